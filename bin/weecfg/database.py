@@ -73,8 +73,8 @@ class DatabaseFix(object):
             A sequence of day TimeSpan objects
         """
 
-        _sql = "SELECT dateTime FROM %s_day_%s "\
-            " WHERE dateTime >= ? AND dateTime <= ?" % (self.dbm.table_name, obs)
+        _sql = "SELECT dateTime FROM %s "\
+            " WHERE dateTime >= ? AND dateTime <= ?" % (self.dbm._day_table_sql(obs),)
 
         _cursor = self.dbm.connection.cursor()
         try:
@@ -95,8 +95,7 @@ class DatabaseFix(object):
             observation. None is returned if no record culd be found.
         """
 
-        _sql_str = "SELECT MIN(dateTime) FROM %s_day_%s" % (self.dbm.table_name,
-                                                            obs_type)
+        _sql_str = "SELECT MIN(dateTime) FROM %s" % (self.dbm._day_table_sql(obs_type),)
         _row = self.dbm.getSql(_sql_str)
         if _row:
             return _row[0]
@@ -324,10 +323,16 @@ class WindSpeedRecalculation(DatabaseFix):
 
         _cursor = cursor or self.dbm.connection.cursor()
 
-        max_update_str = "UPDATE %s_day_%s SET %s=?,%s=? WHERE datetime=?" % (self.dbm.table_name,
-                                                                              obs,
-                                                                              'max',
-                                                                              'maxtime')
+        if self.dbm.day_layout == 'wide':
+            max_update_str = "UPDATE %s SET %s_max=?,%s_maxtime=? WHERE datetime=?" % \
+                (weewx.manager.DaySummaryManager.wide_table_str % self.dbm.table_name,
+                 obs,
+                 obs)
+        else:
+            max_update_str = "UPDATE %s_day_%s SET %s=?,%s=? WHERE datetime=?" % (self.dbm.table_name,
+                                                                                  obs,
+                                                                                  'max',
+                                                                                  'maxtime')
         _cursor.execute(max_update_str, (value, when_ts, row_ts))
         if cursor is None:
             _cursor.close()
@@ -111,8 +111,10 @@ class Connection(object):
         self.database_name = database_name
         self.dbtype = dbtype
 
-    def cursor(self):
-        """Returns an appropriate database cursor."""
+    def cursor(self, streaming=False):
+        """Returns an appropriate database cursor. If streaming is True, the
+        cursor should fetch the rows of a result set as they are asked for,
+        without holding up other queries on the connection."""
         raise NotImplementedError
 
     def execute(self, sql_string, sql_tuple=()):
@@ -154,6 +156,16 @@ class Connection(object):
         """
         raise NotImplemented
     
+    def checkpoint(self, mode='PASSIVE'):
+        """Flush any write-ahead log back into the database. Databases without
+        such a log need do nothing."""
+        pass
+
+    def optimize(self):
+        """Compact the database, and update the statistics used to plan queries.
+        Databases without such maintenance need do nothing."""
+        pass
+
     def begin(self):
         raise NotImplementedError
 
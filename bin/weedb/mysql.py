@@ -8,6 +8,7 @@
 import decimal
 
 import MySQLdb
+import MySQLdb.cursors
 from _mysql_exceptions import DatabaseError, IntegrityError, ProgrammingError, OperationalError
 
 from weeutil.weeutil import to_bool
@@ -101,7 +102,8 @@ class Connection(weedb.Connection):
 
     @guard
     def __init__(self, host='localhost', user='', password='', database_name='',
-                 port=3306, engine=DEFAULT_ENGINE, autocommit=True, **kwargs):
+                 port=3306, engine=DEFAULT_ENGINE, autocommit=True, read_only=False,
+                 check_same_thread=True, in_memory=False, **kwargs):  # @UnusedVariable
         """Initialize an instance of Connection.
 
         Parameters:
@@ -113,27 +115,78 @@ class Connection(weedb.Connection):
             port: Its port number (optional; default is 3306)
             engine: The MySQL database engine to use (optional; default is 'INNODB')
             autocommit: If True, autocommit is enabled (default is True)
+            read_only, check_same_thread, in_memory: Accepted for compatibility with the
+              sqlite driver. They are ignored. Use the MySQL user privileges to restrict access.
             kwargs:   Any extra arguments you may wish to pass on to MySQL 
               connect statement. See the file MySQLdb/connections.py for a list (optional).
         """
-        connection = MySQLdb.connect(host=host, port=int(port), user=user, passwd=password,
-                                     db=database_name, **kwargs)
+        # Keep the arguments, so more connections can be opened for streaming cursors:
+        self.connect_dict = dict(kwargs, host=host, port=int(port), user=user, passwd=password,
+                                 db=database_name)
+        self.engine = engine
+        connection = self._connect()
 
         weedb.Connection.__init__(self, connection, database_name, 'mysql')
 
+        self.is_autocommit = to_bool(autocommit)
+        self.connection.autocommit(self.is_autocommit)
+        # True between begin() and commit() or rollback():
+        self.in_transaction = False
+        # Connections for streaming cursors that are not in use:
+        self.idle_stream_connections = []
+
+    def _connect(self):
+        """Open a MySQLdb connection with the arguments of this connection."""
+        connection = MySQLdb.connect(**self.connect_dict)
+
         # Set the storage engine to be used
-        set_engine(self.connection, engine)
+        set_engine(connection, self.engine)
 
         # Set the transaction isolation level.
-        self.connection.query("SET TRANSACTION ISOLATION LEVEL READ COMMITTED")
-        self.connection.autocommit(to_bool(autocommit))
-
-    def cursor(self):
-        """Return a cursor object."""
+        connection.query("SET TRANSACTION ISOLATION LEVEL READ COMMITTED")
+        return connection
+
+    def cursor(self, streaming=False):
+        """Return a cursor object.
+
+        streaming: If True, the rows of a result set are fetched from the
+        server as they are asked for, rather than all of them at once. This
+        keeps memory use flat for queries over years of data. Because MySQL
+        does not allow another query on a connection until an unbuffered
+        result set has been read to the end, the cursor is given a
+        connection of its own. That connection sees only committed data. So
+        inside a transaction, or if autocommit is off, a regular cursor is
+        returned instead, which sees the changes not yet committed.
+        [Optional. Default is False]"""
         # The implementation of the MySQLdb cursor is lame enough that we are
         # obliged to include a wrapper around it:
+        if streaming and self.is_autocommit and not self.in_transaction:
+            return StreamingCursor(self)
         return Cursor(self)
 
+    @guard
+    def _get_stream_connection(self):
+        """Return an idle connection for a streaming cursor, opening one if
+        there is none. Idle connections may have been closed by the server
+        (see the MySQL variable wait_timeout), so they are checked first."""
+        while self.idle_stream_connections:
+            connection = self.idle_stream_connections.pop()
+            try:
+                connection.ping()
+                return connection
+            except MySQLdb.Error:
+                try:
+                    connection.close()
+                except DatabaseError:
+                    pass
+        connection = self._connect()
+        connection.autocommit(True)
+        return connection
+
+    def _release_stream_connection(self, connection):
+        """Return a connection used by a streaming cursor to the idle list."""
+        self.idle_stream_connections.append(connection)
+
     @guard
     def tables(self):
         """Returns a list of tables in the database."""
@@ -205,18 +258,50 @@ class Connection(weedb.Connection):
         finally:
             cursor.close()
 
+    @guard
+    def optimize(self):
+        """Rebuild the tables, so they are no longer fragmented, and update the
+        statistics used to plan queries."""
+        table_list = self.tables()
+        if not table_list:
+            return
+        cursor = self.connection.cursor()
+        try:
+            # Both statements return a result set with a row for each table, which
+            # has to be read before the next statement:
+            for statement in ("OPTIMIZE TABLE %s", "ANALYZE TABLE %s"):
+                cursor.execute(statement % ', '.join(table_list))
+                cursor.fetchall()
+        finally:
+            cursor.close()
+
     @guard
     def begin(self):
         """Begin a transaction."""
         self.connection.query("START TRANSACTION")
+        self.in_transaction = True
 
     @guard
     def commit(self):
-        self.connection.commit()
+        try:
+            self.connection.commit()
+        finally:
+            self.in_transaction = False
 
     @guard
     def rollback(self):
-        self.connection.rollback()
+        try:
+            self.connection.rollback()
+        finally:
+            self.in_transaction = False
+
+    def close(self):
+        while self.idle_stream_connections:
+            try:
+                self.idle_stream_connections.pop().close()
+            except DatabaseError:
+                pass
+        weedb.Connection.close(self)
 
 
 class Cursor(object):
@@ -250,11 +335,34 @@ class Cursor(object):
 
         return self
 
+    @guard
+    def executemany(self, sql_string, sql_seq):
+        """Execute a SQL statement once for each tuple in a sequence. For an
+        INSERT statement, MySQLdb will combine them into a multi-row INSERT.
+        
+        sql_string: A SQL statement to be executed. It should use ? as
+        a placeholder.
+        
+        sql_seq: A sequence of tuples with the values to be used in the placeholders."""
+
+        # MySQL uses '%s' as placeholders, so replace the ?'s with %s
+        mysql_string = sql_string.replace('?', '%s')
+
+        self.cursor.executemany(mysql_string, [tuple(sql_tuple) for sql_tuple in sql_seq])
+
+        return self
+
     def fetchone(self):
         # Get a result from the MySQL cursor, then run it through the _massage
         # filter below
         return _massage(self.cursor.fetchone())
 
+    def fetchmany(self, size=None):
+        # Get up to 'size' results from the MySQL cursor, then run each of them
+        # through the _massage filter below
+        if size is None: size = self.cursor.arraysize
+        return [_massage(row) for row in self.cursor.fetchmany(size)]
+
     def close(self):
         try:
             self.cursor.close()
@@ -280,6 +388,74 @@ class Cursor(object):
     def __exit__(self, etyp, einst, etb):  # @UnusedVariable
         self.close()
 
+
+class StreamingCursor(Cursor):
+    """A cursor that fetches the rows of a result set from the server as they
+    are asked for. It runs on a connection of its own."""
+
+    @guard
+    def __init__(self, connection):
+        """Initialize a StreamingCursor from a connection.
+
+        connection: An instance of db.mysql.Connection"""
+
+        self.connection = connection
+        self._open()
+
+    def _open(self):
+        self.stream_connection = self.connection._get_stream_connection()
+        self.cursor = self.stream_connection.cursor(MySQLdb.cursors.SSCursor)
+        # True once all the rows of the last result set have been read:
+        self.exhausted = True
+
+    def _discard(self):
+        """Close the connection. It cannot be used again until the rows of
+        the result set have all been read, and reading those left could take
+        a long time."""
+        try:
+            self.stream_connection.close()
+        except DatabaseError:
+            pass
+
+    @guard
+    def execute(self, sql_string, sql_tuple=()):
+        if not self.exhausted:
+            del self.cursor
+            self._discard()
+            self._open()
+        self.exhausted = False
+        return Cursor.execute(self, sql_string, sql_tuple)
+
+    @guard
+    def fetchone(self):
+        row = Cursor.fetchone(self)
+        if row is None:
+            self.exhausted = True
+        return row
+
+    @guard
+    def fetchmany(self, size=None):
+        if size is None: size = self.cursor.arraysize
+        rows = Cursor.fetchmany(self, size)
+        if len(rows) < size:
+            self.exhausted = True
+        return rows
+
+    def close(self):
+        try:
+            cursor = self.cursor
+            del self.cursor
+        except AttributeError:
+            return
+        if self.exhausted:
+            try:
+                cursor.close()
+                self.connection._release_stream_connection(self.stream_connection)
+                return
+            except DatabaseError:
+                pass
+        self._discard()
+
 #
 # This is a utility function for converting a result set that might contain
 # longs or decimal.Decimals (which MySQLdb uses) to something containing just ints.
@@ -6,7 +6,9 @@
 """weedb driver for sqlite"""
 
 from __future__ import with_statement
+import os
 import os.path
+import syslog
 
 # Import sqlite3. If it does not support the 'with' statement, then
 # import pysqlite2, which might...
@@ -84,6 +86,65 @@ def drop(database_name='', SQLITE_ROOT='', driver='', **argv):  # @UnusedVariabl
         else:
             raise weedb.NoDatabaseError("Attempt to drop non-existent database %s" % file_path)
 
+def _available_memory():
+    """The amount of memory, in bytes, that is free to be used, or None if it
+    cannot be told."""
+    try:
+        with open('/proc/meminfo') as meminfo:
+            for line in meminfo:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, ValueError, IndexError):
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+def _file_state(file_path):
+    """The size and modification time of a database file and its write-ahead log."""
+    return tuple((st.st_size, st.st_mtime) for st in
+                 [os.stat(path) for path in (file_path, file_path + '-wal') if os.path.exists(path)])
+
+def _fits_in_memory(file_path):
+    """True if there is enough free memory to hold a copy of the database file."""
+    needed = sum(size for (size, _mtime) in _file_state(file_path))
+    available = _available_memory()
+    if available is not None and needed > available:
+        syslog.syslog(syslog.LOG_INFO, "sqlite: Database %s (%d MB) does not fit in free memory (%d MB). "
+                      "Using the file." % (file_path, needed / 1048576, available / 1048576))
+        return False
+    return True
+
+def _load_into(connection, file_path):
+    """Copy a database file into an empty database. Returns the journal mode
+    of the file."""
+    connection.execute("ATTACH DATABASE ? AS source;", (file_path,))
+    try:
+        journal_mode = str(connection.execute("PRAGMA source.journal_mode;").fetchone()[0]).lower()
+        # Tables go first, then their indexes, then any views and triggers
+        schema_list = connection.execute("SELECT type, name, sql FROM source.sqlite_master "
+                                         "WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%' ORDER BY "
+                                         "CASE type WHEN 'table' THEN 0 WHEN 'index' THEN 1 ELSE 2 END;").fetchall()
+        connection.execute("BEGIN;")
+        for (obj_type, name, sql) in schema_list:
+            connection.execute(sql)
+            if obj_type == 'table':
+                connection.execute('INSERT INTO main."%s" SELECT * FROM source."%s";' % (name, name))
+        if connection.execute("SELECT name FROM source.sqlite_master WHERE name='sqlite_sequence';").fetchone():
+            connection.execute("INSERT INTO main.sqlite_sequence SELECT * FROM source.sqlite_sequence;")
+        connection.execute("COMMIT;")
+    finally:
+        connection.execute("DETACH DATABASE source;")
+    return journal_mode
+
+def _change_count(connection):
+    """A value that differs whenever data or schema have been changed through a
+    connection. Changes to the schema, such as dropping a table, are not counted
+    in total_changes, so the schema version is included as well."""
+    return (connection.total_changes,
+            connection.execute("PRAGMA schema_version;").fetchone()[0])
+
 def _get_filepath(SQLITE_ROOT, database_name, **argv):
     """Utility function to calculate the path to the sqlite database file."""
     # For backwards compatibility, allow the keyword 'root', if 'SQLITE_ROOT' is
@@ -108,6 +169,25 @@ class Connection(weedb.Connection):
               Optional. Default is 5.
             isolation_level: The type of isolation level to use. One of None, 
               DEFERRED, IMMEDIATE, or EXCLUSIVE. Default is None (autocommit mode).
+            journal_mode: The journal mode to use, such as DELETE or WAL. In WAL mode, readers
+              do not block the writer, nor the writer the readers. Optional. Default is
+              to leave the journal mode of the database file unchanged.
+            wal_autocheckpoint: In WAL mode, the number of pages the write-ahead log can
+              hold before it is checkpointed back into the database. Optional. Default
+              is to use the sqlite default (1000 pages).
+            read_only: If True, any attempt to modify the database through this
+              connection will raise weedb.OperationalError. Default is False.
+            check_same_thread: If False, the connection may be used by threads other than
+              the one that made it, although only by one at a time. Default is True.
+            in_memory: If True, the database is copied into memory, and used there. Any
+              changes are copied back to the file when the connection is closed, replacing
+              it in one step. If the database does not fit in the free memory, the file
+              is used as usual. Meant for utilities that go through much of the database.
+              No other program should change the database in the meantime. Default is False.
+            cache_size: The most memory, in kibibytes, to be used to cache pages of the
+              database. Unlike the page size, it is not kept in the database file, so it
+              has to be set for each connection. Optional. Default is to use the sqlite
+              default (2000 KiB).
             
         If the operation fails, an exception of type weedb.OperationalError will be raised.
         """
@@ -117,16 +197,40 @@ class Connection(weedb.Connection):
             raise weedb.NoDatabaseError("Attempt to open a non-existent database %s" % self.file_path)
         timeout = to_int(argv.get('timeout', 5))
         isolation_level = argv.get('isolation_level')
-        connection = sqlite3.connect(self.file_path, timeout=timeout, isolation_level=isolation_level)
-
+        check_same_thread = to_bool(argv.get('check_same_thread', True))
+        read_only = to_bool(argv.get('read_only', False))
+        # The state of the file when it was copied into memory, or None if it is used directly:
+        self.file_state = None
+        if to_bool(argv.get('in_memory', False)) and _fits_in_memory(self.file_path):
+            connection = sqlite3.connect(':memory:', timeout=timeout, isolation_level=isolation_level,
+                                         check_same_thread=check_same_thread)
+            self.file_state = _file_state(self.file_path)
+            self.journal_mode = _load_into(connection, self.file_path)
+            self.loaded_changes = _change_count(connection)
+        else:
+            connection = sqlite3.connect(self.file_path, timeout=timeout, isolation_level=isolation_level,
+                                         check_same_thread=check_same_thread)
+
+            # The journal mode is stored in the database file, so it must be set before
+            # the connection is made read-only.
+            if argv.get('journal_mode'):
+                connection.execute("PRAGMA journal_mode=%s;" % argv['journal_mode'])
+            if argv.get('wal_autocheckpoint') is not None:
+                connection.execute("PRAGMA wal_autocheckpoint=%d;" % to_int(argv['wal_autocheckpoint']))
+        if argv.get('cache_size'):
+            # A negative size is in kibibytes, rather than pages:
+            connection.execute("PRAGMA cache_size=-%d;" % to_int(argv['cache_size']))
         if pragmas is not None:
             for pragma in pragmas:
                 connection.execute("PRAGMA %s=%s;" % (pragma, pragmas[pragma]))
+        if read_only:
+            connection.execute("PRAGMA query_only=ON;")
         weedb.Connection.__init__(self, connection, database_name, 'sqlite')
 
     @guard
-    def cursor(self):
-        """Return a cursor object."""
+    def cursor(self, streaming=False):  # @UnusedVariable
+        """Return a cursor object. SQLite always steps through a result set
+        as the rows are asked for, so streaming makes no difference."""
         return Cursor(self.connection)
 
     @guard
@@ -181,6 +285,48 @@ class Connection(weedb.Connection):
         finally:
             cursor.close()
 
+    @guard
+    def checkpoint(self, mode='PASSIVE'):
+        """Copy the contents of the write-ahead log back into the database.
+
+        mode: One of PASSIVE, FULL, RESTART, or TRUNCATE. A PASSIVE checkpoint never
+          waits on readers. Default is PASSIVE.
+
+        Returns a 3-way tuple (busy, log_pages, checkpointed_pages). If the database
+        is not in WAL mode, the page counts are -1."""
+        return tuple(self.connection.execute("PRAGMA wal_checkpoint(%s);" % mode).fetchone())
+
+    @guard
+    def optimize(self, page_size=4096):
+        """Rebuild the database, so its tables and indexes are no longer fragmented,
+        and update the statistics used to plan queries. No other connection should
+        be open to the database.
+
+        page_size: The smallest size, in bytes, that the pages of the database should
+          have. A database with smaller pages is rebuilt with pages of this size.
+          Older versions of sqlite used pages of 1024 bytes, which take four times
+          as many reads to get the same records. Default is 4096, the size used by
+          sqlite since version 3.12.0."""
+        self.connection.commit()
+        journal_mode = str(self.connection.execute("PRAGMA journal_mode;").fetchone()[0]).lower()
+        new_page_size = page_size and self.connection.execute("PRAGMA page_size;").fetchone()[0] < page_size
+        if new_page_size:
+            # The page size of a database in WAL mode cannot be changed:
+            if journal_mode == 'wal':
+                self.connection.execute("PRAGMA journal_mode=DELETE;")
+            self.connection.execute("PRAGMA page_size=%d;" % page_size)
+        try:
+            self.connection.execute("VACUUM;")
+        finally:
+            if new_page_size and journal_mode == 'wal':
+                self.connection.execute("PRAGMA journal_mode=WAL;")
+        self.connection.execute("ANALYZE;")
+        self.connection.commit()
+        if self.file_state is not None:
+            # None of this is counted as a change, so make sure the copy held in
+            # memory gets saved:
+            self.loaded_changes = None
+
     @guard
     def begin(self):
         self.connection.execute("BEGIN TRANSACTION")
@@ -195,7 +341,40 @@ class Connection(weedb.Connection):
 
     @guard
     def close(self):
-        self.connection.close()
+        try:
+            if self.file_state is not None and _change_count(self.connection) != self.loaded_changes:
+                self._save_to_file()
+        finally:
+            self.connection.close()
+
+    def _save_to_file(self):
+        """Replace the database file with the copy held in memory."""
+        if _file_state(self.file_path) != self.file_state or os.path.exists(self.file_path + '-wal'):
+            raise weedb.OperationalError("Database %s was changed or opened by another program while "
+                                         "held in memory. The changes were not saved." % self.file_path)
+        tmp_path = self.file_path + '.tmp'
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        try:
+            if sqlite3.sqlite_version_info >= (3, 27, 0):
+                self.connection.execute("VACUUM INTO ?", (tmp_path,))
+                target = sqlite3.connect(tmp_path, isolation_level=None)
+            else:
+                # Older versions cannot write a database to a new file, so it has
+                # to be done one statement at a time.
+                target = sqlite3.connect(tmp_path, isolation_level=None)
+                for statement in self.connection.iterdump():
+                    target.execute(statement)
+            try:
+                if self.journal_mode == 'wal':
+                    target.execute("PRAGMA journal_mode=WAL;")
+            finally:
+                target.close()
+            os.rename(tmp_path, self.file_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
 
 
 class Cursor(sqlite3.Cursor):
@@ -210,6 +389,10 @@ class Cursor(sqlite3.Cursor):
     def execute(self, *args, **kwargs):
         return sqlite3.Cursor.execute(self, *args, **kwargs)
 
+    @guard
+    def executemany(self, *args, **kwargs):
+        return sqlite3.Cursor.executemany(self, *args, **kwargs)
+
     @guard
     def fetchone(self):
         return sqlite3.Cursor.fetchone(self)
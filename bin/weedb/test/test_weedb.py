@@ -116,6 +116,47 @@ class Common(unittest.TestCase):
                 _row = _cursor.fetchone()
                 self.assertEqual(_row, None)
             
+    def test_streaming(self):
+        self.populate_db()
+        with weedb.connect(self.db_dict) as _connect:
+            with _connect.cursor(streaming=True) as _cursor:
+                _cursor.execute("SELECT dateTime, min FROM test1 ORDER BY dateTime")
+                for i, _row in enumerate(_cursor):
+                    self.assertEqual(_row[0], i)
+                    # Other queries can be run on the connection while the rows come in:
+                    _connect.execute("INSERT INTO test2 (dateTime, min) VALUES (?, ?)", (i, _row[1]))
+                self.assertEqual(i, 19)
+
+                # Stop part way through, then use the cursor again:
+                _cursor.execute("SELECT dateTime FROM test1 ORDER BY dateTime")
+                self.assertEqual(len(_cursor.fetchmany(5)), 5)
+                _cursor.execute("SELECT COUNT(*) FROM test2")
+                self.assertEqual(_cursor.fetchone()[0], 20)
+
+            # Leave a cursor part way through a result set:
+            with _connect.cursor(streaming=True) as _cursor:
+                _cursor.execute("SELECT dateTime FROM test1")
+                _cursor.fetchone()
+            with _connect.cursor() as _cursor:
+                _cursor.execute("SELECT SUM(min) FROM test2")
+                self.assertEqual(_cursor.fetchone()[0], 1900)
+
+            # Inside a transaction, the rows not yet committed are seen:
+            with weedb.Transaction(_connect) as _cursor:
+                _cursor.execute("DELETE FROM test2 WHERE dateTime < 10")
+                with _connect.cursor(streaming=True) as _stream_cursor:
+                    _stream_cursor.execute("SELECT COUNT(*) FROM test2")
+                    self.assertEqual(_stream_cursor.fetchone()[0], 10)
+
+    def test_optimize(self):
+        self.populate_db()
+        with weedb.connect(self.db_dict) as _connect:
+            _connect.execute("DELETE FROM test1 WHERE dateTime < 10")
+            _connect.optimize()
+            with _connect.cursor() as _cursor:
+                _cursor.execute("SELECT COUNT(*), SUM(min) FROM test1")
+                self.assertEqual(_cursor.fetchone(), (10, 1450))
+
     def test_bad_select(self):
         self.populate_db()
         with weedb.connect(self.db_dict) as _connect:
@@ -194,7 +235,87 @@ class TestSqlite(Common):
             _v = _connect.get_variable('foo')
             self.assertEqual(_v, None)
         _connect.close()
-        
+
+    def test_wal(self):
+        self.populate_db()
+        wal_dict = dict(self.db_dict, journal_mode='WAL', wal_autocheckpoint='100')
+        with weedb.connect(wal_dict) as _writer:
+            self.assertEqual(_writer.get_variable('journal_mode')[1].lower(), 'wal')
+            self.assertEqual(_writer.get_variable('wal_autocheckpoint')[1], 100)
+            with weedb.connect(dict(wal_dict, read_only=True)) as _reader:
+                with _reader.cursor() as _cursor:
+                    # Hold a read transaction open while the writer commits:
+                    _cursor.execute("SELECT dateTime FROM test1")
+                    self.assertEqual(_cursor.fetchone()[0], 0)
+                    with weedb.Transaction(_writer) as _wcursor:
+                        _wcursor.execute("INSERT INTO test1 (dateTime, min, mintime) VALUES (20, 200, 20)")
+                    self.assertEqual(len(_cursor.fetchall()), 19)
+                # The reader sees the new record once its read transaction is over
+                with _reader.cursor() as _cursor:
+                    _cursor.execute("SELECT COUNT(*) FROM test1")
+                    self.assertEqual(_cursor.fetchone()[0], 21)
+                # ... but it cannot change anything
+                self.assertRaises(weedb.OperationalError, _reader.execute,
+                                  "INSERT INTO test1 (dateTime) VALUES (21)")
+            _busy, _log, _checkpointed = _writer.checkpoint('TRUNCATE')
+            self.assertEqual((_busy, _log, _checkpointed), (0, 0, 0))
+
+    def test_page_size(self):
+        self.populate_db()
+        wal_dict = dict(self.db_dict, journal_mode='WAL')
+        with weedb.connect(wal_dict) as _connect:
+            _connect.execute("PRAGMA journal_mode=DELETE;")
+            _connect.execute("PRAGMA page_size=1024;")
+            _connect.execute("VACUUM;")
+            _connect.execute("PRAGMA journal_mode=WAL;")
+            self.assertEqual(_connect.get_variable('page_size'), ('page_size', 1024))
+            # Databases with small pages get rebuilt with bigger ones, but stay in WAL mode:
+            _connect.optimize()
+            self.assertEqual(_connect.get_variable('page_size'), ('page_size', 4096))
+            self.assertEqual(_connect.get_variable('journal_mode'), ('journal_mode', 'wal'))
+            self.assertTrue('sqlite_stat1' in _connect.tables())
+
+    def test_in_memory(self):
+        self.populate_db()
+        with weedb.connect(self.db_dict) as _connect:
+            _connect.execute("CREATE INDEX test1_min ON test1 (min)")
+            _connect.execute("CREATE VIEW test3 AS SELECT dateTime, min FROM test1")
+        memory_dict = dict(self.db_dict, in_memory=True)
+        with weedb.connect(memory_dict) as _connect:
+            self.assertTrue(_connect.file_state is not None)
+            self.assertEqual(sorted(_connect.tables()), ['test1', 'test2'])
+            self.assertEqual(list(_connect.genSchemaOf('test1')), schema)
+            with _connect.cursor() as _cursor:
+                _cursor.execute("SELECT COUNT(*), SUM(min) FROM test3")
+                self.assertEqual(_cursor.fetchone(), (20, 1900.0))
+                _cursor.execute("SELECT name FROM sqlite_master WHERE type='index' AND name='test1_min'")
+                self.assertEqual(_cursor.fetchone()[0], 'test1_min')
+            # Changes are copied back to the file when the connection is closed
+            _connect.execute("INSERT INTO test1 (dateTime, min, mintime) VALUES (20, 200, 20)")
+            with weedb.connect(self.db_dict) as _file_connect:
+                with _file_connect.cursor() as _cursor:
+                    _cursor.execute("SELECT COUNT(*) FROM test1")
+                    self.assertEqual(_cursor.fetchone()[0], 20)
+        with weedb.connect(self.db_dict) as _connect:
+            with _connect.cursor() as _cursor:
+                _cursor.execute("SELECT COUNT(*) FROM test3")
+                self.assertEqual(_cursor.fetchone()[0], 21)
+        # ... unless another connection has changed the file in the meantime
+        _connect = weedb.connect(memory_dict)
+        _connect.execute("DELETE FROM test1")
+        with weedb.connect(self.db_dict) as _file_connect:
+            _file_connect.execute("DELETE FROM test2")
+        self.assertRaises(weedb.OperationalError, _connect.close)
+        with weedb.connect(self.db_dict) as _connect:
+            with _connect.cursor() as _cursor:
+                _cursor.execute("SELECT COUNT(*) FROM test1")
+                self.assertEqual(_cursor.fetchone()[0], 21)
+        # Changes only to the schema are copied back as well:
+        with weedb.connect(memory_dict) as _connect:
+            _connect.execute("DROP TABLE test2")
+        with weedb.connect(self.db_dict) as _connect:
+            self.assertEqual(sorted(_connect.tables()), ['test1'])
+
 class TestMySQL(Common):
     
     def __init__(self, *args, **kwargs):
@@ -211,9 +332,10 @@ class TestMySQL(Common):
     
 def suite():
     tests = ['test_drop', 'test_double_create', 'test_no_db', 'test_no_tables', 
-             'test_create', 'test_bad_table', 'test_select', 'test_bad_select',
+             'test_create', 'test_bad_table', 'test_select', 'test_streaming', 'test_optimize', 'test_bad_select',
              'test_rollback', 'test_transaction', 'test_variable']
-    return unittest.TestSuite(map(TestSqlite, tests) + map(TestMySQL, tests))
+    return unittest.TestSuite(map(TestSqlite, tests + ['test_wal', 'test_in_memory', 'test_page_size']) +
+                              map(TestMySQL, tests))
 
 if __name__ == '__main__':
     unittest.TextTestRunner(verbosity=2).run(suite())
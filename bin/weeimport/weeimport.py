@@ -27,7 +27,7 @@ import weewx
 import weewx.qc
 import weewx.wxservices
 
-from weewx.manager import open_manager_with_config
+from weewx.manager import open_manager_with_config, set_in_memory
 from weewx.units import unit_constants, unit_nicknames, convertStd, to_std_system, ValueTuple
 from weeutil.weeutil import timestamp_to_string, option_as_list, to_int, tobool, _get_object
 
@@ -143,6 +143,8 @@ class Source(object):
 
         # get some weeWX database info
         self.db_binding_wx = get_binding(config_dict)
+        if options.in_memory:
+            set_in_memory(config_dict, self.db_binding_wx)
         self.dbm = open_manager_with_config(config_dict, self.db_binding_wx,
                                             initialize=True,
                                             default_binding_dict={'table_name': 'archive',
@@ -31,6 +31,8 @@ class ScalarStats(object):
         self.setStats(stats_tuple)
         self.last     = None
         self.lasttime = None
+        # An instance of QuantileSketch, if one is kept. See Accum.add_sketch().
+        self.sketch   = None
          
     def setStats(self, stats_tuple=None):
         (self.min, self.mintime,
@@ -65,6 +67,8 @@ class ScalarStats(object):
         self.count   += x_stats.count
         self.wsum    += x_stats.wsum
         self.sumtime += x_stats.sumtime
+        if self.sketch is not None and getattr(x_stats, 'sketch', None) is not None:
+            self.sketch.merge(x_stats.sketch)
 
     def addHiLo(self, val, ts):
         """Include a scalar value in my highs and lows.
@@ -89,6 +93,8 @@ class ScalarStats(object):
             self.count   += 1
             self.wsum    += val * weight
             self.sumtime += weight
+            if self.sketch is not None:
+                self.sketch.add(val)
         
     @property
     def avg(self):
@@ -107,6 +113,8 @@ class VecStats(object):
         self.setStats(stats_tuple)
         self.last     = (None, None)
         self.lasttime = None
+        # An instance of WindRose, if one is kept. See Accum.add_sketch().
+        self.sketch   = None
  
     def setStats(self, stats_tuple=None):
         (self.min, self.mintime,
@@ -153,6 +161,8 @@ class VecStats(object):
         self.dirsumtime += x_stats.dirsumtime
         self.squaresum  += x_stats.squaresum
         self.wsquaresum += x_stats.wsquaresum
+        if self.sketch is not None and getattr(x_stats, 'sketch', None) is not None:
+            self.sketch.merge(x_stats.sketch)
          
     def addHiLo(self, val, ts):
         """Include a vector value in my highs and lows.
@@ -188,6 +198,8 @@ class VecStats(object):
                 self.xsum += weight * speed * math.cos(math.radians(90.0 - dirN))
                 self.ysum += weight * speed * math.sin(math.radians(90.0 - dirN))
                 self.dirsumtime += weight
+            if self.sketch is not None:
+                self.sketch.add(val)
              
     @property
     def avg(self):
@@ -212,6 +224,153 @@ class VecStats(object):
         # Return the last known direction when our vector sum is 0
         return self.last[1]
 
+#===============================================================================
+#                             QuantileSketch
+#===============================================================================
+
+class QuantileSketch(object):
+    """A histogram of values, from which quantiles such as the median can be found.
+    
+    Each bin holds the values that are the same when rounded to a fixed number of
+    significant digits. The bins do not depend on the data, so the sketches of
+    different periods can be merged by adding up their counts. A quantile is
+    exact, to within the rounding."""
+
+    # The number of significant digits kept:
+    digits = 4
+
+    def __init__(self, counts=None):
+        # Key is a rounded value, value is the number of values that round to it:
+        self.counts = counts if counts is not None else {}
+
+    def add(self, val, count=1):
+        """Add a value to the histogram."""
+        if val is not None:
+            if val:
+                val = round(val, QuantileSketch.digits - 1 - int(math.floor(math.log10(abs(val)))))
+            self.counts[val] = self.counts.get(val, 0) + count
+
+    def merge(self, x_sketch):
+        """Merge the counts of another sketch into myself."""
+        for (val, count) in x_sketch.counts.iteritems():
+            self.counts[val] = self.counts.get(val, 0) + count
+
+    @property
+    def count(self):
+        return sum(self.counts.itervalues())
+
+    def quantile(self, q):
+        """Return the smallest value such that a fraction q of all values are
+        less than or equal to it (the "nearest rank" method). For example, q=0.5
+        returns the median. Returns None if there are no values."""
+        total = self.count
+        if not total:
+            return None
+        # The rank of the value, allowing for rounding of q * total:
+        rank = max(int(math.ceil(q * total - 1.0e-9)), 1)
+        running = 0
+        for val in sorted(self.counts):
+            running += self.counts[val]
+            if running >= rank:
+                return val
+
+    def to_string(self):
+        """Return the sketch as a string, in the form 'val:count,val:count,...'"""
+        return ','.join(["%r:%d" % (val, self.counts[val]) for val in sorted(self.counts)])
+
+    @staticmethod
+    def from_string(sketch_str):
+        """Return a sketch, given a string made by to_string()."""
+        counts = {}
+        if sketch_str:
+            for item in sketch_str.split(','):
+                (val, count) = item.split(':')
+                counts[float(val)] = int(count)
+        return QuantileSketch(counts)
+
+#===============================================================================
+#                             WindRose
+#===============================================================================
+
+class WindRose(object):
+    """A histogram of vector values by direction and speed, from which a wind rose
+    can be drawn.
+    
+    Directions are put in one of 'sectors' sectors, the first centered on north.
+    Speeds are put in bins 'speed_step' wide. Values with no speed, or no direction,
+    are counted as calm. Like a QuantileSketch, the bins are fixed, so the roses
+    of different periods can be merged by adding up their counts."""
+
+    # The number of direction sectors:
+    sectors = 16
+    # The width of the speed bins, in the units of the values:
+    speed_step = 1.0
+
+    def __init__(self, counts=None, calm=0):
+        # Key is a tuple (sector, speed bin), value is the number of values in it:
+        self.counts = counts if counts is not None else {}
+        self.calm = calm
+
+    def add(self, val, count=1):
+        """Add a vector value to the histogram. It is a 2-way tuple (mag, dir)."""
+        speed, dirN = val
+        if speed is None:
+            return
+        if not speed or dirN is None:
+            self.calm += count
+        else:
+            width = 360.0 / WindRose.sectors
+            key = (int((dirN + width / 2.0) % 360.0 // width), int(math.floor(speed / WindRose.speed_step)))
+            self.counts[key] = self.counts.get(key, 0) + count
+
+    def merge(self, x_rose):
+        """Merge the counts of another rose into myself."""
+        for (key, count) in x_rose.counts.iteritems():
+            self.counts[key] = self.counts.get(key, 0) + count
+        self.calm += x_rose.calm
+
+    @property
+    def count(self):
+        return self.calm + sum(self.counts.itervalues())
+
+    def frequencies(self, lo=None, hi=None):
+        """Return a list with the percentage of all values, calms included, that
+        fall in each sector, starting with north. If lo or hi are given, only speeds
+        at least lo, and less than hi, are counted. A speed is taken to be the
+        lower edge of its bin. Returns None if there are no values."""
+        total = self.count
+        if not total:
+            return None
+        freq = [0.0] * WindRose.sectors
+        for ((sector, speed_bin), count) in self.counts.iteritems():
+            speed = speed_bin * WindRose.speed_step
+            if (lo is None or speed >= lo) and (hi is None or speed < hi):
+                freq[sector] += 100.0 * count / total
+        return freq
+
+    @property
+    def calm_frequency(self):
+        """The percentage of all values that are calm, or None if there are none."""
+        total = self.count
+        return 100.0 * self.calm / total if total else None
+
+    def to_string(self):
+        """Return the rose as a string, in the form 'calm;sector:bin:count,...'"""
+        return "%d;%s" % (self.calm, ','.join(["%d:%d:%d" % (key + (self.counts[key],))
+                                               for key in sorted(self.counts)]))
+
+    @staticmethod
+    def from_string(rose_str):
+        """Return a rose, given a string made by to_string()."""
+        counts = {}
+        calm = 0
+        if rose_str:
+            (calm, items) = rose_str.split(';')
+            for item in items.split(',') if items else []:
+                (sector, speed_bin, count) = item.split(':')
+                counts[(int(sector), int(speed_bin))] = int(count)
+        return WindRose(counts, int(calm))
+
 #===============================================================================
 #                             Class Accum
 #===============================================================================
@@ -286,6 +445,13 @@ class Accum(dict):
         self._init_type(obs_type)
         self[obs_type].setStats(stats_tuple)
 
+    def add_sketch(self, obs_type, sketch=None):
+        """Keep a sketch of the values of a type, starting with sketch if given.
+        It is found in attribute 'sketch' of the statistics. See new_sketch()."""
+
+        self._init_type(obs_type)
+        self[obs_type].sketch = sketch if sketch is not None else new_sketch(obs_type)
+
     #
     # Begin add functions. These add a record to the accumulator.
     #
@@ -548,6 +714,18 @@ def new_accumulator(obs_type):
         initialize(defaults)
     return accum_type_dict.get(obs_type, ScalarStats)()
 
+def new_sketch(obs_type, sketch_str=None):
+    """Return a sketch for a type: a WindRose for vector types such as 'wind',
+    otherwise a QuantileSketch. If given, it starts with the counts in sketch_str,
+    made by its method to_string()."""
+    global accum_type_dict
+    # If the dictionaries have not been initialized, do so with the defaults
+    if accum_type_dict is None:
+        initialize(defaults)
+    if accum_type_dict.get(obs_type, ScalarStats) is VecStats:
+        return WindRose.from_string(sketch_str)
+    return QuantileSketch.from_string(sketch_str)
+
 def get_add_function(obs_type):
     global add_dict
     # If the dictionaries have not been initialized, do so with the defaults
@@ -11,12 +11,14 @@ import gc
 import locale
 import os.path
 import platform
+import Queue
 import signal
 import socket
 import sys
 import syslog
 import time
 import thread
+import threading
 
 # 3rd party imports:
 import configobj
@@ -113,7 +115,8 @@ class StdEngine(object):
     def preLoadServices(self, config_dict):
         
         self.stn_info = weewx.station.StationInfo(self.console, **config_dict['Station'])
-        self.db_binder = weewx.manager.DBBinder(config_dict)
+        # The managers of the engine stay open as long as it runs:
+        self.db_binder = weewx.manager.DBBinder(config_dict, persistent=True)
         
     def loadServices(self, config_dict):
         """Set up the services to be run."""
@@ -446,6 +449,8 @@ class StdArchive(StdService):
             software_interval = to_int(config_dict['StdArchive'].get('archive_interval', 300))
             self.loop_hilo = to_bool(config_dict['StdArchive'].get('loop_hilo', True))
             self.record_augmentation = to_bool(config_dict['StdArchive'].get('record_augmentation', True))
+            self.backfill_processes = to_int(config_dict['StdArchive'].get('backfill_processes', 1))
+            self.write_queue_size = to_int(config_dict['StdArchive'].get('write_queue_size', 0))
         else:
             self.data_binding = 'wx_binding'
             self.record_generation = 'hardware'
@@ -453,6 +458,8 @@ class StdArchive(StdService):
             software_interval = 300
             self.loop_hilo = True
             self.record_augmentation = True
+            self.backfill_processes = 1
+            self.write_queue_size = 0
             
         syslog.syslog(syslog.LOG_INFO, "engine: Archive will use data binding %s" % self.data_binding)
         
@@ -492,6 +499,13 @@ class StdArchive(StdService):
         weewx.accum.initialize(config_dict)
         self.old_accumulator = None
 
+        # If requested, write the records from a thread of their own:
+        if self.write_queue_size > 0:
+            self.writer = ArchiveWriter(config_dict, self.data_binding, self.write_queue_size)
+            self.writer.start()
+        else:
+            self.writer = None
+
         self.bind(weewx.STARTUP, self.startup)
         self.bind(weewx.PRE_LOOP, self.pre_loop)
         self.bind(weewx.POST_LOOP, self.post_loop)
@@ -573,6 +587,12 @@ class StdArchive(StdService):
 
         # Set the time of the next break loop:
         self.end_archive_delay_ts = self.end_archive_period_ts + self.archive_delay
+
+        # The reports run after this. Make sure they see the new records. So
+        # must the engine's own manager, which did not add them:
+        if self.writer is not None:
+            self.writer.flush()
+            self.engine.db_binder.get_manager(self.data_binding).refresh()
         
     def new_archive_record(self, event):
         """Called when a new archive record has arrived. 
@@ -584,8 +604,19 @@ class StdArchive(StdService):
                 and event.record['dateTime'] == self.old_accumulator.timespan.stop:
             self.old_accumulator.augmentRecord(event.record)
 
-        dbmanager = self.engine.db_binder.get_manager(self.data_binding)
-        dbmanager.addRecord(event.record, accumulator=self.old_accumulator)
+        if self.writer is not None:
+            # Other services may go on to change the record, so queue a copy of it.
+            self.writer.put(dict(event.record), self.old_accumulator)
+        else:
+            dbmanager = self.engine.db_binder.get_manager(self.data_binding)
+            dbmanager.addRecord(event.record, accumulator=self.old_accumulator)
+
+    def shutDown(self):
+        """Write any records still waiting in the queue."""
+        if self.writer is not None:
+            writer = self.writer
+            self.writer = None
+            writer.close()
 
     def setup_database(self, config_dict):  # @UnusedVariable
         """Setup the main database archive"""
@@ -601,7 +632,7 @@ class StdArchive(StdService):
                                              "Finish the update first." % dbmanager.database_name)
         
         # Back fill the daily summaries.
-        _nrecs, _ndays = dbmanager.backfill_day_summary() # @UnusedVariable
+        _nrecs, _ndays = dbmanager.backfill_day_summary(processes=self.backfill_processes) # @UnusedVariable
         
     def _catchup(self, generator):
         """Pull any unarchived records off the console and archive them.
@@ -610,8 +641,11 @@ class StdArchive(StdService):
         type NotImplementedError will be thrown.""" 
 
         dbmanager = self.engine.db_binder.get_manager(self.data_binding)
-        # Find out when the database was last updated.
+        # Find out when the database was last updated. Records still waiting
+        # to be written count as well.
         lastgood_ts = dbmanager.lastGoodStamp()
+        if self.writer is not None:
+            lastgood_ts = weeutil.weeutil.max_with_none([lastgood_ts, self.writer.last_ts])
 
         try:
             # Now ask the console for any new records since then.
@@ -641,6 +675,159 @@ class StdArchive(StdService):
         new_accumulator = weewx.accum.Accum(weeutil.weeutil.TimeSpan(start_ts, end_ts))
         return new_accumulator
     
+#==============================================================================
+#                    Class ArchiveWriter
+#==============================================================================
+
+class ArchiveWriter(threading.Thread):
+    """Adds archive records to the database from a thread of its own, so the
+    main loop need not wait on the database.
+
+    Records wait in a queue of limited size. The writer takes all that are
+    waiting, and adds them, along with the updates of the daily summaries, in
+    a single transaction. Records are added in the order they were queued,
+    each with the accumulator of its archive period.
+
+    If the queue is full, put() waits for room. flush() waits until the
+    records queued so far are in the database. If the writer cannot add the
+    records, even after trying again, it stops. The error is raised again by
+    the next put(), flush(), or close()."""
+
+    def __init__(self, config_dict, data_binding, queue_size=100, max_tries=3, retry_wait=5):
+        """Initialize an instance of ArchiveWriter.
+
+        config_dict: The configuration dictionary.
+
+        data_binding: The binding of the database to be written to.
+
+        queue_size: The most records that can wait to be written.
+
+        max_tries: How many times to try adding a group of records before
+        giving up.
+
+        retry_wait: How long to wait, in seconds, before trying again."""
+        threading.Thread.__init__(self, name="ArchiveWriter")
+        self.setDaemon(True)
+        self.config_dict = config_dict
+        self.data_binding = data_binding
+        self.max_tries = max_tries
+        self.retry_wait = retry_wait
+        self.queue = Queue.Queue(queue_size)
+        # The time of the most recent record queued:
+        self.last_ts = None
+        # How many records have been queued. Along with nrecs, this tells flush()
+        # when the queue has been written out:
+        self.nqueued = 0
+        self.written = threading.Condition()
+        # Set if the writer had to stop:
+        self.error = None
+        # Statistics:
+        self.nrecs = 0
+        self.ncommits = 0
+        self.write_time = 0.0
+        self.max_depth = 0
+        self.nwaits = 0
+
+    def put(self, record, accumulator=None):
+        """Queue a record to be added to the database, along with the
+        accumulator of its archive period, if any."""
+        self._check_error()
+        try:
+            self.queue.put_nowait((record, accumulator))
+        except Queue.Full:
+            self.nwaits += 1
+            syslog.syslog(syslog.LOG_INFO, "engine: Archive writer is behind. Waiting for room in the queue.")
+            while True:
+                try:
+                    self.queue.put((record, accumulator), True, self.retry_wait)
+                    break
+                except Queue.Full:
+                    self._check_error()
+        self.nqueued += 1
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+        self.last_ts = weeutil.weeutil.max_with_none([self.last_ts, record['dateTime']])
+
+    def flush(self):
+        """Wait until all the records queued so far have been added to the
+        database."""
+        _nqueued = self.nqueued
+        with self.written:
+            while self.nrecs < _nqueued and self.error is None and self.isAlive():
+                # Wait with a timeout, so signals still get through:
+                self.written.wait(1.0)
+        self._check_error()
+
+    def close(self):
+        """Write all the records in the queue, then stop the writer."""
+        if self.isAlive():
+            self.queue.put(None)
+            self.join()
+        syslog.syslog(syslog.LOG_INFO, "engine: Archive writer added %d records in %d transactions, "
+                      "taking %.2f seconds. Most waiting: %d. Waits for room: %d."
+                      % (self.nrecs, self.ncommits, self.write_time, self.max_depth, self.nwaits))
+        self._check_error()
+
+    def run(self):
+        dbmanager = None
+        try:
+            while True:
+                # Wait for a record, then take any others waiting along with it:
+                _item_list = [self.queue.get()]
+                while _item_list[-1] is not None:
+                    try:
+                        _item_list.append(self.queue.get_nowait())
+                    except Queue.Empty:
+                        break
+                _done = _item_list[-1] is None
+                if _done:
+                    del _item_list[-1]
+                if _item_list:
+                    dbmanager = self._write(dbmanager, _item_list)
+                if _done:
+                    break
+        except Exception, e:
+            syslog.syslog(syslog.LOG_CRIT, "engine: Archive writer stopped: %s" % e)
+            with self.written:
+                self.error = e
+                self.written.notifyAll()
+        finally:
+            if dbmanager is not None:
+                dbmanager.close()
+
+    def _write(self, dbmanager, item_list):
+        """Add a group of records to the database, trying again if it fails.
+        A manager is opened, or opened again, as needed. Returns the manager."""
+        for _count in range(self.max_tries):
+            try:
+                if dbmanager is None:
+                    dbmanager = weewx.manager.open_manager_with_config(self.config_dict, self.data_binding)
+                t0 = time.time()
+                dbmanager.addRecord([_record for (_record, _accumulator) in item_list],
+                                    accumulator=[_accumulator for (_record, _accumulator) in item_list])
+                self.write_time += time.time() - t0
+                with self.written:
+                    self.nrecs += len(item_list)
+                    self.written.notifyAll()
+                self.ncommits += 1
+                return dbmanager
+            except weedb.OperationalError, e:
+                _error = e
+                syslog.syslog(syslog.LOG_ERR, "engine: Archive writer unable to add %d records: %s"
+                              % (len(item_list), e))
+                if dbmanager is not None:
+                    try:
+                        dbmanager.close()
+                    except weedb.DatabaseError:
+                        pass
+                    dbmanager = None
+                if _count < self.max_tries - 1:
+                    time.sleep(self.retry_wait)
+        raise _error
+
+    def _check_error(self):
+        if self.error is not None:
+            raise self.error
+
 #==============================================================================
 #                    Class StdTimeSynch
 #==============================================================================
@@ -724,6 +911,9 @@ class StdReport(StdService):
     def __init__(self, engine, config_dict):
         super(StdReport, self).__init__(engine, config_dict)
         self.max_wait = int(config_dict['StdReport'].get('max_wait', 600))
+        # Keep the database connections of the reports open from one run to the next:
+        pool_size = to_int(config_dict['StdReport'].get('database_pool_size', 0))
+        self.manager_pool = weewx.manager.ManagerPool(config_dict, pool_size) if pool_size else None
         self.thread = None
         self.launch_time = None
         self.record = None
@@ -757,7 +947,8 @@ class StdReport(StdService):
             self.thread = weewx.reportengine.StdReportEngine(self.config_dict,
                                                              self.engine.stn_info,
                                                              self.record,
-                                                             first_run=not self.launch_time)
+                                                             first_run=not self.launch_time,
+                                                             manager_pool=self.manager_pool)
             self.thread.start()
             self.launch_time = time.time()
         except thread.error:
@@ -774,6 +965,9 @@ class StdReport(StdService):
                 syslog.syslog(syslog.LOG_DEBUG, "engine: StdReport thread has been terminated")
         self.thread = None
         self.launch_time = None
+        if self.manager_pool is not None:
+            self.manager_pool.close()
+            self.manager_pool = None
 
 #==============================================================================
 #                       Signal handler
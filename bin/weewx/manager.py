@@ -5,10 +5,23 @@
 #
 """Classes and functions for interfacing with a weewx archive."""
 from __future__ import with_statement
+import array
+import bisect
+import collections
+import functools
+import itertools
+import json
 import math
+import mmap
+import multiprocessing
+import os
+import re
+import signal
+import struct
 import syslog
 import sys
 import datetime
+import threading
 import time
 
 import weewx.accum
@@ -16,7 +29,44 @@ from weewx.units import ValueTuple
 import weewx.units
 import weeutil.weeutil
 import weedb
-from weeutil.weeutil import timestamp_to_string, isMidnight, to_int
+from weeutil.weeutil import timestamp_to_string, isMidnight, to_int, tobool
+
+# If the user has installed numpy, use it to speed up aggregation of the
+# wind vector types. Otherwise, fall back to pure Python:
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+def _cache_aggregate(getAggregate):
+    """Decorator for the versions of getAggregate() of the managers, which looks up
+    the result in the aggregate cache of the manager, if it has one. Only the first
+    decorated version in the method resolution order of the manager uses the cache.
+    Calls it makes to the version of a superclass, or calls made directly to a
+    specific version, such as Manager.getAggregate(self, ...), do not, because
+    their results can differ."""
+
+    @functools.wraps(getAggregate)
+    def cached_getAggregate(self, timespan, obs_type, aggregate_type, **option_dict):
+        if self.aggregate_cache is None or _first_cached_version(type(self)) is not cached_getAggregate:
+            return getAggregate(self, timespan, obs_type, aggregate_type, **option_dict)
+        (_key, _result) = self._lookup_aggregate(timespan, obs_type, aggregate_type, option_dict)
+        if _result is None:
+            _result = getAggregate(self, timespan, obs_type, aggregate_type, **option_dict)
+            self._save_aggregate(_key, timespan, _result)
+        return _result
+
+    cached_getAggregate.uses_aggregate_cache = True
+    return cached_getAggregate
+
+def _first_cached_version(cls):
+    """Return the first version of getAggregate() decorated by _cache_aggregate()
+    in the method resolution order of class cls."""
+    for _cls in cls.__mro__:
+        _getAggregate = _cls.__dict__.get('getAggregate')
+        if getattr(_getAggregate, 'uses_aggregate_cache', False):
+            return _getAggregate
+    return None
 
 #==============================================================================
 #                         class Manager
@@ -48,7 +98,19 @@ class Manager(object):
     
     first_timestamp: The timestamp of the earliest record in the table.
     
-    last_timestamp: The timestamp of the last record in the table."""
+    last_timestamp: The timestamp of the last record in the table.
+    
+    aggregate_cache: An instance of AggregateCache holding the results of
+    getAggregate(), or None if they are not cached. See enable_aggregate_cache().
+
+    hot_window: An instance of HotWindow holding the most recent records, or
+    None if they are not held in memory. See enable_hot_window().
+
+    snapshot: An instance of ArchiveSnapshot with a read-only copy of the
+    records, or None if there is none. See attach_snapshot().
+
+    partitions: If the archive is split into a table per year, a list of the
+    years, oldest first. Otherwise, an empty list. See partition_archive()."""
     
     def __init__(self, connection, table_name='archive', schema=None):
         """Initialize an object of type Manager.
@@ -66,6 +128,13 @@ class Manager(object):
 
         self.connection = connection
         self.table_name = table_name
+        self._insert_stmt_cache = {}
+        # The database dictionary is known only if opened with open() or open_with_create()
+        self.database_dict = None
+        self.aggregate_cache = None
+        self.hot_window = None
+        self.snapshot = None
+        self._init_partitions()
 
         # Now get the SQL types. 
         try:
@@ -102,6 +171,7 @@ class Manager(object):
 
         # Create an instance of the right class and return it:
         dbmanager = cls(connection, table_name)
+        dbmanager.database_dict = database_dict
         return dbmanager
     
     @classmethod
@@ -138,6 +208,7 @@ class Manager(object):
 
         # Create an instance of the right class and return it:
         dbmanager = cls(connection, table_name=table_name, schema=schema)
+        dbmanager.database_dict = database_dict
         return dbmanager
     
     @property
@@ -150,6 +221,14 @@ class Manager(object):
         return [obs_type for obs_type in self.sqlkeys if obs_type not in ['dateTime', 'usUnits', 'interval']]
     
     def close(self):
+        if self.aggregate_cache is not None:
+            syslog.syslog(syslog.LOG_DEBUG, "manager: Aggregate cache for '%s': %d hits, %d misses"
+                          % (self.database_name, self.aggregate_cache.hits, self.aggregate_cache.misses))
+            self.aggregate_cache = None
+        self.hot_window = None
+        if self.snapshot is not None:
+            self.snapshot.close()
+            self.snapshot = None
         self.connection.close()
         del self.sqlkeys
         del self.first_timestamp
@@ -203,16 +282,52 @@ class Manager(object):
         
         returns: Time of the last good archive record as an epoch time, or
         None if there are no records."""
-        _row = self.getSql("SELECT MAX(dateTime) FROM %s" % self.table_name)
-        return _row[0] if _row else None
+        for _table in reversed(self._archive_tables()):
+            _row = self.getSql("SELECT MAX(dateTime) FROM %s" % _table)
+            if _row and _row[0] is not None:
+                return _row[0]
+        return None
     
     def firstGoodStamp(self):
         """Retrieves earliest timestamp in the archive.
         
         returns: Time of the first good archive record as an epoch time, or
         None if there are no records."""
-        _row = self.getSql("SELECT MIN(dateTime) FROM %s" % self.table_name)
-        return _row[0] if _row else None
+        for _table in self._archive_tables():
+            _row = self.getSql("SELECT MIN(dateTime) FROM %s" % _table)
+            if _row and _row[0] is not None:
+                return _row[0]
+        return None
+
+    def refresh(self):
+        """Catch up with any changes made to the table through other connections.
+        Records added later than the last known record are picked up by the hot
+        window. If records have gone missing, or were added before the first, the
+        caches are rebuilt.
+
+        Raises an exception of type weedb.DatabaseError if the database can no
+        longer be reached."""
+        _first_ts = self.first_timestamp
+        _last_ts = self.last_timestamp
+        self._sync()
+        if self.first_timestamp == _first_ts and self.last_timestamp == _last_ts:
+            return
+        _appended = _first_ts == self.first_timestamp and _last_ts is not None \
+            and self.last_timestamp > _last_ts
+        if self.aggregate_cache is not None and not _appended:
+            self.aggregate_cache.clear()
+        if self.hot_window is not None:
+            if _appended:
+                _columns = self.hot_window.columns
+                self.hot_window.add_records([dict(zip(_columns, _row)) for _row in
+                                            self.genSql("SELECT %s FROM %s WHERE dateTime > ? ORDER BY dateTime ASC"
+                                                        % (','.join(["`%s`" % _column for _column in _columns]),
+                                                           self._archive_table_sql(_last_ts)), (_last_ts,))])
+            else:
+                self.enable_hot_window(self.hot_window.days, self.hot_window.max_size)
+
+    # The maximum number of records to be inserted with a single statement:
+    insert_batch_size = 500
 
     def addRecord(self, record_obj, log_level=syslog.LOG_NOTICE, accumulator=None):
         """Commit a single record or a collection of records to the archive.
@@ -223,43 +338,94 @@ class Manager(object):
         database.
         
         log_level: What syslog level to use for any logging. Default is syslog.LOG_NOTICE.
+        
+        accumulator: An accumulator holding the highs and lows seen in the LOOP
+        packets, or a list of them. Each is used for the record whose time
+        matches the end of its time span. Optional.
+        
+        Consecutive records with the same set of keys are inserted as a batch, using
+        a single prepared statement.
         """
         
         # Determine if record_obj is just a single dictionary instance
         # (in which case it will have method 'keys'). If so, wrap it in
         # something iterable (a list):
         record_list = [record_obj] if hasattr(record_obj, 'keys') else record_obj
-        
-        min_ts = None
-        max_ts = 0
-        with weedb.Transaction(self.connection) as cursor:
 
-            for record in record_list:
-                try:
-                    # If the accumulator time matches the record we are working with,
-                    # use it to update the highs and lows.
-                    if accumulator and record_obj['dateTime'] == accumulator.timespan.stop:
-                        self._updateHiLo(accumulator, cursor)
+        # Making a partition takes DDL, which MySQL commits on the spot. So make
+        # any that are missing before the records go in, in a transaction of their own:
+        if self.partitions:
+            record_list = list(record_list)
+            self._add_partitions(set(_partition_year(record['dateTime']) for record in record_list
+                                     if record['dateTime'] is not None) - set(self.partitions))
 
-                    # Then add the record to the archives:
-                    self._addSingleRecord(record, cursor, log_level)
+        min_ts = None
+        max_ts = None
+        # The records that go in the hot window, once the transaction succeeds:
+        window_list = []
+        with weedb.Transaction(self.connection) as cursor:
 
+            for batch in self._genRecordBatches(record_list, cursor, accumulator):
+                for record in self._addRecordBatch(batch, cursor, log_level):
                     min_ts = min(min_ts, record['dateTime']) if min_ts is not None else record['dateTime']
                     max_ts = max(max_ts, record['dateTime'])
-                except (weedb.IntegrityError, weedb.OperationalError), e:
-                    syslog.syslog(syslog.LOG_ERR, "manager: "
-                                  "Unable to add record %s to database '%s': %s" %
-                                  (weeutil.weeutil.timestamp_to_string(record['dateTime']), 
-                                   self.database_name, e))
+                    if self.hot_window is not None and self.hot_window.covers(record['dateTime'], True):
+                        window_list.append(record)
 
         # Update the cached timestamps. This has to sit outside the
         # transaction context, in case an exception occurs.
-        self.first_timestamp = min(min_ts, self.first_timestamp)
-        self.last_timestamp  = max(max_ts, self.last_timestamp)
+        if min_ts is not None:
+            self.first_timestamp = weeutil.weeutil.min_with_none([min_ts, self.first_timestamp])
+            self.last_timestamp  = weeutil.weeutil.max_with_none([max_ts, self.last_timestamp])
+            self._invalidate_aggregates(min_ts, max_ts)
+        if window_list:
+            self.hot_window.add_records(window_list)
+
+    def _genRecordBatches(self, record_list, cursor, accumulator=None):
+        """Generator function that breaks a sequence of records up into batches
+        of consecutive records with the same keys.
         
-    def _addSingleRecord(self, record, cursor, log_level):
-        """Internal function for adding a single record to the database."""
+        If the timestamp of a record matches an accumulator, the accumulator is
+        used to update the highs and lows, but only after all earlier records
+        have been yielded (and, presumably, added to the database).
         
+        yields: Lists of records, no longer than insert_batch_size."""
+
+        accumulator_list = accumulator if isinstance(accumulator, (list, tuple)) else [accumulator]
+        accumulators = dict((_accum.timespan.stop, _accum) for _accum in accumulator_list if _accum)
+        batch = []
+        batch_keys = None
+        for record in record_list:
+            # If the accumulator time matches the record we are working with,
+            # use it to update the highs and lows.
+            if record['dateTime'] in accumulators:
+                if batch:
+                    yield batch
+                    batch = []
+                try:
+                    self._updateHiLo(accumulators[record['dateTime']], cursor)
+                except (weedb.IntegrityError, weedb.OperationalError), e:
+                    syslog.syslog(syslog.LOG_ERR, "manager: "
+                                  "Unable to update highs and lows for record %s in database '%s': %s" %
+                                  (weeutil.weeutil.timestamp_to_string(record['dateTime']), 
+                                   self.database_name, e))
+
+            self._check_record(record)
+
+            # A batch can only hold records with the same keys, going in the same partition:
+            record_keys = (frozenset(record), _partition_year(record['dateTime']) if self.partitions else None)
+            if batch and (record_keys != batch_keys or len(batch) >= self.insert_batch_size):
+                yield batch
+                batch = []
+            batch_keys = record_keys
+            batch.append(record)
+
+        if batch:
+            yield batch
+
+    def _check_record(self, record):
+        """Check that a record can be added to the database."""
+
         if record['dateTime'] is None:
             syslog.syslog(syslog.LOG_ERR,
                           "manager: Archive record with null time encountered")
@@ -269,15 +435,89 @@ class Manager(object):
         # system as the records already in the database:
         self._check_unit_system(record['usUnits'])
 
+    def _addRecordBatch(self, record_list, cursor, log_level):
+        """Internal function for adding a batch of records to the database.
+        
+        record_list: A list of records. They must all have the same keys.
+        
+        returns: A list of the records that were actually added. Records that
+        cannot be added (for example, because they are already in the database)
+        are logged, then skipped."""
+
+        (key_list, sql_insert_stmt) = self._get_insert_stmt(record_list[0])
+        value_lists = [[record[k] for k in key_list] for record in record_list]
+
+        # Insert the records with a single call. If that fails, back out any
+        # partial results, then add the records one by one, so the good ones
+        # still get added.
+        cursor.execute("SAVEPOINT weewx_batch")
+        try:
+            cursor.executemany(sql_insert_stmt, value_lists)
+        except (weedb.IntegrityError, weedb.OperationalError):
+            cursor.execute("ROLLBACK TO SAVEPOINT weewx_batch")
+            added_list = []
+            for record in record_list:
+                try:
+                    self._addSingleRecord(record, cursor, log_level)
+                    added_list.append(record)
+                except (weedb.IntegrityError, weedb.OperationalError), e:
+                    syslog.syslog(syslog.LOG_ERR, "manager: "
+                                  "Unable to add record %s to database '%s': %s" %
+                                  (weeutil.weeutil.timestamp_to_string(record['dateTime']), 
+                                   self.database_name, e))
+        else:
+            added_list = record_list
+            if len(record_list) == 1:
+                syslog.syslog(log_level, "manager: Added record %s to database '%s'" % 
+                              (weeutil.weeutil.timestamp_to_string(record_list[0]['dateTime']),
+                               self.database_name))
+            else:
+                syslog.syslog(log_level, "manager: Added %d records %s through %s to database '%s'" % 
+                              (len(record_list),
+                               weeutil.weeutil.timestamp_to_string(record_list[0]['dateTime']),
+                               weeutil.weeutil.timestamp_to_string(record_list[-1]['dateTime']),
+                               self.database_name))
+        finally:
+            cursor.execute("RELEASE SAVEPOINT weewx_batch")
+
+        return added_list
+
+    def _addSingleRecord(self, record, cursor, log_level):
+        """Internal function for adding a single record to the database."""
+        
+        self._check_record(record)
+
+        (key_list, sql_insert_stmt) = self._get_insert_stmt(record)
+        # Get the values in the same order as the keys:
+        value_list = [record[k] for k in key_list]
+        cursor.execute(sql_insert_stmt, value_list)
+        syslog.syslog(log_level, "manager: Added record %s to database '%s'" % 
+                      (weeutil.weeutil.timestamp_to_string(record['dateTime']),
+                       self.database_name))
+
+    def _get_insert_stmt(self, record):
+        """Return the list of keys, and the SQL insert statement, for a record.
+        The results are cached, keyed on the set of record keys and the table.
+        If the archive is partitioned, the statement inserts into the partition
+        for the record, which must already exist.
+        
+        returns: A 2-way tuple (key_list, sql_insert_stmt)."""
+        
+        if self.partitions:
+            _table = self._partition_table(_partition_year(record['dateTime']))
+        else:
+            _table = self.table_name
+        record_keys = (frozenset(record), _table)
+        try:
+            return self._insert_stmt_cache[record_keys]
+        except KeyError:
+            pass
+
         # Only data types that appear in the database schema can be
         # inserted. To find them, form the intersection between the
-        # set of all record keys and the set of all sql keys
-        record_key_set = set(record.keys())
-        insert_key_set = record_key_set.intersection(self.sqlkeys)
+        # set of all record keys and the set of all sql keys.
         # Convert to an ordered list:
-        key_list = list(insert_key_set)
-        # Get the values in the same order:
-        value_list = [record[k] for k in key_list]
+        key_list = list(record_keys[0].intersection(self.sqlkeys))
         
         # This will a string of sql types, separated by commas. Because
         # some of the weewx sql keys (notably 'interval') are reserved
@@ -287,16 +527,17 @@ class Manager(object):
         # question marks:
         q_str = ','.join('?' * len(key_list))
         # Form the SQL insert statement:
-        sql_insert_stmt = "INSERT INTO %s (%s) VALUES (%s)" % (self.table_name, k_str, q_str) 
-        cursor.execute(sql_insert_stmt, value_list)
-        syslog.syslog(log_level, "manager: Added record %s to database '%s'" % 
-                      (weeutil.weeutil.timestamp_to_string(record['dateTime']),
-                       self.database_name))
+        sql_insert_stmt = "INSERT INTO %s (%s) VALUES (%s)" % (_table, k_str, q_str) 
+        self._insert_stmt_cache[record_keys] = (key_list, sql_insert_stmt)
+        return (key_list, sql_insert_stmt)
 
     def _updateHiLo(self, accumulator, cursor):
         pass
 
-    def genBatchRows(self, startstamp=None, stopstamp=None):
+    # The number of rows fetched at a time by genBatchRows():
+    fetch_batch_size = 1000
+
+    def genBatchRows(self, startstamp=None, stopstamp=None, batch_size=None):
         """Generator function that yields raw rows from the archive database
         with timestamps within an interval.
         
@@ -306,32 +547,48 @@ class Manager(object):
         stopstamp: Inclusive end of the interval in epoch time. If 'None', then
         end at last archive record.
         
+        batch_size: The number of rows to be fetched from the database at a
+        time. [Optional. Default is fetch_batch_size]
+        
         yields: A list with the data records"""
 
-        _cursor = self.connection.cursor()
-        try:
-            if startstamp is None:
-                if stopstamp is None:
-                    _gen = _cursor.execute("SELECT * FROM %s ORDER BY dateTime ASC" % self.table_name)
-                else:
-                    _gen = _cursor.execute("SELECT * FROM %s WHERE dateTime <= ? ORDER BY dateTime ASC" % self.table_name, (stopstamp,))
-            else:
-                if stopstamp is None:
-                    _gen = _cursor.execute("SELECT * FROM %s WHERE dateTime > ? ORDER BY dateTime ASC" % self.table_name, (startstamp,))
-                else:
-                    _gen = _cursor.execute("SELECT * FROM %s WHERE dateTime > ? AND dateTime <= ? ORDER BY dateTime ASC" % self.table_name,
-                                            (startstamp, stopstamp))
-               
-            _last_time = 0
-            for _row in _gen:
-                # The following is to get around a bug in sqlite when all the
-                # tables are in one file:
-                if _row[0] <= _last_time:
-                    continue
-                _last_time = _row[0]
+        _store = self._memory_store(self.sqlkeys, startstamp, stopstamp)
+        if _store is not None:
+            for _row in _store.rows(self.sqlkeys, startstamp, stopstamp):
                 yield _row
-        finally:
-            _cursor.close()
+            return
+
+        _where = []
+        _args = []
+        if startstamp is not None:
+            _where.append("dateTime > ?")
+            _args.append(startstamp)
+        if stopstamp is not None:
+            _where.append("dateTime <= ?")
+            _args.append(stopstamp)
+        _where_str = " WHERE " + " AND ".join(_where) if _where else ""
+
+        _batch_size = batch_size or self.fetch_batch_size
+        _last_time = 0
+        # If the archive is partitioned, go through the partitions in turn:
+        for _table in self._archive_tables(startstamp, stopstamp):
+            # Ask for a cursor that does not pull the whole result set into memory:
+            _cursor = self.connection.cursor(streaming=True)
+            try:
+                _gen = _cursor.execute("SELECT * FROM %s%s ORDER BY dateTime ASC" % (_table, _where_str), _args)
+                while True:
+                    _rows = _gen.fetchmany(_batch_size)
+                    if not _rows:
+                        break
+                    for _row in _rows:
+                        # The following is to get around a bug in sqlite when all the
+                        # tables are in one file:
+                        if _row[0] <= _last_time:
+                            continue
+                        _last_time = _row[0]
+                        yield _row
+            finally:
+                _cursor.close()
 
     def genBatchRecords(self, startstamp=None, stopstamp=None):
         """Generator function that yields records with timestamps within an
@@ -348,6 +605,30 @@ class Manager(object):
         
         for _row in self.genBatchRows(startstamp, stopstamp):
             yield dict(zip(self.sqlkeys, _row)) if _row else None
+
+    def genRecordViews(self, startstamp=None, stopstamp=None, batch_size=None):
+        """Generator function that yields read-only records with timestamps
+        within an interval.
+
+        Like genBatchRecords(), but rather than building a new dictionary for
+        each record, it wraps the row in a RecordView, which shares the keys
+        with all the others. Use it where the records are only read.
+
+        startstamp: Exclusive start of the interval in epoch time. If 'None',
+        then start at earliest archive record.
+
+        stopstamp: Inclusive end of the interval in epoch time. If 'None', then
+        end at last archive record.
+
+        batch_size: The number of rows to be fetched from the database at a
+        time. [Optional. Default is fetch_batch_size]
+
+        yields: Instances of RecordView"""
+
+        _keys = tuple(self.sqlkeys)
+        _index = dict((_key, i) for (i, _key) in enumerate(_keys))
+        for _row in self.genBatchRows(startstamp, stopstamp, batch_size):
+            yield RecordView(_keys, _index, _row)
         
     def getRecord(self, timestamp, max_delta=None):
         """Get a single archive record with a given epoch time stamp.
@@ -359,26 +640,104 @@ class Manager(object):
         
         returns: a record dictionary or None if the record does not exist."""
 
-        _cursor = self.connection.cursor()
-        try:
-            if max_delta:
-                time_start_ts = timestamp - max_delta
-                time_stop_ts  = timestamp + max_delta
-                _cursor.execute("SELECT * FROM %s WHERE dateTime>=? AND dateTime<=? "\
-                                "ORDER BY ABS(dateTime-?) ASC LIMIT 1" % self.table_name,
-                                (time_start_ts, time_stop_ts, timestamp))
-            else:
-                _cursor.execute("SELECT * FROM %s WHERE dateTime=?" % self.table_name, (timestamp,))
-            _row = _cursor.fetchone()
+        _store = self._memory_store(self.sqlkeys, timestamp - (max_delta or 0), timestamp + (max_delta or 0), True)
+        if _store is not None:
+            _row = _store.nearest(self.sqlkeys, timestamp, max_delta)
             return dict(zip(self.sqlkeys, _row)) if _row else None
-        finally:
-            _cursor.close()
+
+        if max_delta:
+            # Look up the neighbors on either side in the index, rather than sorting
+            # all the records in the window. The earlier record wins a tie.
+            _before = self.getSql("SELECT * FROM %s WHERE dateTime<=? AND dateTime>=? ORDER BY dateTime DESC LIMIT 1"
+                                  % self._archive_table_sql(timestamp - max_delta, timestamp),
+                                  (timestamp, timestamp - max_delta))
+            _after = self.getSql("SELECT * FROM %s WHERE dateTime>? AND dateTime<=? ORDER BY dateTime ASC LIMIT 1"
+                                 % self._archive_table_sql(timestamp, timestamp + max_delta),
+                                 (timestamp, timestamp + max_delta))
+            _i = self.sqlkeys.index('dateTime')
+            if _before is None or (_after is not None and _after[_i] - timestamp < timestamp - _before[_i]):
+                _row = _after
+            else:
+                _row = _before
+        else:
+            _row = self.getSql("SELECT * FROM %s WHERE dateTime=?" % self._archive_table_sql(timestamp, timestamp),
+                               (timestamp,))
+        return dict(zip(self.sqlkeys, _row)) if _row else None
+
+    # The most time windows to be looked up by getRecords() with a single query:
+    max_windows = 200
+
+    def getRecords(self, timestamps, max_delta=None):
+        """Get the archive records with, or nearest to, each of a sequence of
+        epoch time stamps. It gives the same records as getRecord(), but they are
+        found together, in a single pass through the database.
+        
+        timestamps: A sequence of epoch times, in any order.
+        
+        max_delta: The largest difference in time that is acceptable.
+        [Optional. The default is no difference]
+        
+        returns: A list with a record dictionary, or None if there is no record,
+        for each time stamp, in the same order."""
+
+        _delta = max_delta or 0
+        _sorted = sorted(set(timestamps))
+        if not _sorted:
+            return []
+        _i = self.sqlkeys.index('dateTime')
+
+        _store = self._memory_store(self.sqlkeys, _sorted[0] - _delta, _sorted[-1] + _delta, True)
+        if _store is not None:
+            _row_list = [_store.nearest(self.sqlkeys, _ts, max_delta) for _ts in _sorted]
+        else:
+            # Put together the windows around the time stamps where they overlap:
+            _window_list = []
+            for _ts in _sorted:
+                if _window_list and _ts - _delta <= _window_list[-1][1]:
+                    _window_list[-1][1] = _ts + _delta
+                else:
+                    _window_list.append([_ts - _delta, _ts + _delta])
+            # Then read the records in the windows, a batch of windows at a time.
+            # Each window is a range scan of the index of its own; the database
+            # engines do much worse with the equivalent OR'd conditions.
+            _rows = []
+            for _j in xrange(0, len(_window_list), self.max_windows):
+                _batch = _window_list[_j:_j + self.max_windows]
+                _sql_str = " UNION ALL ".join(["SELECT * FROM %s WHERE dateTime BETWEEN ? AND ?"
+                                               % self._archive_table_sql(_lo, _hi) for (_lo, _hi) in _batch])
+                _rows.extend(self.genSql(_sql_str, sum(_batch, [])))
+            _rows.sort(key=lambda _row: _row[_i])
+            # Then merge the sorted records with the sorted time stamps. The
+            # records on either side of a time stamp are the candidates. The
+            # earlier one wins a tie.
+            _row_list = []
+            _k = 0
+            for _ts in _sorted:
+                while _k < len(_rows) and _rows[_k][_i] <= _ts:
+                    _k += 1
+                _best = None
+                for _row in _rows[max(_k - 1, 0):_k + 1]:
+                    if abs(_row[_i] - _ts) <= _delta and (_best is None or abs(_row[_i] - _ts) < abs(_best[_i] - _ts)):
+                        _best = _row
+                _row_list.append(_best)
+
+        _row_dict = dict(zip(_sorted, _row_list))
+        return [dict(zip(self.sqlkeys, _row_dict[_ts])) if _row_dict[_ts] else None for _ts in timestamps]
 
     def updateValue(self, timestamp, obs_type, new_value):
         """Update (replace) a single value in the database."""
         
+        if self.partitions:
+            if _partition_year(timestamp) not in self.partitions:
+                return
+            _table = self._partition_table(_partition_year(timestamp))
+        else:
+            _table = self.table_name
         self.connection.execute("UPDATE %s SET %s=? WHERE dateTime=?" % 
-                                (self.table_name, obs_type), (new_value, timestamp))
+                                (_table, obs_type), (new_value, timestamp))
+        self._invalidate_aggregates(timestamp, timestamp)
+        if self.hot_window is not None:
+            self.hot_window.update_value(timestamp, obs_type, new_value)
 
     def getSql(self, sql, sqlargs=(), cursor=None):
         """Executes an arbitrary SQL statement on the database.
@@ -407,24 +766,218 @@ class Manager(object):
                 yield _row
         finally:
             _cursor.close()
+
+    def _genColumns(self, column_list, startstamp, stopstamp, cursor=None, include_start=False):
+        """Return an iterable with the values of some columns of the archive
+        records within an interval, in time order. The values come from the hot
+        window if it holds all of the records.
+
+        column_list: A list of the columns to be returned.
+
+        startstamp: Exclusive start of the interval in epoch time, unless
+        include_start is True.
+
+        stopstamp: Inclusive end of the interval in epoch time.
+
+        cursor: The cursor to be used for the query. [Optional. If not given,
+        one is created]
+
+        returns: An iterable returning tuples with the values, in the order of
+        column_list."""
+
+        _store = self._memory_store(column_list, startstamp, stopstamp, include_start)
+        if _store is not None:
+            return _store.rows(column_list, startstamp, stopstamp, include_start)
+
+        sql_str = "SELECT %s FROM %%s WHERE dateTime %s ? AND dateTime <= ? ORDER BY dateTime ASC" % \
+                  (','.join(["`%s`" % _column for _column in column_list]),
+                   '>=' if include_start else '>')
+        _tables = self._archive_tables(startstamp, stopstamp)
+        if len(_tables) > 1:
+            return self._genTableRows(sql_str, _tables, (startstamp, stopstamp), cursor)
+        if cursor is not None:
+            return cursor.execute(sql_str % _tables[0], (startstamp, stopstamp))
+        return self.genSql(sql_str % _tables[0], (startstamp, stopstamp))
+
+    def _genTableRows(self, sql_str, table_list, sqlargs, cursor=None):
+        """Generator function that runs a query on each of a list of tables in
+        turn, and yields the rows. The query names the table with '%s'."""
+        for _table in table_list:
+            if cursor is not None:
+                for _row in cursor.execute(sql_str % _table, sqlargs):
+                    yield _row
+            else:
+                for _row in self.genSql(sql_str % _table, sqlargs):
+                    yield _row
             
+    # The name of the table holding the partition of the archive for a year:
+    partition_table_str = "%s__%d"
+    # The number of partitions, newest first, that can still be changed. Older
+    # ones are made read-only.
+    writable_partitions = 2
+
+    def _init_partitions(self):
+        """Find the yearly partitions of the archive, if any."""
+        _match = re.compile(r"%s__(\d{4})$" % re.escape(self.table_name)).match
+        self.partitions = sorted(int(_match(_table).group(1)) for _table in self.connection.tables()
+                                 if _match(_table))
+
+    def _partition_table(self, year):
+        return Manager.partition_table_str % (self.table_name, year)
+
+    def _archive_tables(self, start_ts=None, stop_ts=None):
+        """Return a list of the tables that can hold the archive records from
+        start_ts through stop_ts, oldest first. If the archive is partitioned,
+        these are the partitions that overlap the time span. Otherwise, it is
+        the archive table."""
+        if not self.partitions:
+            return [self.table_name]
+        _table_list = [self._partition_table(_year) for _year in self.partitions
+                       if (start_ts is None or _partition_span(_year).stop >= start_ts)
+                       and (stop_ts is None or _partition_span(_year).start < stop_ts)]
+        # If there are no records in the time span, any partition will do:
+        return _table_list or [self._partition_table(self.partitions[-1])]
+
+    def _archive_table_sql(self, start_ts=None, stop_ts=None):
+        """Return a table expression for use in a FROM clause, which gives the
+        archive records from start_ts through stop_ts. If the archive is
+        partitioned, only the partitions that overlap the time span are used,
+        limited to start_ts <= dateTime <= stop_ts."""
+
+        _table_list = self._archive_tables(start_ts, stop_ts)
+        if len(_table_list) == 1:
+            return _table_list[0]
+        _where = []
+        if start_ts is not None:
+            _where.append("dateTime >= %d" % start_ts)
+        if stop_ts is not None:
+            _where.append("dateTime <= %d" % stop_ts)
+        _where_str = " WHERE " + " AND ".join(_where) if _where else ""
+        return "(%s) AS %s" % (" UNION ALL ".join(["SELECT * FROM %s%s" % (_table, _where_str)
+                                                   for _table in _table_list]), self.table_name)
+
+    def partition_archive(self):
+        """Split the archive table into a table for each year. The archive table
+        is replaced with a view of the same name, which joins the partitions
+        together. It can still be read, but records must be added and changed
+        through the manager. Records are added to the partition for their year,
+        which is made as needed. All but the newest partitions are made
+        read-only. See writable_partitions. A partition made for records older
+        than those stays writable until another partition is added, so older
+        records can still be imported.
+
+        Queries done through the manager use only the partitions that overlap
+        the time span of the query.
+
+        returns: The number of partitions made. If the archive is already
+        partitioned, nothing is done, and zero is returned."""
+
+        if self.partitions:
+            return 0
+        if self.first_timestamp is None:
+            _year_list = [_partition_year(time.time())]
+        else:
+            _year_list = [_year for _year in range(_partition_year(self.first_timestamp),
+                                                   _partition_year(self.last_timestamp) + 1)
+                          if self.getSql("SELECT dateTime FROM %s WHERE dateTime > ? AND dateTime <= ? LIMIT 1"
+                                         % self.table_name, _partition_span(_year))]
+        with weedb.Transaction(self.connection) as _cursor:
+            for _year in _year_list:
+                self._create_like(self._partition_table(_year), self.table_name, _cursor)
+                _cursor.execute("INSERT INTO %s SELECT * FROM %s WHERE dateTime > ? AND dateTime <= ?"
+                                % (self._partition_table(_year), self.table_name), _partition_span(_year))
+            _cursor.execute("DROP TABLE %s" % self.table_name)
+            self.partitions = _year_list
+            self._create_view(_cursor)
+            self._set_read_only(_cursor)
+        self._insert_stmt_cache = {}
+        if self.aggregate_cache is not None:
+            self.aggregate_cache.clear()
+        syslog.syslog(syslog.LOG_INFO, "manager: Split table '%s' in database '%s' into %d partitions"
+                      % (self.table_name, self.database_name, len(_year_list)))
+        return len(_year_list)
+
+    def _add_partitions(self, year_set):
+        """Make the partitions for a set of years, which must not exist yet,
+        in a transaction of their own."""
+        if not year_set:
+            return
+        try:
+            with weedb.Transaction(self.connection) as _cursor:
+                for _year in sorted(year_set):
+                    self._create_like(self._partition_table(_year), self._partition_table(self.partitions[-1]),
+                                      _cursor)
+                    self.partitions = sorted(self.partitions + [_year])
+                self._create_view(_cursor)
+                # The new partitions are about to receive records, so they are
+                # left writable for now:
+                self._set_read_only(_cursor, year_set)
+        except Exception:
+            # Find out which partitions there really are:
+            self._init_partitions()
+            raise
+        for _year in sorted(year_set):
+            syslog.syslog(syslog.LOG_INFO, "manager: Added partition '%s' to database '%s'"
+                          % (self._partition_table(_year), self.database_name))
+
+    def _create_like(self, new_table, table, cursor):
+        """Create a table with the same columns and keys as another."""
+        if self.connection.dbtype == 'mysql':
+            cursor.execute("CREATE TABLE %s LIKE %s" % (new_table, table))
+        else:
+            _row = self.getSql("SELECT sql FROM sqlite_master WHERE type='table' AND name=?", (table,), cursor)
+            cursor.execute(re.sub(r'^\s*CREATE\s+TABLE\s+[`"\[]?\w+[`"\]]?', "CREATE TABLE %s" % new_table,
+                                  _row[0], flags=re.IGNORECASE))
+
+    def _create_view(self, cursor):
+        """(Re)create the view joining the partitions together."""
+        cursor.execute("DROP VIEW IF EXISTS %s" % self.table_name)
+        cursor.execute("CREATE VIEW %s AS %s" % (self.table_name,
+                                                 " UNION ALL ".join(["SELECT * FROM %s" % self._partition_table(_year)
+                                                                     for _year in self.partitions])))
+
+    # Triggers that stop changes to a partition:
+    read_only_trigger = {'sqlite' : "CREATE TRIGGER %(table)s_read_only_%(op)s BEFORE %(op)s ON %(table)s "
+                                    "BEGIN SELECT RAISE(ABORT, 'Partition %(table)s is read-only'); END",
+                         'mysql'  : "CREATE TRIGGER %(table)s_read_only_%(op)s BEFORE %(op)s ON %(table)s "
+                                    "FOR EACH ROW SIGNAL SQLSTATE '45000' "
+                                    "SET MESSAGE_TEXT = 'Partition %(table)s is read-only'"}
+
+    def _set_read_only(self, cursor, writable=()):
+        """Make all but the newest partitions read-only, if they are not already.
+        Partitions for the years in writable are left alone."""
+        if self.connection.dbtype == 'mysql':
+            cursor.execute("SELECT TRIGGER_NAME FROM information_schema.TRIGGERS WHERE TRIGGER_SCHEMA = DATABASE()")
+        else:
+            cursor.execute("SELECT name FROM sqlite_master WHERE type='trigger'")
+        _triggers = set(_row[0] for _row in cursor.fetchall())
+        _newest = self.partitions[-1]
+        for _year in self.partitions:
+            if _year > _newest - self.writable_partitions or _year in writable:
+                continue
+            for _op in ('INSERT', 'UPDATE', 'DELETE'):
+                _trigger_dict = {'table' : self._partition_table(_year), 'op' : _op}
+                if "%(table)s_read_only_%(op)s" % _trigger_dict not in _triggers:
+                    cursor.execute(Manager.read_only_trigger[self.connection.dbtype] % _trigger_dict)
+
+    # These take a single pass over the records. For ties, the earliest record wins.
     sql_dict = {'mintime' : "SELECT dateTime FROM %(table_name)s "\
-                              "WHERE dateTime > %(start)s AND dateTime <= %(stop)s AND "\
-                              "%(obs_type)s = (SELECT MIN(%(obs_type)s) FROM %(table_name)s "\
-                              "WHERE dateTime > %(start)s and dateTime <= %(stop)s) AND %(obs_type)s IS NOT NULL",
+                              "WHERE dateTime > %(start)s AND dateTime <= %(stop)s AND %(obs_type)s IS NOT NULL "\
+                              "ORDER BY %(obs_type)s ASC, dateTime ASC LIMIT 1",
                 'maxtime' : "SELECT dateTime FROM %(table_name)s "\
-                              "WHERE dateTime > %(start)s AND dateTime <= %(stop)s AND "\
-                              "%(obs_type)s = (SELECT MAX(%(obs_type)s) FROM %(table_name)s "\
-                              "WHERE dateTime > %(start)s and dateTime <= %(stop)s) AND %(obs_type)s IS NOT NULL",
+                              "WHERE dateTime > %(start)s AND dateTime <= %(stop)s AND %(obs_type)s IS NOT NULL "\
+                              "ORDER BY %(obs_type)s DESC, dateTime ASC LIMIT 1",
                 'last'    : "SELECT %(obs_type)s FROM %(table_name)s "\
-                              "WHERE dateTime = (SELECT MAX(dateTime) FROM %(table_name)s "\
-                              "WHERE dateTime > %(start)s AND dateTime <= %(stop)s  AND %(obs_type)s IS NOT NULL)",
-                'lasttime': "SELECT MAX(dateTime) FROM %(table_name)s "\
-                              "WHERE dateTime > %(start)s AND dateTime <= %(stop)s  AND %(obs_type)s IS NOT NULL"}
-                            
+                              "WHERE dateTime > %(start)s AND dateTime <= %(stop)s AND %(obs_type)s IS NOT NULL "\
+                              "ORDER BY dateTime DESC LIMIT 1",
+                'lasttime': "SELECT dateTime FROM %(table_name)s "\
+                              "WHERE dateTime > %(start)s AND dateTime <= %(stop)s AND %(obs_type)s IS NOT NULL "\
+                              "ORDER BY dateTime DESC LIMIT 1"}
+
     simple_sql = "SELECT %(aggregate_type)s(%(obs_type)s) FROM %(table_name)s "\
                    "WHERE dateTime > %(start)s AND dateTime <= %(stop)s AND %(obs_type)s IS NOT NULL"
                    
+    @_cache_aggregate
     def getAggregate(self, timespan, obs_type,
                      aggregate_type, **option_dict):  # @UnusedVariable
         """Returns an aggregation of a statistical type for a given time period.
@@ -435,34 +988,313 @@ class Manager(object):
         obs_type: The type over which aggregation is to be done (e.g., 'barometer',
         'outTemp', 'rain', ...)
         
-        aggregate_type: The type of aggregation to be done. 
+        aggregate_type: The type of aggregation to be done. Besides the types done
+        in SQL, this can be 'median', 'pNN' (e.g., 'p95'), or 'percentile', or
+        'rose' for vector types such as 'wind'.
         
-        option_dict: Not used in this version.
+        option_dict: Only key 'val' is used, for the percentile of type 'percentile'.
         
         returns: A value tuple. First element is the aggregation value,
         or None if not enough data was available to calculate it, or if the aggregation
         type is unknown. The second element is the unit type (eg, 'degree_F').
         The third element is the unit group (eg, "group_temperature") """
         
+        _q = _quantile_of(aggregate_type, option_dict.get('val'))
+        if _q is not None or aggregate_type == 'rose':
+            return self._sketch_aggregate(self._archive_sketch(timespan, obs_type), obs_type, aggregate_type, _q)
+
         if aggregate_type not in ['sum', 'count', 'avg', 'max', 'min', 
                                   'mintime', 'maxtime', 'last', 'lasttime']:
             raise weewx.ViolatedPrecondition("Invalid aggregation type '%s'" % aggregate_type)
         
-        interpolate_dict = {'aggregate_type' : aggregate_type,
-                            'obs_type'       : obs_type,
-                            'table_name'     : self.table_name,
-                            'start'          : timespan.start,
-                            'stop'           : timespan.stop}
-        
-        select_stmt = Manager.sql_dict.get(aggregate_type, Manager.simple_sql)
-        _row = self.getSql(select_stmt % interpolate_dict)
+        _store = self._memory_store(['dateTime', obs_type], timespan.start, timespan.stop)
+        if _store is not None:
+            _result = _store.aggregate(obs_type, aggregate_type, timespan.start, timespan.stop)
+        else:
+            interpolate_dict = {'aggregate_type' : aggregate_type,
+                                'obs_type'       : obs_type,
+                                'table_name'     : self._archive_table_sql(timespan.start, timespan.stop),
+                                'start'          : timespan.start,
+                                'stop'           : timespan.stop}
+
+            select_stmt = Manager.sql_dict.get(aggregate_type, Manager.simple_sql)
+            _row = self.getSql(select_stmt % interpolate_dict)
 
-        _result = _row[0] if _row else None
+            _result = _row[0] if _row else None
         
         # Look up the unit type and group of this combination of observation type and aggregation:
         (t, g) = weewx.units.getStandardUnitType(self.std_unit_system, obs_type, aggregate_type)
         # Form the value tuple and return it:
         return weewx.units.ValueTuple(_result, t, g)
+
+    def getRoseVectors(self, timespan, obs_type='wind', speed_bins=None):
+        """Return the frequencies of the directions of a vector type within a
+        timespan, for drawing a wind rose.
+        
+        timespan: An instance of weeutil.Timespan with the time period.
+        
+        obs_type: A vector type. Default is 'wind'.
+        
+        speed_bins: A value tuple with the speeds that separate the bands of a
+        rose, e.g., ([5, 10, 20], 'mile_per_hour', 'group_speed'). Optional. If not
+        given, there is a single band with all speeds.
+        
+        returns: A 3-way tuple (dir_vec, band_list, calm_t). dir_vec is a value tuple
+        with the direction at the center of each sector. band_list holds a value
+        tuple for each speed band, with the percentage of all values in each sector.
+        calm_t is a value tuple with the percentage of calms. The percentages are
+        None if there is no data."""
+        _rose = self._get_sketch(timespan, obs_type)
+        if not isinstance(_rose, weewx.accum.WindRose):
+            raise weewx.ViolatedPrecondition("Type '%s' is not a vector type" % obs_type)
+        _sectors = weewx.accum.WindRose.sectors
+        _dir_vec = weewx.units.ValueTuple([i * 360.0 / _sectors for i in range(_sectors)],
+                                          'degree_compass', 'group_direction')
+        # The edges of the bands, in the units of the database:
+        _edges = [None, None]
+        if speed_bins is not None and self.std_unit_system is not None:
+            _edges[1:1] = weewx.units.convertStd(speed_bins, self.std_unit_system)[0]
+        _band_list = []
+        for (_lo, _hi) in zip(_edges[:-1], _edges[1:]):
+            _freq = _rose.frequencies(_lo, _hi)
+            _band_list.append(weewx.units.ValueTuple(_freq if _freq is not None else [None] * _sectors,
+                                                     'percent', 'group_percent'))
+        return (_dir_vec, _band_list, weewx.units.ValueTuple(_rose.calm_frequency, 'percent', 'group_percent'))
+
+    def _get_sketch(self, timespan, obs_type):
+        """Return a sketch of the values of obs_type within timespan. See
+        weewx.accum.new_sketch()."""
+        return self._archive_sketch(timespan, obs_type)
+
+    def _archive_sketch(self, timespan, obs_type):
+        """Return a sketch of the values of obs_type in the archive records
+        within timespan."""
+        _sketch = weewx.accum.new_sketch(obs_type)
+        if isinstance(_sketch, weewx.accum.WindRose):
+            for (_unused, _speed, _dir) in self._genColumns(['dateTime', 'windSpeed', 'windDir'],
+                                                            timespan.start, timespan.stop):
+                _sketch.add((_speed, _dir))
+        else:
+            for (_unused, _val) in self._genColumns(['dateTime', obs_type], timespan.start, timespan.stop):
+                _sketch.add(_val)
+        return _sketch
+
+    def _sketch_aggregate(self, sketch, obs_type, aggregate_type, q):
+        """Return an aggregation found from a sketch, as a value tuple: the quantile
+        q, or for aggregation type 'rose', the percentage of the values in each
+        direction sector of a wind rose."""
+        if aggregate_type == 'rose':
+            if not isinstance(sketch, weewx.accum.WindRose):
+                raise weewx.ViolatedPrecondition("Aggregation type 'rose' requires a vector type")
+            return weewx.units.ValueTuple(sketch.frequencies(), 'percent', 'group_percent')
+        (t, g) = weewx.units.getStandardUnitType(self.std_unit_system, obs_type, aggregate_type)
+        return weewx.units.ValueTuple(sketch.quantile(q), t, g)
+
+    def enable_aggregate_cache(self, max_entries=1000):
+        """Cache the results of getAggregate(), so they need not be calculated
+        again while the data they depend on does not change.
+
+        The manager takes care of changes it makes itself. Changes made through
+        another manager are looked for only by refresh(), so looking up a cached
+        result does not touch the database. A manager with daily summaries then
+        notices when the other one changed them, as by adding records. Other
+        changes go unnoticed, except for new records.
+
+        max_entries: The maximum number of results held. The least recently
+        used results are dropped first. [Optional. Default is 1000]
+
+        returns: The instance of AggregateCache."""
+
+        self.aggregate_cache = AggregateCache(max_entries)
+        return self.aggregate_cache
+
+    def _lookup_aggregate(self, timespan, obs_type, aggregate_type, option_dict):
+        """Look up the result of an aggregation in the aggregate cache.
+
+        returns: A tuple (key, result). The key is None if the aggregation cannot
+        be cached, the result is None if it has not been."""
+        _key = (timespan.start, timespan.stop, obs_type, aggregate_type,
+                tuple(sorted((_option, _CacheKey(_value) if hasattr(_value, 'keys') else _value)
+                             for (_option, _value) in option_dict.iteritems())))
+        try:
+            return (_key, self.aggregate_cache.get(_key, self.last_timestamp))
+        except TypeError:
+            # An option that cannot be used as a key. Leave the cache out of it.
+            return (None, None)
+
+    def _save_aggregate(self, key, timespan, result):
+        """Save the result of an aggregation looked up by _lookup_aggregate()."""
+        if key is not None:
+            self.aggregate_cache.put(key, timespan, self.last_timestamp, result)
+
+    def _check_aggregate_cache(self):
+        """Drop any cached aggregates that changes made by somebody else have made
+        out of date. Called by refresh(). The archive table alone does not tell,
+        so this version does nothing."""
+        pass
+
+    def enable_hot_window(self, days=35, max_size=20 * 1024 * 1024):
+        """Hold the archive records of the most recent days in memory, so queries
+        over them need not go to the database. The records are read in with a
+        single query.
+
+        Queries over the archive table that start within the window are
+        answered from memory. Only numeric columns are held. Records added or
+        changed by another manager go unnoticed, except for new records once
+        refresh() has been called. So this is meant for managers that stay open,
+        and make the changes themselves or get refreshed, such as the one that
+        writes the archive, or those in a ManagerPool. For any other, reading
+        in the records takes longer than it saves.
+
+        days: The number of days to be held, including the current one.
+        [Optional. Default is 35]
+
+        max_size: The maximum memory, in bytes, to be used. If the days do not
+        fit, only the most recent records are held. [Optional. Default is
+        20 MB]
+
+        returns: The instance of HotWindow."""
+
+        _schema = [(_column, _type) for (_number, _column, _type, _null, _default, _primary)
+                   in self.connection.genSchemaOf(self._archive_tables()[-1]) if _type in ('INTEGER', 'REAL')]
+        self.hot_window = HotWindow(_schema, days, max_size)
+        # Read the records all at once. Note that genBatchRows() would find the
+        # window empty, and return nothing.
+        _start_ts = self.hot_window.start_of_window(self.last_timestamp) if self.last_timestamp is not None else 0
+        self.hot_window.load(self.genSql("SELECT %s FROM %s WHERE dateTime > ? ORDER BY dateTime ASC"
+                                         % (','.join(["`%s`" % _column for _column in self.hot_window.columns]),
+                                            self._archive_table_sql(_start_ts)), (_start_ts,)),
+                             self.last_timestamp)
+        syslog.syslog(syslog.LOG_DEBUG, "manager: Holding %d records after %s from '%s' in memory"
+                      % (len(self.hot_window), timestamp_to_string(self.hot_window.start_ts), self.database_name))
+        return self.hot_window
+
+    def save_snapshot(self, path):
+        """Write a read-only copy of the archive records to a file, with one
+        array per column, for use with attach_snapshot(). Only numeric columns
+        are copied.
+
+        path: The path of the snapshot file. If it exists, it is replaced.
+
+        returns: The number of records written."""
+
+        _schema = [(_column, _type) for (_number, _column, _type, _null, _default, _primary)
+                   in self.connection.genSchemaOf(self._archive_tables()[-1]) if _type in ('INTEGER', 'REAL')]
+        _columns = [_column for (_column, _type) in _schema]
+        # Records that come in while the copy is made are left out.
+        _stop_ts = self.lastGoodStamp()
+        _nrows = self.getSql("SELECT COUNT(*) FROM %s WHERE dateTime <= ?"
+                             % self._archive_table_sql(None, _stop_ts), (_stop_ts,))[0] if _stop_ts is not None else 0
+        _index = [self.sqlkeys.index(_column) for _column in _columns]
+        _row_gen = (tuple(_row[i] for i in _index) for _row in
+                    self.genBatchRows(None, _stop_ts, 10000)) if _stop_ts is not None else ()
+        t1 = time.time()
+        nrecs = ArchiveSnapshot.create(path, _schema, _row_gen, _nrows,
+                                       table_name=self.table_name, std_unit_system=self.std_unit_system,
+                                       stop_ts=_stop_ts)
+        syslog.syslog(syslog.LOG_INFO, "manager: Saved %d records from '%s' to snapshot '%s' in %.2f seconds"
+                      % (nrecs, self.database_name, path, time.time() - t1))
+        return nrecs
+
+    def attach_snapshot(self, path):
+        """Answer queries over the archive from a snapshot file made by
+        save_snapshot(), where it holds all the records they need. The file is
+        memory-mapped, so only the parts that are used get read.
+
+        The snapshot is not changed by the manager. Queries that reach past
+        the last record it holds go to the database. Use it only with a manager
+        that does not change the records it holds, such as one opened
+        read-only for the reports.
+
+        path: The path of the snapshot file.
+
+        returns: The instance of ArchiveSnapshot."""
+
+        _snapshot = ArchiveSnapshot(path)
+        if _snapshot.table_name != self.table_name or (_snapshot.std_unit_system is not None and
+                                                       self.std_unit_system is not None and
+                                                       _snapshot.std_unit_system != self.std_unit_system):
+            _snapshot.close()
+            raise weewx.ViolatedPrecondition("Snapshot '%s' was not made from table '%s' of database '%s'"
+                                             % (path, self.table_name, self.database_name))
+        if self.snapshot is not None:
+            self.snapshot.close()
+        self.snapshot = _snapshot
+        syslog.syslog(syslog.LOG_DEBUG, "manager: Using snapshot '%s' of %d records through %s for '%s'"
+                      % (path, len(_snapshot), timestamp_to_string(_snapshot.stop_ts), self.database_name))
+        return self.snapshot
+
+    def _memory_store(self, column_list, start_ts, stop_ts, include_start=False):
+        """Return the HotWindow or ArchiveSnapshot that holds all the records of
+        some columns within an interval, or None if they have to be read from
+        the database. A stop_ts of None means through the last record."""
+        if stop_ts is None:
+            stop_ts = self.last_timestamp
+        for _store in (self.hot_window, self.snapshot):
+            if _store is not None and _store.covers(start_ts, include_start, stop_ts) \
+                    and all(_column in _store.index for _column in column_list):
+                return _store
+        return None
+
+    def _invalidate_aggregates(self, start_ts, stop_ts):
+        """Data for the times start_ts through stop_ts has changed. Drop any cached
+        aggregates over the days they fall in."""
+        if self.aggregate_cache is not None:
+            self.aggregate_cache.invalidate(weeutil.weeutil.archiveDaySpan(start_ts).start,
+                                            weeutil.weeutil.archiveDaySpan(stop_ts).stop)
+
+    # The aggregates that getAggregates() calculates together, in a single query:
+    batch_aggregates = ['sum', 'count', 'avg', 'max', 'min']
+
+    def getAggregates(self, timespan, aggregate_list):
+        """Returns several aggregations for the same time period.
+
+        Where possible, the aggregations are calculated together, in a single
+        query. Any others are done one by one with getAggregate().
+
+        timespan: An instance of weeutil.Timespan with the time period over which
+        aggregation is to be done.
+
+        aggregate_list: A list of tuples (obs_type, aggregate_type, option_dict).
+        The option_dict is passed on to getAggregate(), and may be left out.
+
+        returns: A dictionary with key (obs_type, aggregate_type), and a value
+        tuple as value. See getAggregate()."""
+
+        _results = {}
+        _batch_list = []
+        # Key is the aggregation, value its key in the aggregate cache:
+        _cache_keys = {}
+        for (obs_type, aggregate_type, option_dict) in _expand_aggregate_list(aggregate_list):
+            if aggregate_type in Manager.batch_aggregates and obs_type in self.sqlkeys:
+                if self.aggregate_cache is not None:
+                    (_cache_keys[(obs_type, aggregate_type)], _result) = \
+                        self._lookup_aggregate(timespan, obs_type, aggregate_type, option_dict)
+                    if _result is not None:
+                        _results[(obs_type, aggregate_type)] = _result
+                        continue
+                _batch_list.append((obs_type, aggregate_type))
+            else:
+                _results[(obs_type, aggregate_type)] = self.getAggregate(timespan, obs_type, aggregate_type,
+                                                                         **option_dict)
+        _store = self._memory_store(['dateTime'] + [obs_type for (obs_type, aggregate_type) in _batch_list],
+                                    timespan.start, timespan.stop) if _batch_list else None
+        if _store is not None:
+            _row = [_store.aggregate(obs_type, aggregate_type, timespan.start, timespan.stop)
+                    for (obs_type, aggregate_type) in _batch_list]
+        elif _batch_list:
+            _row = self.getSql("SELECT %s FROM %s WHERE dateTime > ? AND dateTime <= ?"
+                               % (','.join(["%s(%s)" % (aggregate_type, obs_type)
+                                            for (obs_type, aggregate_type) in _batch_list]),
+                                  self._archive_table_sql(timespan.start, timespan.stop)),
+                               (timespan.start, timespan.stop))
+        for (i, (obs_type, aggregate_type)) in enumerate(_batch_list):
+            (t, g) = weewx.units.getStandardUnitType(self.std_unit_system, obs_type, aggregate_type)
+            _results[(obs_type, aggregate_type)] = weewx.units.ValueTuple(_row[i] if _row else None, t, g)
+            if self.aggregate_cache is not None:
+                self._save_aggregate(_cache_keys[(obs_type, aggregate_type)], timespan,
+                                     _results[(obs_type, aggregate_type)])
+        return _results
     
     def getSqlVectors(self, timespan, obs_type, 
                       aggregate_type=None,
@@ -539,97 +1371,105 @@ class Manager(object):
                 if aggregate_type not in ['sum', 'count', 'avg', 'max', 'min', 'last']:
                     raise weewx.ViolatedPrecondition("Invalid aggregation type '%s'" % aggregate_type)
                 
-                # Special select statement for 'last'
-                if aggregate_type == 'last':
-                    sql_str = "SELECT dateTime, %s, usUnits FROM %s WHERE dateTime = "\
-                        "(SELECT MAX(dateTime) FROM %s WHERE "\
-                        "dateTime > ? AND dateTime <= ?)" % (windvec_types[obs_type], self.table_name, 
-                                                             self.table_name)
+                if numpy is not None:
+                    # Numpy is available. Use it to do the aggregation over all
+                    # intervals at once.
+                    (start_vec, stop_vec, data_vec, std_unit_system) = \
+                        self._getWindvecAggregates(windvec_types[obs_type], aggregate_type,
+                                                   weeutil.weeutil.intervalgen(timespan[0], timespan[1], aggregate_interval),
+                                                   _cursor)
                 else:
-                    sql_str = 'SELECT dateTime, %s, usUnits FROM %s WHERE dateTime > ? AND dateTime <= ?' % \
-                        (windvec_types[obs_type], self.table_name)
+                    # Special select statement for 'last'
+                    _table_sql = self._archive_table_sql(timespan[0], timespan[1])
+                    if aggregate_type == 'last':
+                        sql_str = "SELECT dateTime, %s, usUnits FROM %s WHERE dateTime = "\
+                            "(SELECT MAX(dateTime) FROM %s WHERE "\
+                            "dateTime > ? AND dateTime <= ?)" % (windvec_types[obs_type], _table_sql, 
+                                                                 _table_sql)
+                    else:
+                        sql_str = 'SELECT dateTime, %s, usUnits FROM %s WHERE dateTime > ? AND dateTime <= ?' % \
+                            (windvec_types[obs_type], _table_sql)
 
-                # Go through each aggregation interval, calculating the aggregation.
-                for stamp in weeutil.weeutil.intervalgen(timespan[0], timespan[1], aggregate_interval):
+                    # Go through each aggregation interval, calculating the aggregation.
+                    for stamp in weeutil.weeutil.intervalgen(timespan[0], timespan[1], aggregate_interval):
     
-                    _mag_extreme = _dir_at_extreme = None
-                    _xsum = _ysum = 0.0
-                    _count = 0
+                        _mag_extreme = _dir_at_extreme = None
+                        _xsum = _ysum = 0.0
+                        _count = 0
     
-                    for _rec in _cursor.execute(sql_str, stamp):
-                        (_mag, _dir) = _rec[1:3]
+                        for _rec in _cursor.execute(sql_str, stamp):
+                            (_mag, _dir) = _rec[1:3]
     
-                        if _mag is None:
-                            continue
+                            if _mag is None:
+                                continue
     
-                        # A good direction is necessary unless the mag is zero:
-                        if _mag == 0.0  or _dir is not None:
-                            _count += 1
-                            if std_unit_system:
-                                if std_unit_system != _rec[3]:
-                                    raise weewx.UnsupportedFeature("Unit type cannot change "\
-                                                                   "within a time interval.")
-                            else:
-                                std_unit_system = _rec[3]
+                            # A good direction is necessary unless the mag is zero:
+                            if _mag == 0.0  or _dir is not None:
+                                _count += 1
+                                if std_unit_system:
+                                    if std_unit_system != _rec[3]:
+                                        raise weewx.UnsupportedFeature("Unit type cannot change "\
+                                                                       "within a time interval.")
+                                else:
+                                    std_unit_system = _rec[3]
                             
-                            # Pick the kind of aggregation:
-                            if aggregate_type == 'min':
-                                if _mag_extreme is None or _mag < _mag_extreme:
-                                    _mag_extreme = _mag
-                                    _dir_at_extreme = _dir
-                            elif aggregate_type == 'max':
-                                if _mag_extreme is None or _mag > _mag_extreme:
-                                    _mag_extreme = _mag
-                                    _dir_at_extreme = _dir
-                            else:
-                                # An undefined direction is OK (and expected) if the magnitude
-                                # is zero. But, in that case, it doesn't contribute to the sums either.
-                                if _dir is None:
-                                    # Sanity check
+                                # Pick the kind of aggregation:
+                                if aggregate_type == 'min':
+                                    if _mag_extreme is None or _mag < _mag_extreme:
+                                        _mag_extreme = _mag
+                                        _dir_at_extreme = _dir
+                                elif aggregate_type == 'max':
+                                    if _mag_extreme is None or _mag > _mag_extreme:
+                                        _mag_extreme = _mag
+                                        _dir_at_extreme = _dir
+                                else:
+                                    # An undefined direction is OK (and expected) if the magnitude
+                                    # is zero. But, in that case, it doesn't contribute to the sums either.
+                                    if _dir is None:
+                                        # Sanity check
+                                        if weewx.debug:
+                                            assert(_mag == 0.0)
+                                        _xvec = _yvec = 0.0
+                                    else:
+                                        _xvec = _mag * math.cos(math.radians(90.0 - _dir))
+                                        _yvec = _mag * math.sin(math.radians(90.0 - _dir))
+                                        _xsum += _xvec
+                                        _ysum += _yvec
+                        # We've gone through the whole interval. Were there any
+                        # good data?
+                        if _count:
+                            # Record the time of the last good data point:
+                            start_vec.append(stamp.start)
+                            stop_vec.append(stamp.stop)
+                            # Form the requested aggregation:
+                            if aggregate_type in ('min', 'max'):
+                                if _dir_at_extreme is None:
+                                    # The only way direction can be zero with a
+                                    # non-zero count is if all wind velocities
+                                    # were zero
                                     if weewx.debug:
-                                        assert(_mag == 0.0)
-                                    _xvec = _yvec = 0.0
+                                        assert(_mag_extreme <= 1.0e-6)
+                                    x_extreme = y_extreme = 0.0
                                 else:
-                                    _xvec = _mag * math.cos(math.radians(90.0 - _dir))
-                                    _yvec = _mag * math.sin(math.radians(90.0 - _dir))
-                                    _xsum += _xvec
-                                    _ysum += _yvec
-                    # We've gone through the whole interval. Were there any
-                    # good data?
-                    if _count:
-                        # Record the time of the last good data point:
-                        start_vec.append(stamp.start)
-                        stop_vec.append(stamp.stop)
-                        # Form the requested aggregation:
-                        if aggregate_type in ('min', 'max'):
-                            if _dir_at_extreme is None:
-                                # The only way direction can be zero with a
-                                # non-zero count is if all wind velocities
-                                # were zero
-                                if weewx.debug:
-                                    assert(_mag_extreme <= 1.0e-6)
-                                x_extreme = y_extreme = 0.0
+                                    x_extreme = _mag_extreme * math.cos(math.radians(90.0 - _dir_at_extreme))
+                                    y_extreme = _mag_extreme * math.sin(math.radians(90.0 - _dir_at_extreme))
+                                data_vec.append(complex(x_extreme, y_extreme))
+                            elif aggregate_type == 'sum':
+                                data_vec.append(complex(_xsum, _ysum))
+                            elif aggregate_type == 'count':
+                                data_vec.append(_count)
+                            elif aggregate_type == 'last':
+                                data_vec.append(complex(_xvec, _yvec))
                             else:
-                                x_extreme = _mag_extreme * math.cos(math.radians(90.0 - _dir_at_extreme))
-                                y_extreme = _mag_extreme * math.sin(math.radians(90.0 - _dir_at_extreme))
-                            data_vec.append(complex(x_extreme, y_extreme))
-                        elif aggregate_type == 'sum':
-                            data_vec.append(complex(_xsum, _ysum))
-                        elif aggregate_type == 'count':
-                            data_vec.append(_count)
-                        elif aggregate_type == 'last':
-                            data_vec.append(complex(_xvec, _yvec))
-                        else:
-                            # Must be 'avg'
-                            data_vec.append(complex(_xsum/_count, _ysum/_count))
+                                # Must be 'avg'
+                                data_vec.append(complex(_xsum/_count, _ysum/_count))
             else:
                 # No aggregation desired. It's a lot simpler. Go get the
                 # data in the requested time period
                 # This SQL select string will select the proper wind types
-                sql_str = 'SELECT dateTime, %s, usUnits, `interval` FROM %s WHERE dateTime >= ? AND dateTime <= ?' % \
-                        (windvec_types[obs_type], self.table_name)
-                
-                for _rec in _cursor.execute(sql_str, timespan):
+                _columns = [_column.strip() for _column in windvec_types[obs_type].split(',')]
+                for _rec in self._genColumns(['dateTime'] + _columns + ['usUnits', 'interval'],
+                                             timespan[0], timespan[1], _cursor, include_start=True):
                     start_vec.append(_rec[0] - _rec[4])
                     stop_vec.append(_rec[0])
                     if std_unit_system:
@@ -660,6 +1500,103 @@ class Manager(object):
                 weewx.units.ValueTuple(stop_vec, time_type, time_group),
                 weewx.units.ValueTuple(data_vec, data_type, data_group))
 
+    def _getWindvecAggregates(self, sql_columns, aggregate_type, span_seq, cursor):
+        """Aggregate wind vectors over a sequence of time spans, using numpy.
+
+        The magnitudes and directions for the whole sequence are retrieved with a
+        single query, then broken down into x- and y-components, then aggregated
+        for each span using grouped reductions.
+
+        sql_columns: The magnitude and direction columns, separated by a comma.
+        Example: 'windSpeed, windDir'
+
+        aggregate_type: One of 'sum', 'count', 'avg', 'max', 'min', or 'last'.
+
+        span_seq: An iterable returning TimeSpans in increasing order, such as
+        that returned by weeutil.weeutil.intervalgen().
+
+        cursor: The cursor to be used.
+
+        returns: A 4-way tuple (start_vec, stop_vec, data_vec, std_unit_system).
+        Only spans with good data appear in the vectors."""
+
+        span_list = list(span_seq)
+        if not span_list:
+            return ([], [], [], None)
+
+        _rows = list(self._genColumns(['dateTime'] + [_column.strip() for _column in sql_columns.split(',')] + ['usUnits'],
+                                      span_list[0].start, span_list[-1].stop, cursor))
+        if not _rows:
+            return ([], [], [], None)
+
+        # Nulls become NaNs:
+        (_ts, _mag, _dir, _units) = [numpy.array(_col, dtype=float) for _col in zip(*_rows)]
+
+        # Find the span each record belongs to. Because records are never beyond
+        # the last span, the index is always valid.
+        _stops  = numpy.array([_span.stop for _span in span_list], dtype=float)
+        _starts = numpy.array([_span.start for _span in span_list], dtype=float)
+        _ispan  = numpy.searchsorted(_stops, _ts, side='left')
+        _select = _ts > _starts[_ispan]
+
+        if aggregate_type == 'last':
+            # Only the last record of each span is of interest. Because the records
+            # are in order, this is where the span index changes.
+            _is_last = numpy.ones(len(_ts), dtype=bool)
+            _is_last[:-1] = _ispan[1:] != _ispan[:-1]
+            _select &= _is_last
+
+        # A good direction is necessary unless the magnitude is zero:
+        _good = _select & ~numpy.isnan(_mag) & ((_mag == 0.0) | ~numpy.isnan(_dir))
+        if not _good.any():
+            return ([], [], [], None)
+
+        _good_units = _units[_good]
+        if (_good_units != _good_units[0]).any():
+            raise weewx.UnsupportedFeature("Unit type cannot change within a time interval.")
+        std_unit_system = int(_good_units[0])
+
+        _ispan = _ispan[_good]
+        _mag   = _mag[_good]
+        _dir   = _dir[_good]
+
+        # Break down into x- and y-components. An undefined direction is OK if the
+        # magnitude is zero. But, in that case, the record contributes nothing.
+        _no_dir = numpy.isnan(_dir)
+        _theta = numpy.radians(90.0 - numpy.where(_no_dir, 0.0, _dir))
+        _x = numpy.where(_no_dir, 0.0, _mag * numpy.cos(_theta))
+        _y = numpy.where(_no_dir, 0.0, _mag * numpy.sin(_theta))
+
+        _count = numpy.bincount(_ispan, minlength=len(span_list))
+        _has_data = numpy.nonzero(_count)[0]
+
+        if aggregate_type == 'count':
+            _data = _count[_has_data]
+        elif aggregate_type in ('sum', 'avg'):
+            _xsum = numpy.bincount(_ispan, weights=_x, minlength=len(span_list))[_has_data]
+            _ysum = numpy.bincount(_ispan, weights=_y, minlength=len(span_list))[_has_data]
+            if aggregate_type == 'avg':
+                _xsum /= _count[_has_data]
+                _ysum /= _count[_has_data]
+            _data = _xsum + 1j * _ysum
+        elif aggregate_type == 'last':
+            # There is exactly one record per span
+            _data = _x + 1j * _y
+        else:
+            # Must be 'min' or 'max'. Sort by span, then magnitude, then time, and
+            # pick the first record of each span. For ties, the earliest record wins.
+            _key = _mag if aggregate_type == 'min' else -_mag
+            _order = numpy.lexsort((numpy.arange(len(_mag)), _key, _ispan))
+            _sorted_span = _ispan[_order]
+            _first = numpy.ones(len(_order), dtype=bool)
+            _first[1:] = _sorted_span[1:] != _sorted_span[:-1]
+            _extreme = _order[_first]
+            _data = _x[_extreme] + 1j * _y[_extreme]
+
+        start_vec = [span_list[i].start for i in _has_data]
+        stop_vec  = [span_list[i].stop for i in _has_data]
+        return (start_vec, stop_vec, _data.tolist(), std_unit_system)
+
     def _check_unit_system(self, unit_system):
         """ Check to make sure a unit system is the same as what's already in use in the database."""
 
@@ -743,23 +1680,27 @@ class Manager(object):
                 if not aggregate_interval:
                     raise weewx.ViolatedPrecondition("Aggregation interval missing")
 
-                if aggregate_type == 'last':
-                    sql_str = "SELECT %s, usUnits, usUnits FROM %s WHERE dateTime = "\
-                        "(SELECT MAX(dateTime) FROM %s WHERE "\
-                        "dateTime > ? AND dateTime <= ?)" % (sql_type, self.table_name, 
-                                                             self.table_name)
+                if aggregate_type in Manager.bucket_aggregates:
+                    # The aggregate can be calculated for all intervals in a single
+                    # pass over the archive table.
+                    _gen = self._genBucketAggregates(sql_type, aggregate_type,
+                                                     weeutil.weeutil.intervalgen(startstamp, stopstamp, aggregate_interval),
+                                                     _cursor)
                 else:
-                    sql_str = "SELECT %s(%s), MIN(usUnits), MAX(usUnits) FROM %s "\
-                        "WHERE dateTime > ? AND dateTime <= ?" % (aggregate_type, sql_type, self.table_name)
+                    # Unknown to us. Let the database do the aggregation, one interval
+                    # at a time.
+                    _gen = self._genIntervalAggregates(sql_type, aggregate_type,
+                                                       weeutil.weeutil.intervalgen(startstamp, stopstamp, aggregate_interval),
+                                                       _cursor)
 
-                for stamp in weeutil.weeutil.intervalgen(startstamp, stopstamp, aggregate_interval):
-                    _cursor.execute(sql_str, stamp)
-                    _rec = _cursor.fetchone()
+                for (stamp, _rec) in _gen:
                     # Don't accumulate any results where there wasn't a record
                     # (signified by a null result)
                     if _rec and _rec[0] is not None:
                         if std_unit_system:
-                            if not (std_unit_system == _rec[1] == _rec[2]):
+                            # An interval without any records (possible with a 'count')
+                            # has no unit system, so it cannot conflict.
+                            if _rec[1] is not None and not (std_unit_system == _rec[1] == _rec[2]):
                                 raise weewx.UnsupportedFeature("Unit type cannot change "\
                                                                "within a time interval (%s vs %s vs %s)." %
                                                                (std_unit_system, _rec[1], _rec[2]))
@@ -770,9 +1711,8 @@ class Manager(object):
                         data_vec.append(_rec[0])
             else:
                 # No aggregation
-                sql_str = "SELECT dateTime, %s, usUnits, `interval` FROM %s "\
-                            "WHERE dateTime >= ? AND dateTime <= ?" % (sql_type, self.table_name)
-                for _rec in _cursor.execute(sql_str, (startstamp, stopstamp)):
+                for _rec in self._genColumns(['dateTime', sql_type, 'usUnits', 'interval'],
+                                             startstamp, stopstamp, _cursor, include_start=True):
                     start_vec.append(_rec[0] - _rec[3])
                     stop_vec.append(_rec[0])
                     if std_unit_system:
@@ -788,9 +1728,114 @@ class Manager(object):
         (time_type, time_group) = weewx.units.getStandardUnitType(std_unit_system, 'dateTime')
         (data_type, data_group) = weewx.units.getStandardUnitType(std_unit_system, sql_type, aggregate_type)
         return (ValueTuple(start_vec, time_type, time_group),
-                ValueTuple(stop_vec, time_type, time_group), 
+                ValueTuple(stop_vec, time_type, time_group),
                 ValueTuple(data_vec, data_type, data_group))
 
+    # Aggregation types that _genBucketAggregates knows how to calculate:
+    bucket_aggregates = ['sum', 'count', 'avg', 'max', 'min', 'last']
+
+    def _genBucketAggregates(self, sql_type, aggregate_type, span_seq, cursor):
+        """Generator function that calculates an aggregate over a sequence of
+        time spans using a single query against the archive table.
+
+        sql_type: The observation type to be aggregated.
+
+        aggregate_type: The type of aggregation. Must be one of bucket_aggregates.
+
+        span_seq: An iterable returning TimeSpans in increasing order, such as
+        that returned by weeutil.weeutil.intervalgen().
+
+        cursor: The cursor to be used.
+
+        yields: A sequence of 2-way tuples (span, row), where row is a 3-way
+        tuple (aggregate, min_unit_system, max_unit_system), the same as what
+        would be returned by the equivalent per-interval SQL query. Spans
+        without any rows are yielded only for aggregate type 'count'."""
+
+        span_list = list(span_seq)
+        if not span_list:
+            return
+
+        # A snapshot can do them all at once, with numpy:
+        if numpy is not None and self.snapshot is not None and \
+                self._memory_store(['dateTime', sql_type, 'usUnits'],
+                                   span_list[0].start, span_list[-1].stop) is self.snapshot:
+            for _result in self.snapshot.genBucketAggregates(sql_type, aggregate_type, span_list):
+                yield _result
+            return
+
+        # One set of statistics for each span:
+        # [count, sum, min, max, last, min_unit_system, max_unit_system]
+        stats_list = [None] * len(span_list)
+
+        ispan = 0
+        for (_ts, _val, _units) in self._genColumns(['dateTime', sql_type, 'usUnits'],
+                                                    span_list[0].start, span_list[-1].stop, cursor):
+            # Advance to the span that includes this timestamp. This is guaranteed
+            # to terminate because the query never returns anything beyond the last span.
+            while _ts > span_list[ispan].stop:
+                ispan += 1
+            if _ts <= span_list[ispan].start:
+                # The timestamp fell in a gap between spans.
+                continue
+            _stats = stats_list[ispan]
+            if _stats is None:
+                _stats = stats_list[ispan] = [0, None, None, None, None, _units, _units]
+            else:
+                _stats[5] = min(_stats[5], _units)
+                _stats[6] = max(_stats[6], _units)
+            if aggregate_type == 'last':
+                # For 'last', the unit system is that of the last record only
+                _stats[4] = _val
+                _stats[5] = _stats[6] = _units
+            elif _val is not None:
+                _stats[0] += 1
+                _stats[1] = _stats[1] + _val if _stats[0] > 1 else _val
+                if _stats[2] is None or _val < _stats[2]:
+                    _stats[2] = _val
+                if _stats[3] is None or _val > _stats[3]:
+                    _stats[3] = _val
+
+        for (_span, _stats) in zip(span_list, stats_list):
+            if _stats is None:
+                # No records at all in this span. Only a count has a value.
+                if aggregate_type == 'count':
+                    yield (_span, (0, None, None))
+                continue
+            (_count, _sum, _min, _max, _last, _min_units, _max_units) = _stats
+            if aggregate_type == 'count':
+                _result = _count
+            elif aggregate_type == 'sum':
+                _result = _sum
+            elif aggregate_type == 'avg':
+                _result = float(_sum) / _count if _count else None
+            elif aggregate_type == 'min':
+                _result = _min
+            elif aggregate_type == 'max':
+                _result = _max
+            else:
+                _result = _last
+            yield (_span, (_result, _min_units, _max_units))
+
+    def _genIntervalAggregates(self, sql_type, aggregate_type, span_seq, cursor):
+        """Generator function that calculates an aggregate over a sequence of
+        time spans, using one SQL query per time span. Slow, but it works for any
+        aggregate function the database supports.
+
+        yields: A sequence of 2-way tuples (span, row). See _genBucketAggregates."""
+
+        if aggregate_type == 'last':
+            sql_str = "SELECT %s, usUnits, usUnits FROM %%(table)s WHERE dateTime = "\
+                "(SELECT MAX(dateTime) FROM %%(table)s WHERE "\
+                "dateTime > ? AND dateTime <= ?)" % (sql_type,)
+        else:
+            sql_str = "SELECT %s(%s), MIN(usUnits), MAX(usUnits) FROM %%(table)s "\
+                "WHERE dateTime > ? AND dateTime <= ?" % (aggregate_type, sql_type)
+
+        for stamp in span_seq:
+            cursor.execute(sql_str % {'table' : self._archive_table_sql(stamp[0], stamp[1])}, stamp)
+            yield (stamp, cursor.fetchone())
+
 
 def reconfig(old_db_dict, new_db_dict, new_unit_system=None, new_schema=None):
     """Copy over an old archive to a new one, using a provided schema."""
@@ -802,7 +1847,7 @@ def reconfig(old_db_dict, new_db_dict, new_unit_system=None, new_schema=None):
         with Manager.open_with_create(new_db_dict, schema=new_schema) as new_archive:
 
             # Wrap the input generator in a unit converter.
-            record_generator = weewx.units.GenWithConvert(old_archive.genBatchRecords(), new_unit_system)
+            record_generator = weewx.units.GenWithConvert(old_archive.genRecordViews(), new_unit_system)
         
             # This is very fast because it is done in a single transaction
             # context:
@@ -812,23 +1857,598 @@ def reconfig(old_db_dict, new_db_dict, new_unit_system=None, new_schema=None):
 #                    Class DBBinder
 #===============================================================================
 
+class AggregateCache(object):
+    """Holds the results of aggregations, so they need not be calculated again
+    while the database does not change. See Manager.enable_aggregate_cache().
+
+    Each result is tagged with a generation: the time of the last record in
+    the database when it was calculated. If the timespan of the aggregation
+    reaches past that time, the result is good only until the generation
+    changes. If it does not, the timespan was closed, so the result stays
+    good until it gets invalidated. Once there are more than max_entries
+    results, the least recently used one is dropped.
+
+    USEFUL ATTRIBUTES
+
+    hits: The number of results found in the cache.
+
+    misses: The number of results that were not in the cache, or no longer good."""
+
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, generation):
+        """Return the result for key, or None if there is no good one."""
+        _entry = self.entries.pop(key, None)
+        if _entry is None or (_entry[2] != generation and (_entry[2] is None or _entry[1].stop > _entry[2])):
+            self.misses += 1
+            return None
+        # Put it back, as the most recently used:
+        self.entries[key] = _entry
+        self.hits += 1
+        return _entry[0]
+
+    def put(self, key, timespan, generation, result):
+        """Save the result for key, an aggregation over timespan."""
+        self.entries[key] = (result, timespan, generation)
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, start_ts, stop_ts):
+        """Drop the results for timespans that overlap the time from start_ts to stop_ts."""
+        for _key in [_key for (_key, _entry) in self.entries.iteritems()
+                     if _entry[1].start < stop_ts and _entry[1].stop > start_ts]:
+            del self.entries[_key]
+
+    def clear(self):
+        self.entries.clear()
+
+class RecordView(object):
+    """A read-only record dictionary, which looks up its values in a row of
+    the archive table. The keys, and the map from a key to its place in the
+    row, are shared by all the views of the rows returned by the same query,
+    so a view costs little more than the row itself.
+
+    Use dict(view) to get a dictionary that can be changed."""
+
+    __slots__ = ('_keys', '_index', '_row')
+
+    def __init__(self, keys, index, row):
+        """Initialize an object of type RecordView.
+
+        keys: The keys, in the order of the columns of the row.
+
+        index: A dictionary with the place of each key in the row.
+
+        row: The row."""
+        self._keys = keys
+        self._index = index
+        self._row = row
+
+    def __getitem__(self, key):
+        return self._row[self._index[key]]
+
+    def get(self, key, default=None):
+        i = self._index.get(key)
+        return self._row[i] if i is not None else default
+
+    def __contains__(self, key):
+        return key in self._index
+
+    has_key = __contains__
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    iterkeys = __iter__
+
+    def __len__(self):
+        return len(self._keys)
+
+    def keys(self):
+        return list(self._keys)
+
+    def values(self):
+        return list(self._row)
+
+    def itervalues(self):
+        return iter(self._row)
+
+    def items(self):
+        return zip(self._keys, self._row)
+
+    def iteritems(self):
+        return itertools.izip(self._keys, self._row)
+
+    def copy(self):
+        return dict(itertools.izip(self._keys, self._row))
+
+    def __eq__(self, other):
+        return self.copy() == (other.copy() if isinstance(other, RecordView) else other)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __repr__(self):
+        return repr(self.copy())
+
+class _ColumnStore(object):
+    """Archive records held one array per column, in time order, so queries
+    over them need not go to the database. Only numeric columns are held. They
+    hold floats, with NaN standing in for a null value. Integer columns are
+    converted back when the values are read.
+
+    Subclasses set the attributes columns, index, is_int and data, and
+    implement covers()."""
+
+    def __len__(self):
+        return len(self.data[self.index['dateTime']])
+
+    def _slice(self, start_ts, stop_ts, include_start=False):
+        """The indexes of the records from start_ts through stop_ts."""
+        _ts_data = self.data[self.index['dateTime']]
+        lo = bisect.bisect_left(_ts_data, start_ts) if include_start else bisect.bisect_right(_ts_data, start_ts)
+        hi = bisect.bisect_right(_ts_data, stop_ts) if stop_ts is not None else len(_ts_data)
+        return (lo, hi)
+
+    def values(self, column, lo, hi):
+        """Return a list of the values of column for the records lo through hi-1,
+        with None for a null value."""
+        i = self.index[column]
+        _vals = self.data[i][lo:hi]
+        if self.is_int[i]:
+            return [int(_val) if _val == _val else None for _val in _vals]
+        return [_val if _val == _val else None for _val in _vals]
+
+    def rows(self, columns, start_ts, stop_ts, include_start=False):
+        """Return a list of tuples with the values of the columns for the records
+        after start_ts (or from it, if include_start is True) through stop_ts.
+        If stop_ts is None, go through the last record."""
+        (lo, hi) = self._slice(start_ts, stop_ts, include_start)
+        return zip(*[self.values(_column, lo, hi) for _column in columns])
+
+    def nearest(self, columns, timestamp, max_delta=None):
+        """Return a tuple with the values of the columns for the record closest
+        to timestamp, no more than max_delta away, or None if there is none.
+        The earlier record wins a tie."""
+        (lo, hi) = self._slice(timestamp - (max_delta or 0), timestamp + (max_delta or 0), True)
+        if lo == hi:
+            return None
+        _ts_data = self.data[self.index['dateTime']]
+        i = min(xrange(lo, hi), key=lambda j: abs(_ts_data[j] - timestamp)) if hi - lo > 1 else lo
+        return tuple(self.values(_column, i, i + 1)[0] for _column in columns)
+
+    def aggregate(self, obs_type, aggregate_type, start_ts, stop_ts):
+        """Calculate an aggregate over the records after start_ts through stop_ts,
+        giving the same result as the archive table query of Manager.getAggregate()."""
+        (lo, hi) = self._slice(start_ts, stop_ts)
+        _good = [(_ts, _val) for (_ts, _val) in zip(self.values('dateTime', lo, hi),
+                                                     self.values(obs_type, lo, hi))
+                 if _val is not None]
+        if aggregate_type == 'count':
+            return len(_good)
+        if not _good:
+            return None
+        if aggregate_type == 'sum':
+            return sum(_val for (_ts, _val) in _good)
+        elif aggregate_type == 'avg':
+            return float(sum(_val for (_ts, _val) in _good)) / len(_good)
+        elif aggregate_type in ('min', 'mintime'):
+            # The first of any ties wins
+            _extreme = min(_good, key=lambda x: x[1])
+            return _extreme[1] if aggregate_type == 'min' else _extreme[0]
+        elif aggregate_type in ('max', 'maxtime'):
+            _extreme = max(_good, key=lambda x: x[1])
+            return _extreme[1] if aggregate_type == 'max' else _extreme[0]
+        elif aggregate_type == 'last':
+            return _good[-1][1]
+        elif aggregate_type == 'lasttime':
+            return _good[-1][0]
+        raise weewx.ViolatedPrecondition("Invalid aggregation type '%s'" % aggregate_type)
+
+class HotWindow(_ColumnStore):
+    """Holds the archive records of the most recent days in memory, one array
+    per column. See Manager.enable_hot_window().
+
+    Every record with a timestamp greater than start_ts is held. As new
+    records arrive, the oldest are dropped, to keep only the given number of
+    days, and no more than max_size bytes.
+
+    Only numeric columns are held, each as an array of floats, with NaN
+    standing in for a null value. Integer columns are converted back when the
+    values are read."""
+
+    def __init__(self, schema, days=35, max_size=20 * 1024 * 1024):
+        """Initialize an object of type HotWindow.
+
+        schema: A list of 2-way tuples (column_name, column_type) of the columns
+        to be held, where the type is as returned by genSchemaOf() of the
+        database connection. They must be numeric, and include 'dateTime'.
+
+        days: The number of days to be held, including the current one.
+
+        max_size: The maximum number of bytes used by the arrays."""
+
+        if [_column for (_column, _type) in schema if _type not in ('INTEGER', 'REAL')]:
+            raise weewx.ViolatedPrecondition("Only numeric columns can be held in a hot window")
+        self.columns = [_column for (_column, _type) in schema]
+        self.index = dict((_column, i) for (i, _column) in enumerate(self.columns))
+        self.is_int = [_type == 'INTEGER' for (_column, _type) in schema]
+        self.days = days
+        self.max_size = max_size
+        # Each value takes the 8 bytes of a float:
+        self.max_rows = max(1, max_size // (8 * len(self.columns)))
+        self.clear(None)
+
+    def clear(self, start_ts):
+        """Drop all records, then hold everything after start_ts. If start_ts is
+        None, nothing is held until the window is filled again with load()."""
+        self.start_ts = start_ts
+        self.data = [array.array('d') for _column in self.columns]
+
+    def load(self, row_seq, last_ts):
+        """Fill the window from rows of the archive table, in time order.
+
+        row_seq: An iterable returning rows with the columns of the window, in
+        order. It should return the rows after start_of_window(last_ts).
+
+        last_ts: The time of the last record in the archive, or None if it is
+        empty."""
+        self.clear(self.start_of_window(last_ts) if last_ts is not None else 0)
+        for _row in row_seq:
+            for (_column_data, _val) in zip(self.data, _row):
+                _column_data.append(_val if _val is not None else _NAN)
+            if len(self.data[0]) > 2 * self.max_rows:
+                self._trim()
+        self._trim()
+
+    def start_of_window(self, time_ts):
+        """The start of the window, if the last record is at time_ts."""
+        return weeutil.weeutil.archiveDaySpan(time_ts, days_ago=self.days - 1).start
+
+    def covers(self, start_ts, include_start=False, stop_ts=None):  # @UnusedVariable
+        """True if the window holds all records after start_ts, or from start_ts
+        if include_start is True. The window always reaches the last record, so
+        stop_ts does not matter."""
+        return self.start_ts is not None and start_ts is not None and \
+            (start_ts > self.start_ts or (start_ts == self.start_ts and not include_start))
+
+    def add_records(self, record_list):
+        """Add records that have been added to the archive."""
+        if self.start_ts is None:
+            return
+        _ts_data = self.data[self.index['dateTime']]
+        for _record in record_list:
+            if _record['dateTime'] <= self.start_ts:
+                continue
+            _values = [_record.get(_column) for _column in self.columns]
+            if not _ts_data or _record['dateTime'] > _ts_data[-1]:
+                for (_column_data, _val) in zip(self.data, _values):
+                    _column_data.append(_val if _val is not None else _NAN)
+            else:
+                # Out of order. This should be rare.
+                i = bisect.bisect_left(_ts_data, _record['dateTime'])
+                for (_column_data, _val) in zip(self.data, _values):
+                    _column_data.insert(i, _val if _val is not None else _NAN)
+        self._trim()
+
+    def update_value(self, timestamp, obs_type, new_value):
+        """Change a value that has been changed in the archive."""
+        if self.start_ts is None or obs_type not in self.index:
+            return
+        _ts_data = self.data[self.index['dateTime']]
+        i = bisect.bisect_left(_ts_data, timestamp)
+        if i < len(_ts_data) and _ts_data[i] == timestamp:
+            self.data[self.index[obs_type]][i] = new_value if new_value is not None else _NAN
+
+    def _trim(self):
+        """Drop the records that fall before the window, or beyond the size limit."""
+        _ts_data = self.data[self.index['dateTime']]
+        if not _ts_data:
+            return
+        _start_ts = max(self.start_ts, self.start_of_window(_ts_data[-1]))
+        ndrop = bisect.bisect_right(_ts_data, _start_ts)
+        if len(_ts_data) - ndrop > self.max_rows:
+            ndrop = len(_ts_data) - self.max_rows
+            _start_ts = int(_ts_data[ndrop - 1])
+        if ndrop:
+            for _column_data in self.data:
+                del _column_data[:ndrop]
+        self.start_ts = _start_ts
+
+_NAN = float('nan')
+
+class ArchiveSnapshot(_ColumnStore):
+    """A read-only copy of the archive records, in a file with one contiguous
+    array of floats per column. The file is memory-mapped, so only the parts
+    that are used get read. See Manager.save_snapshot() and
+    Manager.attach_snapshot().
+
+    The file starts with a magic string and the offset of the header. Then
+    come the arrays, each 'stride' values long, of which the first 'nrows'
+    are used, and finally the header, in JSON. Only numeric columns are held.
+
+    USEFUL ATTRIBUTES
+
+    path: The path of the snapshot file.
+
+    table_name: The name of the archive table it was made from.
+
+    std_unit_system: The unit system of the records.
+
+    stop_ts: The time of the last record in the archive when the snapshot was
+    made, or None if it was empty. All records through this time are held."""
+
+    magic = 'WXSNAP01'
+    preamble_format = '<8sQ'
+
+    def __init__(self, path):
+        """Initialize an object of type ArchiveSnapshot, by mapping a snapshot file.
+
+        path: The path of the snapshot file."""
+
+        self.path = path
+        self.file = open(path, 'rb')
+        try:
+            self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            (_magic, _header_offset) = struct.unpack_from(ArchiveSnapshot.preamble_format, self.buffer)
+            if _magic != ArchiveSnapshot.magic:
+                raise weewx.ViolatedPrecondition("File '%s' is not an archive snapshot" % path)
+            _header = json.loads(self.buffer[_header_offset:])
+            if _header['byteorder'] != sys.byteorder:
+                raise weewx.UnsupportedFeature("Snapshot '%s' was made on a machine with a different byte order"
+                                               % path)
+        except (struct.error, ValueError, KeyError, mmap.error), e:
+            self.file.close()
+            raise weewx.ViolatedPrecondition("Cannot read archive snapshot '%s': %s" % (path, e))
+        except Exception:
+            self.file.close()
+            raise
+
+        self.columns = [str(_column) for (_column, _type) in _header['columns']]
+        self.index = dict((_column, i) for (i, _column) in enumerate(self.columns))
+        self.is_int = [_type == 'INTEGER' for (_column, _type) in _header['columns']]
+        _start = struct.calcsize(ArchiveSnapshot.preamble_format)
+        self.data = [_MappedColumn(self.buffer, _start + 8 * _header['stride'] * i, _header['nrows'])
+                     for i in range(len(self.columns))]
+        self.table_name = str(_header['table_name'])
+        self.std_unit_system = _header['std_unit_system']
+        self.stop_ts = _header['stop_ts']
+
+    @staticmethod
+    def create(path, schema, row_seq, nrows, **header_dict):
+        """Write a snapshot file. It is written under a temporary name, then
+        renamed, so a snapshot in use is never seen half written.
+
+        path: The path of the snapshot file.
+
+        schema: A list of 2-way tuples (column_name, column_type) of the columns
+        to be held. They must be numeric, and include 'dateTime'.
+
+        row_seq: An iterable returning tuples with the values of the columns, in
+        time order.
+
+        nrows: The most rows row_seq can return.
+
+        header_dict: Anything else to be kept in the header.
+
+        returns: The number of rows written."""
+
+        _tmp_path = path + '.tmp'
+        _start = struct.calcsize(ArchiveSnapshot.preamble_format)
+        _batch_size = 10000
+        n = 0
+        try:
+            with open(_tmp_path, 'wb') as _file:
+                _file.write(struct.pack(ArchiveSnapshot.preamble_format, ArchiveSnapshot.magic, 0))
+                _row_iter = iter(row_seq)
+                while True:
+                    _batch = list(itertools.islice(_row_iter, _batch_size))
+                    if not _batch:
+                        break
+                    if n + len(_batch) > nrows:
+                        raise weewx.ViolatedPrecondition("More than %d rows for snapshot '%s'" % (nrows, path))
+                    for (i, _column_data) in enumerate(zip(*_batch)):
+                        _file.seek(_start + 8 * (nrows * i + n))
+                        _file.write(array.array('d', [_val if _val is not None else _NAN
+                                                      for _val in _column_data]).tostring())
+                    n += len(_batch)
+                _header_offset = _start + 8 * nrows * len(schema)
+                _file.seek(_header_offset)
+                _file.write(json.dumps(dict(header_dict, columns=schema, stride=nrows, nrows=n,
+                                            byteorder=sys.byteorder)))
+                _file.seek(0)
+                _file.write(struct.pack(ArchiveSnapshot.preamble_format, ArchiveSnapshot.magic, _header_offset))
+            os.rename(_tmp_path, path)
+        except Exception:
+            if os.path.exists(_tmp_path):
+                os.remove(_tmp_path)
+            raise
+        return n
+
+    def close(self):
+        self.data = []
+        self.buffer.close()
+        self.file.close()
+
+    def covers(self, start_ts, include_start=False, stop_ts=None):  # @UnusedVariable
+        """True if the snapshot holds all records through stop_ts. It holds
+        everything from the first record, so start_ts does not matter."""
+        return stop_ts is not None and self.stop_ts is not None and stop_ts <= self.stop_ts
+
+    def _vector(self, column, lo, hi):
+        """The values of a column for the records lo through hi-1, as a numpy
+        array mapped onto the file."""
+        return self.data[self.index[column]].vector(lo, hi)
+
+    def _value(self, column, val):
+        """Convert a float from a column to the value returned by the database."""
+        if val != val:
+            return None
+        return int(val) if self.is_int[self.index[column]] else float(val)
+
+    def aggregate(self, obs_type, aggregate_type, start_ts, stop_ts):
+        """Calculate an aggregate over the records after start_ts through stop_ts.
+        See _ColumnStore.aggregate(). Uses numpy, if it is installed."""
+        if numpy is None or aggregate_type not in ('count', 'sum', 'avg', 'min', 'mintime',
+                                                   'max', 'maxtime', 'last', 'lasttime'):
+            return _ColumnStore.aggregate(self, obs_type, aggregate_type, start_ts, stop_ts)
+        (lo, hi) = self._slice(start_ts, stop_ts)
+        _vals = self._vector(obs_type, lo, hi)
+        _good = numpy.flatnonzero(~numpy.isnan(_vals))
+        if aggregate_type == 'count':
+            return len(_good)
+        if not len(_good):
+            return None
+        if aggregate_type in ('sum', 'avg'):
+            _sum = self._value(obs_type, _vals[_good].sum())
+            return _sum if aggregate_type == 'sum' else float(_sum) / len(_good)
+        if aggregate_type in ('min', 'mintime'):
+            # numpy picks the first of any ties
+            i = _good[_vals[_good].argmin()]
+        elif aggregate_type in ('max', 'maxtime'):
+            i = _good[_vals[_good].argmax()]
+        else:
+            i = _good[-1]
+        if aggregate_type.endswith('time'):
+            return self._value('dateTime', self.data[self.index['dateTime']][lo + i])
+        return self._value(obs_type, _vals[i])
+
+    def genBucketAggregates(self, sql_type, aggregate_type, span_list):
+        """Calculate an aggregate over a list of time spans at once, using numpy.
+        Gives the same results as Manager._genBucketAggregates()."""
+
+        (lo, hi) = self._slice(span_list[0].start, span_list[-1].stop)
+        _ts = self._vector('dateTime', lo, hi)
+        _vals = self._vector(sql_type, lo, hi)
+        _units = self._vector('usUnits', lo, hi)
+        _starts = numpy.array([_span.start for _span in span_list], dtype=float)
+        _stops = numpy.array([_span.stop for _span in span_list], dtype=float)
+        # The span of each record. Those in the gaps between spans are dropped.
+        _ispan = numpy.searchsorted(_stops, _ts, side='left')
+        _in_span = _ts > _starts[_ispan]
+        (_ispan, _vals, _units) = (_ispan[_in_span], _vals[_in_span], _units[_in_span])
+
+        # The records of a span are contiguous. Find the first and last of each.
+        _first = numpy.flatnonzero(numpy.r_[True, _ispan[1:] != _ispan[:-1]]) if len(_ispan) else _ispan
+        _last = numpy.r_[_first[1:] - 1, len(_ispan) - 1] if len(_ispan) else _ispan
+        _good = ~numpy.isnan(_vals)
+        _count = numpy.bincount(_ispan[_good], minlength=len(span_list))
+        if aggregate_type in ('sum', 'avg'):
+            _sum = numpy.bincount(_ispan[_good], weights=_vals[_good], minlength=len(span_list))
+        elif aggregate_type in ('min', 'max'):
+            # The NaNs of the null values lose out to any other value:
+            _fill = numpy.inf if aggregate_type == 'min' else -numpy.inf
+            _reduce = numpy.minimum if aggregate_type == 'min' else numpy.maximum
+            _extreme = _reduce.reduceat(numpy.where(_good, _vals, _fill), _first) if len(_first) else _first
+        if aggregate_type == 'last':
+            (_min_units, _max_units) = (_units[_last], _units[_last])
+        else:
+            (_min_units, _max_units) = (numpy.minimum.reduceat(_units, _first) if len(_first) else _first,
+                                        numpy.maximum.reduceat(_units, _first) if len(_first) else _first)
+
+        _has_records = dict((int(_ispan[_first[j]]), j) for j in xrange(len(_first)))
+        for (k, _span) in enumerate(span_list):
+            j = _has_records.get(k)
+            if j is None:
+                # No records at all in this span. Only a count has a value.
+                if aggregate_type == 'count':
+                    yield (_span, (0, None, None))
+                continue
+            if aggregate_type == 'count':
+                _result = int(_count[k])
+            elif aggregate_type == 'last':
+                _result = self._value(sql_type, _vals[_last[j]])
+            elif not _count[k]:
+                _result = None
+            elif aggregate_type == 'sum':
+                _result = self._value(sql_type, _sum[k])
+            elif aggregate_type == 'avg':
+                _result = float(_sum[k]) / _count[k]
+            else:
+                _result = self._value(sql_type, _extreme[j])
+            yield (_span, (_result, int(_min_units[j]), int(_max_units[j])))
+
+class _MappedColumn(object):
+    """A column of an ArchiveSnapshot. Acts as a read-only sequence of floats."""
+
+    def __init__(self, buffer, offset, length):
+        self.buffer = buffer
+        self.offset = offset
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            (lo, hi, _step) = i.indices(self.length)
+            return array.array('d', self.buffer[self.offset + 8 * lo:self.offset + 8 * max(lo, hi)])
+        if i < 0:
+            i += self.length
+        if not 0 <= i < self.length:
+            raise IndexError("Snapshot index out of range")
+        return struct.unpack_from('d', self.buffer, self.offset + 8 * i)[0]
+
+    def vector(self, lo, hi):
+        """The values lo through hi-1 as a numpy array, without copying them."""
+        return numpy.frombuffer(self.buffer, dtype=float, count=max(0, hi - lo), offset=self.offset + 8 * lo)
+
+class _CacheKey(object):
+    """Stands in for an option that cannot be hashed, such as a dictionary, in
+    the key of an AggregateCache. It matches only the same object."""
+    def __init__(self, obj):
+        self.obj = obj
+    def __hash__(self):
+        return id(self.obj)
+    def __eq__(self, other):
+        return isinstance(other, _CacheKey) and self.obj is other.obj
+    def __ne__(self, other):
+        return not self.__eq__(other)
+    def __lt__(self, other):
+        return id(self.obj) < id(getattr(other, 'obj', other))
+
 class DBBinder(object):
     """Given a binding name, it returns the matching database as a managed object. Caches
     results."""
 
-    def __init__(self, config_dict):
-        """ Initialize a DBBinder object.
+    def __init__(self, config_dict, read_only=False, pool=None, persistent=False):
+        """ Initialize a DBBinder object.
+
+        config_dict: The configuration dictionary.
+        
+        read_only: If True, managers are opened on read-only connections, unless they are
+        to be initialized. Threads that only read the database should use this.
+
+        persistent: True if the binder, and the managers it opens, are to stay open for a
+        long time, such as those of the engine. See open_manager().
 
-        config_dict: The configuration dictionary. """
+        pool: An instance of ManagerPool. If given, managers are checked out of the pool,
+        then returned to it by close(), rather than opened and closed. Managers to be
+        initialized are always opened anew. """
 
         self.config_dict = config_dict           
+        self.read_only = read_only
+        self.pool = pool
+        self.persistent = persistent
         self.default_binding_dict = {}
         self.manager_cache = {}
+        self.pooled = set()
     
     def close(self):
         for data_binding in self.manager_cache.keys():
             try:
-                self.manager_cache[data_binding].close()
+                if data_binding in self.pooled:
+                    self.pooled.discard(data_binding)
+                    self.pool.checkin(self.manager_cache[data_binding])
+                else:
+                    self.manager_cache[data_binding].close()
                 del self.manager_cache[data_binding]
             except Exception:
                 pass
@@ -851,10 +2471,17 @@ class DBBinder(object):
             # If this binding has a set of defaults, use them. Otherwise, use the generic
             # defaults
             defaults = self.default_binding_dict.get(data_binding, default_binding_dict)
-            manager_dict = get_manager_dict_from_config(self.config_dict,
-                                                        data_binding, 
-                                                        default_binding_dict=defaults)
-            self.manager_cache[data_binding] = open_manager(manager_dict, initialize)
+            if self.pool is not None and not initialize:
+                self.manager_cache[data_binding] = self.pool.checkout(data_binding, self.read_only,
+                                                                      default_binding_dict=defaults)
+                self.pooled.add(data_binding)
+            else:
+                manager_dict = get_manager_dict_from_config(self.config_dict,
+                                                            data_binding, 
+                                                            default_binding_dict=defaults)
+                self.manager_cache[data_binding] = open_manager(manager_dict, initialize,
+                                                                read_only=self.read_only and not initialize,
+                                                                persistent=self.persistent)
 
         return self.manager_cache[data_binding]
     
@@ -871,6 +2498,180 @@ class DBBinder(object):
 
         return db_lookup
 
+#===============================================================================
+#                                 Class ManagerPool
+#===============================================================================
+
+class ManagerPool(object):
+    """A thread-safe pool of open managers. Threads that come and go, such as the
+    report thread, check managers out of the pool and back in again, rather than
+    opening a new connection each time.
+
+    A manager is used by only one thread at a time. Before a manager is handed
+    out again, it is brought up to date with refresh(). That is also its health
+    check: a manager that fails it is closed, and a new one opened in its
+    place.
+
+    A thread that already holds managers never waits for another: it may open
+    more than max_size, as a report can use any number of bindings. Managers
+    over the maximum are closed when they are checked in."""
+
+    def __init__(self, config_dict, max_size=5, max_idle=900, timeout=30):
+        """Initialize an instance of ManagerPool.
+
+        config_dict: The configuration dictionary.
+
+        max_size: The maximum number of managers that can be open at once, in
+        use or not, other than those of threads that already hold one.
+        [Optional. Default is 5]
+
+        max_idle: Managers left unused for this many seconds are closed.
+        [Optional. Default is 900]
+
+        timeout: How long checkout() waits for a manager, if the pool is at
+        its maximum size and all are in use by other threads.
+        [Optional. Default is 30]"""
+
+        self.config_dict = config_dict
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.timeout = timeout
+        # Key is (data_binding, read_only). Value is a list of (manager, time returned).
+        self.idle = {}
+        # Key is id(manager). Value is (key of the manager in self.idle, thread using it).
+        self.in_use = {}
+        # Key is a thread. Value is how many managers it has checked out.
+        self.holders = {}
+        self.size = 0
+        self.opened = 0
+        self.reused = 0
+        self.condition = threading.Condition()
+
+    def checkout(self, data_binding='wx_binding', read_only=False, default_binding_dict=None):
+        """Return a manager for a binding, for the use of the calling thread
+        alone, until it is given back with checkin().
+
+        Raises an exception of type weedb.OperationalError if no manager can
+        be had within the timeout, or the pool has been closed."""
+
+        _key = (data_binding, bool(read_only))
+        _thread = threading.current_thread()
+        _deadline = time.time() + self.timeout
+        with self.condition:
+            if self.idle is None:
+                raise weedb.OperationalError("Manager pool has been closed")
+            self._close_idle(time.time() - self.max_idle)
+            while True:
+                if self.idle.get(_key):
+                    _manager = self.idle[_key].pop()[0]
+                    break
+                if self.size < self.max_size or self._close_oldest() or _thread in self.holders:
+                    # Room for a new one. Reserve the spot, then open it outside the lock.
+                    _manager = None
+                    self.size += 1
+                    break
+                _wait = _deadline - time.time()
+                if _wait <= 0:
+                    raise weedb.OperationalError("No manager for binding '%s' free after %s seconds"
+                                                 % (data_binding, self.timeout))
+                self.condition.wait(_wait)
+
+        if _manager is not None:
+            try:
+                _manager.refresh()
+            except weedb.DatabaseError, e:
+                syslog.syslog(syslog.LOG_INFO, "manager: Closing stale manager for binding '%s': %s"
+                              % (data_binding, e))
+                _close_quietly(_manager)
+                _manager = None
+            else:
+                self.reused += 1
+        if _manager is None:
+            try:
+                _manager = self._open(data_binding, read_only, default_binding_dict)
+            except Exception:
+                with self.condition:
+                    self.size -= 1
+                    self.condition.notify()
+                raise
+            self.opened += 1
+
+        with self.condition:
+            self.in_use[id(_manager)] = (_key, _thread)
+            self.holders[_thread] = self.holders.get(_thread, 0) + 1
+        return _manager
+
+    def checkin(self, manager, discard=False):
+        """Give back a manager obtained from checkout(). If discard is True, or
+        the pool has been closed, or is over its maximum size, the manager
+        is closed."""
+        with self.condition:
+            (_key, _thread) = self.in_use.pop(id(manager))
+            self.holders[_thread] -= 1
+            if not self.holders[_thread]:
+                del self.holders[_thread]
+            if discard or self.idle is None or self.size > self.max_size:
+                self.size -= 1
+            else:
+                self.idle.setdefault(_key, []).append((manager, time.time()))
+                manager = None
+            self.condition.notify()
+        if manager is not None:
+            _close_quietly(manager)
+
+    def close(self):
+        """Close all managers not in use. Those in use are closed when they
+        are checked in."""
+        with self.condition:
+            _idle = self.idle
+            self.idle = None
+            for _manager_list in _idle.itervalues():
+                for (_manager, _ts) in _manager_list:
+                    _close_quietly(_manager)
+                    self.size -= 1
+        syslog.syslog(syslog.LOG_DEBUG, "manager: Manager pool opened %d, reused %d"
+                      % (self.opened, self.reused))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, etyp, einst, etb):  # @UnusedVariable
+        self.close()
+
+    def _open(self, data_binding, read_only, binding_defaults):
+        """Open a manager that can be passed from thread to thread."""
+        manager_dict = get_manager_dict_from_config(self.config_dict, data_binding,
+                                                    default_binding_dict=binding_defaults or default_binding_dict)
+        manager_dict['database_dict'] = dict(manager_dict['database_dict'], check_same_thread=False)
+        return open_manager(manager_dict, read_only=read_only, persistent=True)
+
+    def _close_idle(self, before_ts):
+        """Close the managers that have not been used since before_ts. Call
+        with the lock held."""
+        for _manager_list in self.idle.itervalues():
+            while _manager_list and _manager_list[0][1] < before_ts:
+                _close_quietly(_manager_list.pop(0)[0])
+                self.size -= 1
+
+    def _close_oldest(self):
+        """Close the manager that has gone unused the longest, to make room for
+        another. Call with the lock held. Returns False if there is none."""
+        _oldest = None
+        for _manager_list in self.idle.itervalues():
+            if _manager_list and (_oldest is None or _manager_list[0][1] < _oldest[0][1]):
+                _oldest = _manager_list
+        if _oldest is None:
+            return False
+        _close_quietly(_oldest.pop(0)[0])
+        self.size -= 1
+        return True
+
+def _close_quietly(manager):
+    try:
+        manager.close()
+    except Exception:
+        pass
+
 #===============================================================================
 #                                 Utilities
 #===============================================================================
@@ -950,6 +2751,28 @@ def get_database_dict_from_config(config_dict, database):
 #  database_dict: The database dictionary. This will be passed
 #      on to weedb.
 #
+def set_in_memory(config_dict, data_binding=None):
+    """Have the database of a binding held in memory while it is used, if the
+    driver supports it. See option in_memory of weedb.sqlite.
+
+    config_dict: The configuration dictionary. It is changed in place.
+
+    data_binding: The name of the binding. [Optional. If not given, all of
+    the databases are held in memory]"""
+
+    if data_binding is None:
+        database_list = config_dict.get('Databases', {}).keys()
+    else:
+        try:
+            database_list = [config_dict['DataBindings'][data_binding]['database']]
+        except KeyError, e:
+            raise weewx.UnknownBinding("Unknown data binding '%s'" % e)
+    for database in database_list:
+        try:
+            config_dict['Databases'][database]['in_memory'] = True
+        except KeyError, e:
+            raise weewx.UnknownDatabase("Unknown database '%s'" % e)
+
 def get_manager_dict_from_config(config_dict, data_binding,
                                  default_binding_dict=default_binding_dict):
     
@@ -985,6 +2808,10 @@ def get_manager_dict_from_config(config_dict, data_binding,
     else:
         # Schema is a string, with the name of the schema object
         manager_dict['schema'] = weeutil.weeutil._get_object(schema_name)
+
+    # A relative path to a snapshot is relative to WEEWX_ROOT:
+    if manager_dict.get('snapshot'):
+        manager_dict['snapshot'] = os.path.join(config_dict.get('WEEWX_ROOT', ''), manager_dict['snapshot'])
     
     return manager_dict
 
@@ -997,16 +2824,63 @@ def get_manager_dict(bindings_dict, databases_dict, data_binding,
     return get_manager_dict_from_config(bindings_dict.parent, data_binding, 
                                         default_binding_dict)
     
-def open_manager(manager_dict, initialize=False):
+def open_manager(manager_dict, initialize=False, read_only=False, persistent=False):
+    """Open a manager, as given by a manager dictionary.
+
+    initialize: If True, the database is initialized if it is not already.
+
+    read_only: If True, the manager is opened on a connection that cannot change
+    the database.
+
+    persistent: True if the manager is to stay open for a long time, such as the
+    one that writes the archive, or those in a ManagerPool. Only those hold the
+    most recent records in memory, as asked for by option hot_window_days.
+
+    returns: The manager."""
     
     manager_cls = weeutil.weeutil._get_object(manager_dict['manager'])
+    if read_only:
+        # Open the database on a connection that cannot modify it:
+        manager_dict = dict(manager_dict, database_dict=dict(manager_dict['database_dict'],
+                                                             read_only=True))
     if initialize:
-        return manager_cls.open_with_create(manager_dict['database_dict'],
-                                            manager_dict['table_name'],
-                                            manager_dict['schema'])
+        dbmanager = manager_cls.open_with_create(manager_dict['database_dict'],
+                                                 manager_dict['table_name'],
+                                                 manager_dict['schema'])
     else:
-        return manager_cls.open(manager_dict['database_dict'],
-                                manager_dict['table_name'])
+        dbmanager = manager_cls.open(manager_dict['database_dict'],
+                                     manager_dict['table_name'])
+    # Change the number of records inserted, or fetched, at a time if requested:
+    for option in ('insert_batch_size', 'fetch_batch_size'):
+        if manager_dict.get(option):
+            setattr(dbmanager, option, to_int(manager_dict[option]))
+    # Keep hourly summaries if requested. Only a manager that can write to the
+    # database can start them.
+    if not read_only and tobool(manager_dict.get('hourly_summaries', False)) \
+            and hasattr(dbmanager, 'enable_hourly_summaries'):
+        dbmanager.enable_hourly_summaries()
+    # Keep sketches with the daily summaries (a wind rose, for 'wind') if requested.
+    # Only a manager that can write to the database can start them.
+    quantile_types = weeutil.weeutil.option_as_list(manager_dict.get('quantile_types', []))
+    if not read_only and quantile_types and hasattr(dbmanager, 'enable_sketches'):
+        dbmanager.enable_sketches(quantile_types)
+    # Cache aggregates if requested:
+    aggregate_cache_size = to_int(manager_dict.get('aggregate_cache_size', 0))
+    if aggregate_cache_size:
+        dbmanager.enable_aggregate_cache(aggregate_cache_size)
+    # Hold the most recent records in memory if requested. Reading them in takes
+    # longer than a manager that is soon closed would save.
+    hot_window_days = to_int(manager_dict.get('hot_window_days', 0))
+    if hot_window_days and persistent:
+        dbmanager.enable_hot_window(hot_window_days,
+                                    int(float(manager_dict.get('hot_window_max_mb', 20)) * 1024 * 1024))
+    # A snapshot can stand in for the records it holds only if they cannot be changed:
+    if read_only and manager_dict.get('snapshot'):
+        try:
+            dbmanager.attach_snapshot(manager_dict['snapshot'])
+        except (IOError, weewx.ViolatedPrecondition, weewx.UnsupportedFeature), e:
+            syslog.syslog(syslog.LOG_ERR, "manager: Unable to use snapshot '%s': %s" % (manager_dict['snapshot'], e))
+    return dbmanager
     
 def open_manager_with_config(config_dict, data_binding,
                              initialize=False, default_binding_dict=default_binding_dict):
@@ -1036,7 +2910,7 @@ def drop_database_with_config(config_dict, data_binding,
 #
 #     Adds daily summaries to the database.
 # 
-#     This class specializes method _addSingleRecord so that it adds
+#     This class specializes method _addRecordBatch so that it adds
 #     the data to a daily summary, as well as the regular archive table.
 #     
 #     Note that a date does not include midnight --- that belongs
@@ -1055,12 +2929,116 @@ def drop_database_with_config(config_dict, data_binding,
 #
 #===============================================================================
 
+def _expand_aggregate_list(aggregate_list):
+    """Fill in any missing option dictionaries in a list of aggregations for
+    Manager.getAggregates()."""
+    for _aggregate in aggregate_list:
+        if len(_aggregate) == 2:
+            yield (_aggregate[0], _aggregate[1], {})
+        else:
+            yield (_aggregate[0], _aggregate[1], _aggregate[2] or {})
+
 def show_progress(nrec, last_time):
     """Utility function to show our progress while backfilling"""
     print >>sys.stdout, "Records processed: %d; Last date: %s\r" % \
         (nrec, weeutil.weeutil.timestamp_to_string(last_time)),
     sys.stdout.flush()
         
+def _quantile_of(aggregate_type, val=None):
+    """Return the quantile (between 0 and 1) asked for by an aggregation type
+    'median', 'pNN' (the NNth percentile, e.g. 'p95'), or 'percentile' with the
+    percentile given by val. None for any other type."""
+    aggregate_type = aggregate_type.lower()
+    if aggregate_type == 'median':
+        return 0.5
+    if aggregate_type == 'percentile':
+        if val is None:
+            raise weewx.ViolatedPrecondition("Aggregation type 'percentile' requires a value")
+        return float(val) / 100.0
+    _match = re.match(r'p(\d\d?)$', aggregate_type)
+    return int(_match.group(1)) / 100.0 if _match else None
+
+def _partition_year(time_ts):
+    """Return the year of the partition to which an archive record with timestamp
+    time_ts belongs. Like archive days, a year includes its end, but not its start."""
+    return time.localtime(time_ts - 1).tm_year
+
+def _partition_span(year):
+    """Return the time span of the archive records in the partition for a year."""
+    return weeutil.weeutil.TimeSpan(int(time.mktime((year, 1, 1, 0, 0, 0, 0, 0, -1))),
+                                    int(time.mktime((year + 1, 1, 1, 0, 0, 0, 0, 0, -1))))
+
+def _archive_hour_start(time_ts):
+    """Return the start of the hour to which an archive record with timestamp time_ts
+    belongs. Like archive days, an archive hour includes its end, but not its start.
+    Hours follow local time, so they always fall within an archive day."""
+    time_ts -= 1
+    time_tt = time.localtime(time_ts)
+    return int(time_ts) - time_tt.tm_min * 60 - time_tt.tm_sec
+
+def _is_hour_boundary(time_ts):
+    """True if time_ts is the start of a local hour."""
+    time_tt = time.localtime(time_ts)
+    return time_tt.tm_min == 0 and time_tt.tm_sec == 0 and time_ts == int(time_ts)
+
+def _init_backfill_worker():
+    """Initialize a worker process used by DaySummaryManager.backfill_day_summary().
+    Keyboard interrupts are left for the main process to handle."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def _backfill_worker(args):
+    """Build the daily summaries for archive records with startstamp < dateTime <= stopstamp,
+    where both are the start of a day.
+
+    args: A tuple (database_dict, table_name, weighted, startstamp, stopstamp, sketch_types,
+    want_hours). If weighted is True, statistics are weighted by the archive interval. A
+    sketch of each day is made for the types in sketch_types. Hourly statistics are made
+    only if want_hours is True.
+
+    returns: A tuple (nrecs, lastUpdate, day_list, hour_list), where day_list holds a
+    tuple (sod_ts, unit_system, stats_dict, sketch_dict) for each day with data, and
+    hour_list a tuple (hour_ts, stats_dict) for each hour with data. The sketches in
+    sketch_dict are strings. If want_hours is False, hour_list is empty. """
+    (database_dict, table_name, weighted, startstamp, stopstamp, sketch_types, want_hours) = args
+
+    day_list = []
+    hour_list = []
+    nrecs = 0
+    lastUpdate = None
+    with Manager.open(database_dict, table_name) as archive:
+        for day_span in weeutil.weeutil.genDaySpans(startstamp, stopstamp - 1):
+            # Read a day at a time, so the database does not stay locked while
+            # the records get processed
+            records = list(archive.genRecordViews(day_span.start, day_span.stop))
+            if not records:
+                continue
+            day_accum = weewx.accum.Accum(day_span)
+            for obs_type in sketch_types:
+                day_accum.add_sketch(obs_type)
+            hour_accum = None
+            for rec in records:
+                weight = 60.0 * rec['interval'] if weighted else 1.0
+                day_accum.addRecord(rec, weight=weight)
+                if not want_hours:
+                    continue
+                if hour_accum is None or not hour_accum.timespan.includesArchiveTime(rec['dateTime']):
+                    if hour_accum is not None:
+                        hour_list.append((hour_accum.timespan.start,
+                                          dict((obs_type, hour_accum[obs_type].getStatsTuple()) for obs_type in hour_accum)))
+                    hour_ts = _archive_hour_start(rec['dateTime'])
+                    hour_accum = weewx.accum.Accum(weeutil.weeutil.TimeSpan(hour_ts, hour_ts + 3600))
+                hour_accum.addRecord(rec, weight=weight)
+            if hour_accum is not None:
+                hour_list.append((hour_accum.timespan.start,
+                                  dict((obs_type, hour_accum[obs_type].getStatsTuple()) for obs_type in hour_accum)))
+            lastUpdate = max(lastUpdate, records[-1]['dateTime']) if lastUpdate else records[-1]['dateTime']
+            nrecs += len(records)
+            day_list.append((day_span.start, day_accum.unit_system,
+                             dict((obs_type, day_accum[obs_type].getStatsTuple()) for obs_type in day_accum),
+                             dict((obs_type, day_accum[obs_type].sketch.to_string()) for obs_type in sketch_types)))
+
+    return (nrecs, lastUpdate, day_list, hour_list)
+
 class DaySummaryManager(Manager):
     """Manage a daily statistical summary. 
     
@@ -1078,7 +3056,17 @@ class DaySummaryManager(Manager):
     sumtime is the sum of the archive intervals.
         
     In addition to all the tables for each type, there is one additional table called
-    'archive_day__metadata', which currently holds the time of the last update. """
+    'archive_day__metadata', which currently holds the time of the last update. 
+    
+    Alternatively, the summaries can use a 'wide' layout, where the statistics for all
+    types are kept in a single table called 'archive_day__wide', with one row per day.
+    Its columns are named after the type and the statistic, for example 'outTemp_min'.
+    See method convert_day_layout().
+
+    A sketch of each day can be kept for some types, in table 'archive_day__sketches'.
+    For scalar types, it is a quantile sketch, which allows aggregations such as the
+    median. For vector types such as wind, it is a wind rose. See method
+    enable_sketches(). """
     
     version = "2.0"
 
@@ -1091,38 +3079,90 @@ class DaySummaryManager(Manager):
     meta_create_str   = """CREATE TABLE %s_day__metadata (name CHAR(20) NOT NULL UNIQUE PRIMARY KEY, value TEXT);"""
     meta_replace_str  = """REPLACE INTO %s_day__metadata VALUES(?, ?)"""
     meta_select_str   = """SELECT value FROM %s_day__metadata WHERE name=?"""
+
+    # The table used by the 'wide' layout:
+    wide_table_str = "%s_day__wide"
+
+    # The table with the hourly summaries. It uses the same form as the
+    # 'wide' layout, with one row per hour:
+    hourly_table_str = "%s_day__hourly"
+
+    # The table with the sketches, with one row per type and day:
+    sketch_table_str = "%s_day__sketches"
+    sketch_create_str = "CREATE TABLE %s_day__sketches (obs_type CHAR(30) NOT NULL, dateTime INTEGER NOT NULL, "\
+      "sketch TEXT, PRIMARY KEY (obs_type, dateTime));"
+
+    # The statistics that can be kept for a type, in the order they appear in the
+    # daily summary tables, together with their SQL type. Only types such as wind
+    # use the last six.
+    day_stats = [('min', 'REAL'), ('mintime', 'INTEGER'), ('max', 'REAL'), ('maxtime', 'INTEGER'),
+                 ('sum', 'REAL'), ('count', 'INTEGER'), ('wsum', 'REAL'), ('sumtime', 'INTEGER'),
+                 ('max_dir', 'REAL'), ('xsum', 'REAL'), ('ysum', 'REAL'), ('dirsumtime', 'INTEGER'),
+                 ('squaresum', 'REAL'), ('wsquaresum', 'REAL')]
     
     # Set of SQL statements to be used for calculating aggregate statistics. Key is the aggregation type.
-    sqlDict = {'min'        : "SELECT MIN(min) FROM %(table_name)s_day_%(obs_key)s WHERE dateTime >= %(start)s AND dateTime < %(stop)s",
-               'minmax'     : "SELECT MIN(max) FROM %(table_name)s_day_%(obs_key)s WHERE dateTime >= %(start)s AND dateTime < %(stop)s",
-               'max'        : "SELECT MAX(max) FROM %(table_name)s_day_%(obs_key)s WHERE dateTime >= %(start)s AND dateTime < %(stop)s",
-               'maxmin'     : "SELECT MAX(min) FROM %(table_name)s_day_%(obs_key)s WHERE dateTime >= %(start)s AND dateTime < %(stop)s",
-               'meanmin'    : "SELECT AVG(min) FROM %(table_name)s_day_%(obs_key)s WHERE dateTime >= %(start)s AND dateTime < %(stop)s",
-               'meanmax'    : "SELECT AVG(max) FROM %(table_name)s_day_%(obs_key)s WHERE dateTime >= %(start)s AND dateTime < %(stop)s",
-               'maxsum'     : "SELECT MAX(sum) FROM %(table_name)s_day_%(obs_key)s WHERE dateTime >= %(start)s AND dateTime < %(stop)s",
-               'mintime'    : "SELECT mintime FROM %(table_name)s_day_%(obs_key)s  WHERE dateTime >= %(start)s AND dateTime < %(stop)s AND " \
-                              "min = (SELECT MIN(min) FROM %(table_name)s_day_%(obs_key)s WHERE dateTime >= %(start)s AND dateTime <%(stop)s)",
-               'maxmintime' : "SELECT mintime FROM %(table_name)s_day_%(obs_key)s  WHERE dateTime >= %(start)s AND dateTime < %(stop)s AND " \
-                              "min = (SELECT MAX(min) FROM %(table_name)s_day_%(obs_key)s WHERE dateTime >= %(start)s AND dateTime <%(stop)s)",
-               'maxtime'    : "SELECT maxtime FROM %(table_name)s_day_%(obs_key)s  WHERE dateTime >= %(start)s AND dateTime < %(stop)s AND " \
-                              "max = (SELECT MAX(max) FROM %(table_name)s_day_%(obs_key)s WHERE dateTime >= %(start)s AND dateTime <%(stop)s)",
-               'minmaxtime' : "SELECT maxtime FROM %(table_name)s_day_%(obs_key)s  WHERE dateTime >= %(start)s AND dateTime < %(stop)s AND " \
-                              "max = (SELECT MIN(max) FROM %(table_name)s_day_%(obs_key)s WHERE dateTime >= %(start)s AND dateTime <%(stop)s)",
-               'maxsumtime' : "SELECT maxtime FROM %(table_name)s_day_%(obs_key)s  WHERE dateTime >= %(start)s AND dateTime < %(stop)s AND " \
-                              "sum = (SELECT MAX(sum) FROM %(table_name)s_day_%(obs_key)s WHERE dateTime >= %(start)s AND dateTime <%(stop)s)",
-               'gustdir'    : "SELECT max_dir FROM %(table_name)s_day_%(obs_key)s  WHERE dateTime >= %(start)s AND dateTime < %(stop)s AND " \
-                              "max = (SELECT MAX(max) FROM %(table_name)s_day_%(obs_key)s WHERE dateTime >= %(start)s AND dateTime < %(stop)s)",
-               'sum'        : "SELECT SUM(sum) FROM %(table_name)s_day_%(obs_key)s WHERE dateTime >= %(start)s AND dateTime < %(stop)s",
-               'count'      : "SELECT SUM(count) FROM %(table_name)s_day_%(obs_key)s WHERE dateTime >= %(start)s AND dateTime < %(stop)s",
-               'avg'        : "SELECT SUM(wsum),SUM(sumtime) FROM %(table_name)s_day_%(obs_key)s WHERE dateTime >= %(start)s AND dateTime < %(stop)s",
-               'rms'        : "SELECT SUM(wsquaresum),SUM(sumtime) FROM %(table_name)s_day_%(obs_key)s WHERE dateTime >= %(start)s AND dateTime < %(stop)s",
-               'vecavg'     : "SELECT SUM(xsum),SUM(ysum),SUM(dirsumtime)  FROM %(table_name)s_day_%(obs_key)s WHERE dateTime >= %(start)s AND dateTime < %(stop)s",
-               'vecdir'     : "SELECT SUM(xsum),SUM(ysum) FROM %(table_name)s_day_%(obs_key)s WHERE dateTime >= %(start)s AND dateTime < %(stop)s",
-               'max_ge'     : "SELECT SUM(max >= %(val)s) FROM %(table_name)s_day_%(obs_key)s WHERE dateTime >= %(start)s AND dateTime < %(stop)s",
-               'max_le'     : "SELECT SUM(max <= %(val)s) FROM %(table_name)s_day_%(obs_key)s WHERE dateTime >= %(start)s AND dateTime < %(stop)s",
-               'min_ge'     : "SELECT SUM(min >= %(val)s) FROM %(table_name)s_day_%(obs_key)s WHERE dateTime >= %(start)s AND dateTime < %(stop)s",
-               'min_le'     : "SELECT SUM(min <= %(val)s) FROM %(table_name)s_day_%(obs_key)s WHERE dateTime >= %(start)s AND dateTime < %(stop)s",
-               'sum_ge'     : "SELECT SUM(sum >= %(val)s) FROM %(table_name)s_day_%(obs_key)s WHERE dateTime >= %(start)s AND dateTime < %(stop)s"}
+    sqlDict = {'min'        : "SELECT MIN(min) FROM %(day_table)s WHERE dateTime >= %(start)s AND dateTime < %(stop)s",
+               'minmax'     : "SELECT MIN(max) FROM %(day_table)s WHERE dateTime >= %(start)s AND dateTime < %(stop)s",
+               'max'        : "SELECT MAX(max) FROM %(day_table)s WHERE dateTime >= %(start)s AND dateTime < %(stop)s",
+               'maxmin'     : "SELECT MAX(min) FROM %(day_table)s WHERE dateTime >= %(start)s AND dateTime < %(stop)s",
+               'meanmin'    : "SELECT AVG(min) FROM %(day_table)s WHERE dateTime >= %(start)s AND dateTime < %(stop)s",
+               'meanmax'    : "SELECT AVG(max) FROM %(day_table)s WHERE dateTime >= %(start)s AND dateTime < %(stop)s",
+               'maxsum'     : "SELECT MAX(sum) FROM %(day_table)s WHERE dateTime >= %(start)s AND dateTime < %(stop)s",
+               'mintime'    : "SELECT mintime FROM %(day_table)s WHERE dateTime >= %(start)s AND dateTime < %(stop)s AND min IS NOT NULL " \
+                              "ORDER BY min ASC, dateTime ASC LIMIT 1",
+               'maxmintime' : "SELECT mintime FROM %(day_table)s WHERE dateTime >= %(start)s AND dateTime < %(stop)s AND min IS NOT NULL " \
+                              "ORDER BY min DESC, dateTime ASC LIMIT 1",
+               'maxtime'    : "SELECT maxtime FROM %(day_table)s WHERE dateTime >= %(start)s AND dateTime < %(stop)s AND max IS NOT NULL " \
+                              "ORDER BY max DESC, dateTime ASC LIMIT 1",
+               'minmaxtime' : "SELECT maxtime FROM %(day_table)s WHERE dateTime >= %(start)s AND dateTime < %(stop)s AND max IS NOT NULL " \
+                              "ORDER BY max ASC, dateTime ASC LIMIT 1",
+               'maxsumtime' : "SELECT maxtime FROM %(day_table)s WHERE dateTime >= %(start)s AND dateTime < %(stop)s AND sum IS NOT NULL " \
+                              "ORDER BY sum DESC, dateTime ASC LIMIT 1",
+               'gustdir'    : "SELECT max_dir FROM %(day_table)s WHERE dateTime >= %(start)s AND dateTime < %(stop)s AND max IS NOT NULL " \
+                              "ORDER BY max DESC, dateTime ASC LIMIT 1",
+               'sum'        : "SELECT SUM(sum) FROM %(day_table)s WHERE dateTime >= %(start)s AND dateTime < %(stop)s",
+               'count'      : "SELECT SUM(count) FROM %(day_table)s WHERE dateTime >= %(start)s AND dateTime < %(stop)s",
+               'avg'        : "SELECT SUM(wsum),SUM(sumtime) FROM %(day_table)s WHERE dateTime >= %(start)s AND dateTime < %(stop)s",
+               'rms'        : "SELECT SUM(wsquaresum),SUM(sumtime) FROM %(day_table)s WHERE dateTime >= %(start)s AND dateTime < %(stop)s",
+               'vecavg'     : "SELECT SUM(xsum),SUM(ysum),SUM(dirsumtime)  FROM %(day_table)s WHERE dateTime >= %(start)s AND dateTime < %(stop)s",
+               'vecdir'     : "SELECT SUM(xsum),SUM(ysum) FROM %(day_table)s WHERE dateTime >= %(start)s AND dateTime < %(stop)s",
+               'max_ge'     : "SELECT SUM(max >= %(val)s) FROM %(day_table)s WHERE dateTime >= %(start)s AND dateTime < %(stop)s",
+               'max_le'     : "SELECT SUM(max <= %(val)s) FROM %(day_table)s WHERE dateTime >= %(start)s AND dateTime < %(stop)s",
+               'min_ge'     : "SELECT SUM(min >= %(val)s) FROM %(day_table)s WHERE dateTime >= %(start)s AND dateTime < %(stop)s",
+               'min_le'     : "SELECT SUM(min <= %(val)s) FROM %(day_table)s WHERE dateTime >= %(start)s AND dateTime < %(stop)s",
+               'sum_ge'     : "SELECT SUM(sum >= %(val)s) FROM %(day_table)s WHERE dateTime >= %(start)s AND dateTime < %(stop)s"}
+
+    # The columns that getAggregates() selects for aggregations that can be done
+    # together in a single query. They give the same row as the query in sqlDict.
+    batch_sqlDict = {'min'     : ["MIN(%(prefix)smin)"],
+                     'minmax'  : ["MIN(%(prefix)smax)"],
+                     'max'     : ["MAX(%(prefix)smax)"],
+                     'maxmin'  : ["MAX(%(prefix)smin)"],
+                     'meanmin' : ["AVG(%(prefix)smin)"],
+                     'meanmax' : ["AVG(%(prefix)smax)"],
+                     'maxsum'  : ["MAX(%(prefix)ssum)"],
+                     'sum'     : ["SUM(%(prefix)ssum)"],
+                     'count'   : ["SUM(%(prefix)scount)"],
+                     'avg'     : ["SUM(%(prefix)swsum)", "SUM(%(prefix)ssumtime)"],
+                     'rms'     : ["SUM(%(prefix)swsquaresum)", "SUM(%(prefix)ssumtime)"],
+                     'vecavg'  : ["SUM(%(prefix)sxsum)", "SUM(%(prefix)sysum)", "SUM(%(prefix)sdirsumtime)"],
+                     'vecdir'  : ["SUM(%(prefix)sxsum)", "SUM(%(prefix)sysum)"]}
+
+    # The aggregates that can be calculated from the hourly summaries. The others
+    # count days, or rely on daily extremes, so do not apply to an hourly summary.
+    hour_aggregates = ['min', 'mintime', 'max', 'maxtime', 'gustdir', 'sum', 'count',
+                       'avg', 'rms', 'vecavg', 'vecdir']
+
+    # The aggregates that can be calculated over any timespan by merging the
+    # statistics of its pieces. See _plan_aggregate(). The last four are for
+    # vector types only.
+    hybrid_aggregates = ['min', 'mintime', 'max', 'maxtime', 'sum', 'count', 'avg',
+                         'rms', 'vecavg', 'vecdir', 'gustdir']
+    hybrid_vector_aggregates = ['rms', 'vecavg', 'vecdir', 'gustdir']
+
+    # For types derived from other observation types, the archive columns they
+    # are accumulated from:
+    hybrid_columns = {'wind': ('windSpeed', 'windDir', 'windGust', 'windGustDir')}
     
     def __init__(self, connection, table_name='archive', schema=None):
         """Initialize an instance of DaySummaryManager
@@ -1154,16 +3194,16 @@ class DaySummaryManager(Manager):
                           "manager: Created daily summary tables")
         
         # Get a list of all the observation types which have daily summaries
-        all_tables = self.connection.tables()
-        prefix = "%s_day_" % self.table_name
-        Nprefix = len(prefix)
-        meta_name = '%s_day__metadata' % self.table_name
-        self.daykeys = [x[Nprefix:] for x in all_tables if (x.startswith(prefix) and x != meta_name)]
+        self._init_day_layout()
         self.version = self._read_metadata('Version')
         syslog.syslog(syslog.LOG_DEBUG,
                       'manager: Daily summary version is %s' % self.version)
+        # The summary of the day most recently written to is kept in memory.
+        # See _get_day_cache().
+        self._invalidate_day_cache()
     
     def close(self):
+        self._invalidate_day_cache()
         del self.version
         # There will be no daykeys if the daily summaries have been dropped.
         try:
@@ -1172,6 +3212,161 @@ class DaySummaryManager(Manager):
             pass
         super(DaySummaryManager, self).close()
 
+    def refresh(self):
+        """Catch up with any changes made through other connections. The in-memory
+        summaries may be out of date, so they are dropped as well, along with the
+        cached aggregates that the changes to the daily summaries affect."""
+        super(DaySummaryManager, self).refresh()
+        self._invalidate_day_cache()
+        if self.aggregate_cache is not None:
+            self._check_aggregate_cache()
+
+    def enable_aggregate_cache(self, max_entries=1000):
+        """Specialized version that notes the time of the last update of the daily
+        summaries. See _check_aggregate_cache()."""
+        self._cache_lastUpdate = self._read_metadata('lastUpdate')
+        return super(DaySummaryManager, self).enable_aggregate_cache(max_entries)
+
+    def _check_aggregate_cache(self):
+        """Drop any cached aggregates made out of date by somebody else, who has
+        updated the daily summaries. If they only added records after the last
+        update, just the aggregates from the day of that update on are dropped.
+        Otherwise, all of them are."""
+        _last_update = self._read_metadata('lastUpdate')
+        if _last_update == self._cache_lastUpdate:
+            return
+        if self._cache_lastUpdate is not None and _last_update is not None \
+                and int(self._cache_lastUpdate) < int(_last_update) == self.lastGoodStamp():
+            self.aggregate_cache.invalidate(weeutil.weeutil.archiveDaySpan(int(self._cache_lastUpdate)).start,
+                                            weeutil.weeutil.archiveDaySpan(int(_last_update)).stop)
+        else:
+            syslog.syslog(syslog.LOG_DEBUG, "manager: Daily summary in '%s' modified externally. "
+                          "Dropping cached aggregates." % self.database_name)
+            self.aggregate_cache.clear()
+        self._cache_lastUpdate = _last_update
+
+    def _init_day_layout(self):
+        """Find the layout of the daily summaries, and the types they hold."""
+        all_tables = self.connection.tables()
+        wide_name = DaySummaryManager.wide_table_str % self.table_name
+        hourly_name = DaySummaryManager.hourly_table_str % self.table_name
+        sketch_name = DaySummaryManager.sketch_table_str % self.table_name
+        if wide_name in all_tables:
+            self.day_layout = 'wide'
+            (self.daykeys, self.day_columns) = self._parse_wide_columns(wide_name)
+        else:
+            self.day_layout = 'separate'
+            self.day_columns = None
+            prefix = "%s_day_" % self.table_name
+            Nprefix = len(prefix)
+            meta_name = '%s_day__metadata' % self.table_name
+            self.daykeys = [x[Nprefix:] for x in all_tables
+                            if (x.startswith(prefix) and x not in (meta_name, hourly_name, sketch_name))]
+
+        # Now the hourly summaries, which may not be there:
+        if hourly_name in all_tables:
+            (self.hourkeys, self.hour_columns) = self._parse_wide_columns(hourly_name)
+            self.hourly_start = to_int(self._read_metadata('hourlyStart'))
+        else:
+            self.hourkeys = []
+            self.hour_columns = None
+            self.hourly_start = None
+
+        # The types with sketches. Key is the type, value is the start of
+        # the first day from which there is a sketch for every day:
+        self.sketch_start = {}
+        if sketch_name in all_tables:
+            for _item in (self._read_metadata('sketchStart') or '').split(','):
+                if _item:
+                    (_obs_type, _start_ts) = _item.split(':')
+                    self.sketch_start[_obs_type] = int(_start_ts)
+
+    def _parse_wide_columns(self, table_name):
+        """Find the types held by a table with one row per time period, and the
+        statistics kept for each.
+
+        returns: A tuple (key_list, column_dict), where key_list is a list of the
+        types, and column_dict holds a list of statistics for each type."""
+        key_list = []
+        column_dict = {}
+        stat_names = [x[0] for x in DaySummaryManager.day_stats]
+        for column in self.connection.columnsOf(table_name)[1:]:
+            for stat in stat_names:
+                if column.endswith('_' + stat):
+                    obs_type = column[:-len(stat) - 1]
+                    if obs_type not in column_dict:
+                        key_list.append(obs_type)
+                        column_dict[obs_type] = []
+                    column_dict[obs_type].append(stat)
+                    break
+        return (key_list, column_dict)
+
+    def _create_wide_table(self, table_name, key_list, column_dict, cursor):
+        """Create a table with one row per time period, and a column for each
+        statistic of each type in key_list."""
+        _stat_types = dict(DaySummaryManager.day_stats)
+        _defs = ', '.join(["%s_%s %s" % (_key, _stat, _stat_types[_stat])
+                           for _key in key_list for _stat in column_dict[_key]])
+        cursor.execute("CREATE TABLE %s (dateTime INTEGER NOT NULL UNIQUE PRIMARY KEY, %s);" % (table_name, _defs))
+
+    def enable_hourly_summaries(self):
+        """Keep hourly summaries, with the same statistics as the daily summaries,
+        if they are not kept already. They cannot hold the hours before the latest
+        archive record. Those get filled in by a rebuild of the daily summaries.
+
+        returns: True if the table of hourly summaries was created."""
+        if self.hour_columns is not None:
+            return False
+        if self.day_layout == 'wide':
+            _column_dict = self.day_columns
+        else:
+            _column_dict = dict((_day_key, self.connection.columnsOf('%s_day_%s' % (self.table_name, _day_key))[1:])
+                                for _day_key in self.daykeys)
+        _stat_types = dict(DaySummaryManager.day_stats)
+        _key_list = [_day_key for _day_key in self.daykeys
+                     if all([_stat in _stat_types for _stat in _column_dict[_day_key]])]
+        # The first hour that will be complete:
+        _hourly_start = _archive_hour_start(self.last_timestamp) + 3600 if self.last_timestamp else 0
+
+        with weedb.Transaction(self.connection) as _cursor:
+            self._create_wide_table(DaySummaryManager.hourly_table_str % self.table_name,
+                                    _key_list, _column_dict, _cursor)
+            self._write_metadata('hourlyStart', str(_hourly_start), _cursor)
+        syslog.syslog(syslog.LOG_NOTICE, "manager: Created hourly summary table")
+        self._init_day_layout()
+        return True
+
+    def enable_sketches(self, obs_types):
+        """Keep a sketch of each day for the types in obs_types, so aggregations
+        such as 'median', 'p95', or 'rose' need not go through the archive records.
+        Types that already have sketches, or have no daily summaries, are left
+        alone. For the others, the sketches start with the day after the latest
+        archive record. A rebuild of the daily summaries fills in the days before.
+
+        returns: A list of the types for which sketches were started."""
+
+        _new_types = [_obs_type for _obs_type in obs_types
+                      if _obs_type not in self.sketch_start and _obs_type in self.daykeys]
+        if not _new_types:
+            return []
+        # The first day that will be complete:
+        _start_ts = int(weeutil.weeutil.archiveDaySpan(self.last_timestamp).stop) if self.last_timestamp else 0
+        _sketch_start = dict(self.sketch_start)
+        for _obs_type in _new_types:
+            _sketch_start[_obs_type] = _start_ts
+
+        with weedb.Transaction(self.connection) as _cursor:
+            if DaySummaryManager.sketch_table_str % self.table_name not in self.connection.tables():
+                _cursor.execute(DaySummaryManager.sketch_create_str % self.table_name)
+            self._write_sketch_start(_sketch_start, _cursor)
+        self.sketch_start = _sketch_start
+        syslog.syslog(syslog.LOG_NOTICE, "manager: Started daily sketches for %s" % ', '.join(_new_types))
+        return _new_types
+
+    def _write_sketch_start(self, sketch_start, cursor=None):
+        self._write_metadata('sketchStart', ','.join(["%s:%d" % (_obs_type, sketch_start[_obs_type])
+                                                        for _obs_type in sorted(sketch_start)]), cursor)
+
     def _initialize_day_tables(self, archiveSchema, cursor):  # @UnusedVariable
         """Initialize the tables needed for the daily summary."""
         # Create the tables needed for the daily summaries.
@@ -1182,26 +3377,44 @@ class DaySummaryManager(Manager):
         # Put the version number in it:
         self._write_metadata('Version', DaySummaryManager.version, cursor)
 
-    def _addSingleRecord(self, record, cursor, log_level):
+    def _addRecordBatch(self, record_list, cursor, log_level):
         """Specialized version that updates the daily summaries, as well as the 
         main archive table."""
         
-        # First let my superclass handle adding the record to the main archive table:
-        super(DaySummaryManager, self)._addSingleRecord(record, cursor, log_level=log_level)
+        # First let my superclass handle adding the records to the main archive table:
+        added_list = super(DaySummaryManager, self)._addRecordBatch(record_list, cursor, log_level=log_level)
 
-        # Get the start of day for the record:        
-        _sod_ts = weeutil.weeutil.startOfArchiveDay(record['dateTime'])
-        
-        # Get the weight
-        _weight = self._calc_weight(record)
+        # Then add the records that made it to the daily summary for the appropriate day:
+        for record in added_list:
+            # Get the start of day for the record:        
+            _sod_ts = weeutil.weeutil.startOfArchiveDay(record['dateTime'])
 
-        # Now add to the daily summary for the appropriate day:
-        _day_summary = self._get_day_summary(_sod_ts, cursor)
-        _day_summary.addRecord(record, weight=_weight)
-        self._set_day_summary(_day_summary, record['dateTime'], cursor)
-        syslog.syslog(log_level, "manager: Added record %s to daily summary in '%s'" % 
-                      (weeutil.weeutil.timestamp_to_string(record['dateTime']), 
-                       self.database_name))
+            # Get the weight
+            _weight = self._calc_weight(record)
+
+            # Now add to the daily summary for the appropriate day:
+            _day_summary = self._get_day_cache(_sod_ts, cursor)
+            _day_summary.addRecord(record, weight=_weight)
+            # ... and to the hourly summary:
+            if self.hour_columns is not None:
+                _hour_summary = self._get_hour_cache(_archive_hour_start(record['dateTime']), cursor)
+                _hour_summary.addRecord(record, weight=_weight)
+            self._day_pending_update = record['dateTime']
+
+        # Write the changes, including any left by _updateHiLo, in one go:
+        self._flush_day_cache(cursor)
+
+        if len(added_list) == 1:
+            syslog.syslog(log_level, "manager: Added record %s to daily summary in '%s'" % 
+                          (weeutil.weeutil.timestamp_to_string(added_list[0]['dateTime']), 
+                           self.database_name))
+        elif added_list:
+            syslog.syslog(log_level, "manager: Added %d records %s through %s to daily summary in '%s'" % 
+                          (len(added_list),
+                           weeutil.weeutil.timestamp_to_string(added_list[0]['dateTime']),
+                           weeutil.weeutil.timestamp_to_string(added_list[-1]['dateTime']),
+                           self.database_name))
+        return added_list
         
     def _updateHiLo(self, accumulator, cursor):
         """Use the contents of an accumulator to update the daily hi/lows."""
@@ -1210,12 +3423,31 @@ class DaySummaryManager(Manager):
         _sod_ts = weeutil.weeutil.startOfArchiveDay(accumulator.timespan.stop)
 
         # Retrieve the daily summaries seen so far:
-        _stats_dict = self._get_day_summary(_sod_ts, cursor)
+        _stats_dict = self._get_day_cache(_sod_ts, cursor)
         # Update them with the contents of the accumulator:
         _stats_dict.updateHiLo(accumulator)
-        # Then save the results:
-        self._set_day_summary(_stats_dict, accumulator.timespan.stop, cursor)
+        # Same with the hourly summaries:
+        if self.hour_columns is not None:
+            _hour_summary = self._get_hour_cache(_archive_hour_start(accumulator.timespan.stop), cursor)
+            try:
+                _hour_summary.updateHiLo(accumulator)
+            except weewx.accum.OutOfSpan:
+                # The accumulator covers more than the hour. Its hi/lows cannot
+                # be placed, so the hourly summary keeps those of the archive record.
+                pass
+        # The results get saved along with the archive record that follows:
+        self._day_pending_update = accumulator.timespan.stop
+
+    def addRecord(self, record_obj, log_level=syslog.LOG_NOTICE, accumulator=None):
+        """Specialized version that discards the in-memory daily summary if
+        the transaction fails, because it no longer matches the database."""
+        try:
+            super(DaySummaryManager, self).addRecord(record_obj, log_level, accumulator)
+        except Exception:
+            self._invalidate_day_cache()
+            raise
         
+    @_cache_aggregate
     def getAggregate(self, timespan, obs_type, aggregate_type, **option_dict):
         """Returns an aggregation of a statistical type for a given time period.
         It will use the daily summaries if possible, otherwise the archive table.
@@ -1235,20 +3467,29 @@ class DaySummaryManager(Manager):
         type is unknown. The second element is the unit type (eg, 'degree_F').
         The third element is the unit group (eg, "group_temperature") """
         
+        # Quantiles and wind roses come from the sketches, where there are any:
+        _q = _quantile_of(aggregate_type, option_dict.get('val'))
+        if _q is not None or aggregate_type == 'rose':
+            return self._sketch_aggregate(self._get_sketch(timespan, obs_type), obs_type, aggregate_type, _q)
+
         # We can use the day summary optimizations if the starting and ending times of
         # the aggregation interval sit on midnight boundaries, or are the first or last
         # records in the database.
-        if aggregate_type in ['last', 'lasttime'] or not (isMidnight(timespan.start) or \
-                                                          timespan.start == self.first_timestamp) \
-                                                  or not (isMidnight(timespan.stop)  or \
-                                                          timespan.stop  == self.last_timestamp):
+        use_days = (isMidnight(timespan.start) or timespan.start == self.first_timestamp) \
+               and (isMidnight(timespan.stop)  or timespan.stop  == self.last_timestamp)
+        if aggregate_type in ['last', 'lasttime'] or not (use_days or self._use_hours(timespan, obs_type, aggregate_type)):
             
-            # Cannot use the day summaries. We'll have to calculate the aggregate
-            # using the regular archive table:
+            # Cannot use the summaries for the whole timespan. See if it can be
+            # put together from summaries of the whole days (or hours) inside it,
+            # plus the archive records at either end:
+            _plan = self._plan_aggregate(timespan, obs_type, aggregate_type)
+            if _plan:
+                return self._get_hybrid_aggregate(_plan, obs_type, aggregate_type.lower())
+            # No. We'll have to calculate the aggregate using the regular archive table:
             return Manager.getAggregate(self, timespan, obs_type, aggregate_type, 
                                           **option_dict)
 
-        # We can use the daily summaries. Proceed.
+        # We can use the daily (or hourly) summaries. Proceed.
                 
         # This entry point won't work for heating or cooling degree days:
         if weewx.debug:
@@ -1276,16 +3517,98 @@ class DaySummaryManager(Manager):
         aggregate_type = aggregate_type.lower()
 
         # Form the interpolation dictionary        
-        interDict = {'start'         : weeutil.weeutil.startOfDay(timespan.start),
+        interDict = {'start'         : weeutil.weeutil.startOfDay(timespan.start) if use_days else timespan.start,
                      'stop'          : timespan.stop,
                      'obs_key'       : obs_type,
                      'aggregate_type': aggregate_type,
                      'val'           : target_val,
                      'table_name'    : self.table_name}
+        if use_days:
+            interDict['day_table'] = self._day_table_sql(obs_type, interDict['start'], interDict['stop'])
+        else:
+            # The hourly summaries have the same statistics, so the same queries work on them:
+            interDict['day_table'] = self._wide_table_sql(DaySummaryManager.hourly_table_str % self.table_name,
+                                                          self.hour_columns, obs_type,
+                                                          interDict['start'], interDict['stop'])
             
         # Run the query against the database:
         _row = self.getSql(DaySummaryManager.sqlDict[aggregate_type] % interDict)
 
+        _result = DaySummaryManager._calc_aggregate(aggregate_type, _row)
+
+        # Look up the unit type and group of this combination of stats type and aggregation:
+        (t, g) = weewx.units.getStandardUnitType(self.std_unit_system, obs_type, aggregate_type)
+        # Form the value tuple and return it:
+        return weewx.units.ValueTuple(_result, t, g)
+        
+    def getAggregates(self, timespan, aggregate_list):
+        """Specialized version that calculates aggregations from the same daily
+        (or hourly) summary table together, in a single query.
+
+        returns: A dictionary with key (obs_type, aggregate_type), and a value
+        tuple as value. See getAggregate()."""
+
+        use_days = (isMidnight(timespan.start) or timespan.start == self.first_timestamp) \
+               and (isMidnight(timespan.stop)  or timespan.stop  == self.last_timestamp)
+
+        _results = {}
+        # Key is the table, value is a list of the aggregations to be done on it:
+        _batch_dict = {}
+        # Key is the aggregation, value its key in the aggregate cache:
+        _cache_keys = {}
+        for (obs_type, aggregate_type, option_dict) in _expand_aggregate_list(aggregate_list):
+            _table = None
+            if aggregate_type in DaySummaryManager.batch_sqlDict and option_dict.get('val') is None \
+                    and (aggregate_type not in DaySummaryManager.hybrid_vector_aggregates
+                         or isinstance(weewx.accum.new_accumulator(obs_type), weewx.accum.VecStats)):
+                if use_days and obs_type in self.daykeys:
+                    _table = 'day' if self.day_layout == 'wide' else obs_type
+                elif self._use_hours(timespan, obs_type, aggregate_type):
+                    _table = 'hour'
+            if _table is None:
+                _results[(obs_type, aggregate_type)] = self.getAggregate(timespan, obs_type, aggregate_type,
+                                                                         **option_dict)
+                continue
+            if self.aggregate_cache is not None:
+                (_cache_keys[(obs_type, aggregate_type)], _result) = \
+                    self._lookup_aggregate(timespan, obs_type, aggregate_type, option_dict)
+                if _result is not None:
+                    _results[(obs_type, aggregate_type)] = _result
+                    continue
+            _batch_dict.setdefault(_table, []).append((obs_type, aggregate_type))
+
+        for (_table, _batch_list) in _batch_dict.iteritems():
+            # Statistics are in columns <obs_type>_<stat> in the wide tables, <stat> otherwise:
+            if _table == 'day':
+                _table_name = DaySummaryManager.wide_table_str % self.table_name
+            elif _table == 'hour':
+                _table_name = DaySummaryManager.hourly_table_str % self.table_name
+            else:
+                _table_name = "%s_day_%s" % (self.table_name, _table)
+            _start = weeutil.weeutil.startOfDay(timespan.start) if _table != 'hour' else timespan.start
+            _exprs = []
+            for (obs_type, aggregate_type) in _batch_list:
+                _prefix = obs_type + '_' if _table in ('day', 'hour') else ''
+                _exprs.extend([_expr % {'prefix' : _prefix} for _expr in DaySummaryManager.batch_sqlDict[aggregate_type]])
+            _row = self.getSql("SELECT %s FROM %s WHERE dateTime >= ? AND dateTime < ?"
+                               % (','.join(_exprs), _table_name), (_start, timespan.stop))
+            # Hand each aggregation its part of the row:
+            i = 0
+            for (obs_type, aggregate_type) in _batch_list:
+                _n = len(DaySummaryManager.batch_sqlDict[aggregate_type])
+                _result = DaySummaryManager._calc_aggregate(aggregate_type, _row[i:i + _n] if _row else None)
+                (t, g) = weewx.units.getStandardUnitType(self.std_unit_system, obs_type, aggregate_type)
+                _results[(obs_type, aggregate_type)] = weewx.units.ValueTuple(_result, t, g)
+                if self.aggregate_cache is not None:
+                    self._save_aggregate(_cache_keys[(obs_type, aggregate_type)], timespan,
+                                         _results[(obs_type, aggregate_type)])
+                i += _n
+        return _results
+
+    @staticmethod
+    def _calc_aggregate(aggregate_type, _row):
+        """Calculate an aggregate from the row returned by its query in sqlDict."""
+
         #=======================================================================
         # Each aggregation type requires a slightly different calculation.
         #=======================================================================
@@ -1325,11 +3648,191 @@ class DaySummaryManager(Manager):
             # Unknown aggregation. Return None
             _result = None
 
+        return _result
+
+    def _use_hours(self, timespan, obs_type, aggregate_type):
+        """True if an aggregate over timespan can be calculated from the hourly
+        summaries. Both ends of timespan must sit on an hour boundary, although
+        the end may also be the last record in the database, and the hourly
+        summaries must be complete over the timespan."""
+        return self.hour_columns is not None \
+            and obs_type in self.hour_columns \
+            and aggregate_type.lower() in DaySummaryManager.hour_aggregates \
+            and self.hourly_start is not None and timespan.start >= self.hourly_start \
+            and _is_hour_boundary(timespan.start) \
+            and (_is_hour_boundary(timespan.stop) or timespan.stop == self.last_timestamp)
+
+    def _plan_aggregate(self, timespan, obs_type, aggregate_type):
+        """Split a timespan into pieces which can be aggregated separately: whole
+        days from the daily summaries, whole hours from the hourly summaries, and
+        what is left from the archive table.
+
+        returns: A list of tuples (source, TimeSpan) in time order, where source
+        is one of 'day', 'hour' or 'archive'. None if the aggregate cannot be put
+        together from pieces, or if all of it would come from the archive table."""
+
+        aggregate_type = aggregate_type.lower()
+        if obs_type not in self.daykeys or aggregate_type not in DaySummaryManager.hybrid_aggregates:
+            return None
+        if aggregate_type in DaySummaryManager.hybrid_vector_aggregates \
+                and not isinstance(weewx.accum.new_accumulator(obs_type), weewx.accum.VecStats):
+            return None
+
+        # The whole days inside the timespan:
+        if isMidnight(timespan.start) or timespan.start == self.first_timestamp:
+            _day_start = timespan.start
+        else:
+            _day_start = weeutil.weeutil.archiveDaySpan(timespan.start, grace=0).stop
+        if isMidnight(timespan.stop) or timespan.stop == self.last_timestamp:
+            _day_stop = timespan.stop
+        else:
+            _day_stop = weeutil.weeutil.startOfDay(timespan.stop)
+
+        if _day_start < _day_stop:
+            _plan = self._plan_hours(weeutil.weeutil.TimeSpan(timespan.start, _day_start), obs_type) + \
+                    [('day', weeutil.weeutil.TimeSpan(_day_start, _day_stop))] + \
+                    self._plan_hours(weeutil.weeutil.TimeSpan(_day_stop, timespan.stop), obs_type)
+        else:
+            _plan = self._plan_hours(timespan, obs_type)
+
+        if all([_source == 'archive' for (_source, _span) in _plan]):
+            return None
+        return _plan
+
+    def _plan_hours(self, timespan, obs_type):
+        """Like _plan_aggregate(), but for pieces of less than a day, which can
+        only use the hourly summaries and the archive table."""
+
+        if timespan.start >= timespan.stop:
+            return []
+        if self.hour_columns is None or obs_type not in self.hour_columns or self.hourly_start is None:
+            return [('archive', timespan)]
+
+        # The whole hours inside the timespan, for which there are hourly summaries:
+        if _is_hour_boundary(timespan.start):
+            _hour_start = timespan.start
+        else:
+            _hour_start = _archive_hour_start(timespan.start + 1) + 3600
+        _hour_start = max(_hour_start, self.hourly_start)
+        if _is_hour_boundary(timespan.stop) or timespan.stop == self.last_timestamp:
+            _hour_stop = timespan.stop
+        else:
+            _hour_stop = _archive_hour_start(timespan.stop + 1)
+
+        if _hour_start >= _hour_stop or not _is_hour_boundary(_hour_start):
+            return [('archive', timespan)]
+        _plan = [('hour', weeutil.weeutil.TimeSpan(_hour_start, _hour_stop))]
+        if timespan.start < _hour_start:
+            _plan.insert(0, ('archive', weeutil.weeutil.TimeSpan(timespan.start, _hour_start)))
+        if _hour_stop < timespan.stop:
+            _plan.append(('archive', weeutil.weeutil.TimeSpan(_hour_stop, timespan.stop)))
+        return _plan
+
+    def _get_hybrid_aggregate(self, plan, obs_type, aggregate_type):
+        """Calculate an aggregate from the pieces of a timespan given by
+        _plan_aggregate(). The statistics of the pieces are merged, just as the
+        statistics of archive records are merged into a daily summary."""
+
+        _stats = weewx.accum.new_accumulator(obs_type)
+        for (_source, _span) in plan:
+            for _piece_stats in self._gen_piece_stats(_source, _span, obs_type):
+                _stats.mergeHiLo(_piece_stats)
+                _stats.mergeSum(_piece_stats)
+
+        # Same calculations as for the daily summaries:
+        if not _stats.count:
+            _result = _stats.count if aggregate_type == 'count' else None
+        elif aggregate_type in ['min', 'max', 'sum', 'count']:
+            _result = getattr(_stats, aggregate_type)
+        elif aggregate_type in ['mintime', 'maxtime']:
+            _result = int(getattr(_stats, aggregate_type))
+        elif aggregate_type == 'gustdir':
+            _result = _stats.max_dir
+        elif aggregate_type == 'avg':
+            # The plain average of the archive records, as AVG() in the archive
+            # table would give, rather than the average weighted by time:
+            _result = _stats.sum / _stats.count
+        elif aggregate_type == 'rms':
+            _result = math.sqrt(_stats.wsquaresum / _stats.sumtime) if _stats.sumtime else None
+        elif aggregate_type == 'vecavg':
+            _result = math.sqrt((_stats.xsum**2 + _stats.ysum**2) / _stats.dirsumtime**2) if _stats.dirsumtime else None
+        elif aggregate_type == 'vecdir':
+            if _stats.xsum == 0.0 and _stats.ysum == 0.0:
+                _result = None
+            else:
+                deg = 90.0 - math.degrees(math.atan2(_stats.ysum, _stats.xsum))
+                _result = deg if deg >= 0 else deg + 360.0
+
         # Look up the unit type and group of this combination of stats type and aggregation:
         (t, g) = weewx.units.getStandardUnitType(self.std_unit_system, obs_type, aggregate_type)
         # Form the value tuple and return it:
         return weewx.units.ValueTuple(_result, t, g)
-        
+
+    def _gen_piece_stats(self, source, timespan, obs_type):
+        """Generate the statistics of obs_type for a piece of a timespan, as
+        instances of ScalarStats or VecStats, in time order."""
+
+        if source == 'archive':
+            # Accumulate the archive records, as would be done for the daily summary:
+            _columns = ['dateTime', 'usUnits', 'interval'] + \
+                [_obs_type for _obs_type in DaySummaryManager.hybrid_columns.get(obs_type, (obs_type,))
+                 if _obs_type in self.sqlkeys]
+            _accum = weewx.accum.Accum(timespan)
+            for _row in self._genColumns(_columns, timespan.start, timespan.stop):
+                _record = dict(zip(_columns, _row))
+                _accum.addRecord(_record, weight=self._calc_weight(_record))
+            if obs_type in _accum:
+                yield _accum[obs_type]
+            return
+
+        if source == 'day':
+            _start = weeutil.weeutil.startOfDay(timespan.start)
+            _table_sql = self._day_table_sql(obs_type, _start, timespan.stop)
+        else:
+            _start = timespan.start
+            _table_sql = self._wide_table_sql(DaySummaryManager.hourly_table_str % self.table_name,
+                                              self.hour_columns, obs_type, _start, timespan.stop)
+        for _row in self.genSql("SELECT * FROM %s WHERE dateTime >= ? AND dateTime < ? ORDER BY dateTime ASC"
+                                % _table_sql, (_start, timespan.stop)):
+            # A period without data for the type has no count.
+            if not _row[6]:
+                continue
+            _piece_stats = weewx.accum.new_accumulator(obs_type)
+            _piece_stats.setStats(_row[1:])
+            yield _piece_stats
+
+    def _get_sketch(self, timespan, obs_type):
+        """Return a sketch of the values of obs_type within timespan. The
+        sketches of the whole days inside timespan are merged, where there are
+        any. The rest comes from the archive records."""
+
+        if obs_type not in self.sketch_start:
+            return self._archive_sketch(timespan, obs_type)
+
+        # The whole days inside the timespan, for which there are sketches:
+        if isMidnight(timespan.start):
+            _day_start = timespan.start
+        else:
+            _day_start = weeutil.weeutil.archiveDaySpan(timespan.start, grace=0).stop
+        _day_start = max(_day_start, self.sketch_start[obs_type])
+        if isMidnight(timespan.stop) or timespan.stop == self.last_timestamp:
+            _day_stop = timespan.stop
+        else:
+            _day_stop = weeutil.weeutil.startOfDay(timespan.stop)
+        if _day_start >= _day_stop:
+            return self._archive_sketch(timespan, obs_type)
+
+        _sketch = weewx.accum.new_sketch(obs_type)
+        for (_sketch_str,) in self.genSql("SELECT sketch FROM %s WHERE obs_type = ? AND dateTime >= ? AND dateTime < ?"
+                                          % (DaySummaryManager.sketch_table_str % self.table_name),
+                                          (obs_type, _day_start, _day_stop)):
+            _sketch.merge(weewx.accum.new_sketch(obs_type, _sketch_str))
+        # Then the pieces on either side:
+        for (_start, _stop) in ((timespan.start, _day_start), (_day_stop, timespan.stop)):
+            if _start < _stop:
+                _sketch.merge(self._archive_sketch(weeutil.weeutil.TimeSpan(_start, _stop), obs_type))
+        return _sketch
+
     def exists(self, obs_type):
         """Checks whether the observation type exists in the database."""
 
@@ -1342,7 +3845,7 @@ class DaySummaryManager(Manager):
         return self.exists(obs_type) and self.getAggregate(timespan, obs_type, 'count')[0] != 0
 
     def backfill_day_summary(self, start_d=None, stop_d=None,
-                             progress_fn=show_progress, trans_days=5):
+                             progress_fn=show_progress, trans_days=5, processes=1):
         
         """Fill the daily summaries from an archive database.
           
@@ -1367,6 +3870,11 @@ class DaySummaryManager(Manager):
         trans_day: Number of days of archive data to be used for each daily
         summaries database transaction. [Optional. Default is 5.] 
           
+        processes: If greater than 1, the daily summaries are built by this many
+        worker processes, each working on a different set of trans_days days,
+        while this process writes them to the database. Requires a manager opened
+        with open() or open_with_create(). [Optional. Default is 1.]
+          
         returns: A 2-way tuple (nrecs, ndays) where 
           nrecs is the number of records backfilled;
           ndays is the number of days
@@ -1427,26 +3935,38 @@ class DaySummaryManager(Manager):
                                              (timestamp_to_string(lastUpdate), 
                                               timestamp_to_string(lastRecord)))
     
+        if processes > 1:
+            if self.database_dict is not None:
+                return self._backfill_parallel(start_d, stop_d, lastUpdate,
+                                               progress_fn, trans_days, processes)
+            syslog.syslog(syslog.LOG_INFO, "manager: Database dictionary unknown. Backfilling in a single process.")
+
         nrecs = 0
         ndays = 0
+        self._invalidate_day_cache()
+        if self.aggregate_cache is not None:
+            self.aggregate_cache.invalidate(time.mktime(start_d.timetuple()),
+                                            time.mktime((stop_d + datetime.timedelta(days=1)).timetuple()))
+        first_d = start_d
          
         while start_d <= stop_d:
             # Calculate the last date included in this transaction
             stop_transaction = min(stop_d, start_d + datetime.timedelta(days=(trans_days-1)))
             day_accum = None
+            hour_accum = None
 
             with weedb.Transaction(self.connection) as cursor:
                 # Go through all the archive records in the time span, adding them to the
                 # daily summaries
                 start_batch = time.mktime(start_d.timetuple())
                 stop_batch  = time.mktime((stop_transaction + datetime.timedelta(days=1)).timetuple())
-                for rec in self.genBatchRecords(start_batch, stop_batch):
+                for rec in self.genRecordViews(start_batch, stop_batch):
                     # If this is the very first record, fetch a new accumulator
                     if not day_accum:
                         # Get a TimeSpan that include's the record's timestamp:
                         timespan = weeutil.weeutil.archiveDaySpan(rec['dateTime'])
                         # Get an empty day accumulator:
-                        day_accum = weewx.accum.Accum(timespan)
+                        day_accum = self._new_day_accum(timespan)
                     weight = self._calc_weight(rec)
                     # Try updating. If the time is out of the accumulator's time span, an
                     # exception will get raised.
@@ -1459,9 +3979,17 @@ class DaySummaryManager(Manager):
                         ndays += 1
                         # Get a new accumulator:
                         timespan = weeutil.weeutil.archiveDaySpan(rec['dateTime'])
-                        day_accum = weewx.accum.Accum(timespan)
+                        day_accum = self._new_day_accum(timespan)
                         # try again
                         day_accum.addRecord(rec, weight=weight)
+                    # Hours fall within a day, so the hourly summaries can be done alongside
+                    if self.hour_columns is not None:
+                        if hour_accum is None or not hour_accum.timespan.includesArchiveTime(rec['dateTime']):
+                            if hour_accum is not None:
+                                self._set_hour_summary(hour_accum, cursor)
+                            hour_ts = _archive_hour_start(rec['dateTime'])
+                            hour_accum = weewx.accum.Accum(weeutil.weeutil.TimeSpan(hour_ts, hour_ts + 3600))
+                        hour_accum.addRecord(rec, weight=weight)
                       
                     lastUpdate = max(lastUpdate, rec['dateTime']) if lastUpdate else rec['dateTime']
                     nrecs += 1
@@ -1472,6 +4000,8 @@ class DaySummaryManager(Manager):
                 if day_accum and not day_accum.isEmpty:
                     self._set_day_summary(day_accum, None, cursor)
                     ndays += 1
+                if hour_accum is not None:
+                    self._set_hour_summary(hour_accum, cursor)
                 # Patch lastUpdate:
                 if lastUpdate:
                     self._write_metadata('lastUpdate', str(int(lastUpdate)), cursor)
@@ -1479,6 +4009,9 @@ class DaySummaryManager(Manager):
             # Advance
             start_d += datetime.timedelta(days=trans_days)
 
+        self._extend_hourly_start(first_d, stop_d)
+        self._extend_sketch_start(first_d, stop_d)
+
         tdiff = time.time() - t1             
         if nrecs:
             syslog.syslog(syslog.LOG_INFO, 
@@ -1489,6 +4022,112 @@ class DaySummaryManager(Manager):
         
         return (nrecs, ndays)
 
+    def _backfill_parallel(self, start_d, stop_d, lastUpdate, progress_fn, trans_days, processes):
+        """Backfill the days start_d through stop_d, with the daily summaries built
+        by a pool of worker processes. The results are written in date order, one
+        transaction for every trans_days days, so lastUpdate advances just as it
+        does for a backfill done in a single process."""
+
+        # The workers only read the archive, which they can do from the file:
+        _database_dict = dict(self.database_dict, in_memory=False) if self.database_dict is not None else None
+
+        def _gen_args(start_d):
+            while start_d <= stop_d:
+                stop_transaction = min(stop_d, start_d + datetime.timedelta(days=(trans_days-1)))
+                start_batch = time.mktime(start_d.timetuple())
+                stop_batch  = time.mktime((stop_transaction + datetime.timedelta(days=1)).timetuple())
+                yield (_database_dict, self.table_name, self.version >= '2.0', start_batch, stop_batch,
+                       sorted(self.sketch_start), self.hour_columns is not None)
+                start_d += datetime.timedelta(days=trans_days)
+
+        t1 = time.time()
+        nrecs = 0
+        ndays = 0
+        self._invalidate_day_cache()
+        if self.aggregate_cache is not None:
+            self.aggregate_cache.invalidate(time.mktime(start_d.timetuple()),
+                                            time.mktime((stop_d + datetime.timedelta(days=1)).timetuple()))
+        first_d = start_d
+
+        pool = multiprocessing.Pool(processes, _init_backfill_worker)
+        try:
+            results = pool.imap(_backfill_worker, _gen_args(start_d))
+            while True:
+                # Wait with a timeout, so a keyboard interrupt gets through
+                try:
+                    (_nrecs, _lastUpdate, _day_list, _hour_list) = results.next(timeout=5)
+                except multiprocessing.TimeoutError:
+                    continue
+                except StopIteration:
+                    break
+                with weedb.Transaction(self.connection) as cursor:
+                    for (_sod_ts, _unit_system, _stats_dict, _sketch_dict) in _day_list:
+                        self._check_unit_system(_unit_system)
+                        self._write_day_stats(_sod_ts, dict((_summary_type, _stats_dict[_summary_type])
+                                                            for _summary_type in _stats_dict
+                                                            if _summary_type in self.daykeys), cursor)
+                        for (_obs_type, _sketch_str) in _sketch_dict.iteritems():
+                            self._write_sketch(_obs_type, _sod_ts, _sketch_str, cursor)
+                    for (_hour_ts, _stats_dict) in _hour_list:
+                        self._write_wide_row(DaySummaryManager.hourly_table_str % self.table_name,
+                                             self.hour_columns, _hour_ts,
+                                             dict((_summary_type, _stats_dict[_summary_type])
+                                                  for _summary_type in _stats_dict
+                                                  if _summary_type in self.hour_columns), cursor)
+                    # Patch lastUpdate:
+                    lastUpdate = max(lastUpdate, _lastUpdate) if lastUpdate else _lastUpdate
+                    if lastUpdate:
+                        self._write_metadata('lastUpdate', str(int(lastUpdate)), cursor)
+                nrecs += _nrecs
+                ndays += len(_day_list)
+                if progress_fn and _nrecs:
+                    progress_fn(nrecs, _lastUpdate)
+        except:
+            pool.terminate()
+            raise
+        else:
+            pool.close()
+        finally:
+            pool.join()
+
+        self._extend_hourly_start(first_d, stop_d)
+        self._extend_sketch_start(first_d, stop_d)
+
+        tdiff = time.time() - t1
+        if nrecs:
+            syslog.syslog(syslog.LOG_INFO, 
+                          "manager: Processed %d records to backfill %d day summaries in %.2f seconds using %d processes"
+                          % (nrecs, ndays, tdiff, processes))
+        else:
+            syslog.syslog(syslog.LOG_INFO,
+                          "manager: Daily summaries up to date")
+
+        return (nrecs, ndays)
+
+    def _extend_hourly_start(self, start_d, stop_d):
+        """The hourly summaries have been rebuilt for the days start_d through
+        stop_d. If that joins up with the hours already covered, they are now
+        complete from the start of start_d."""
+        if self.hourly_start is None:
+            return
+        start_ts = int(time.mktime(start_d.timetuple()))
+        stop_ts  = int(time.mktime((stop_d + datetime.timedelta(days=1)).timetuple()))
+        if start_ts < self.hourly_start <= stop_ts:
+            with weedb.Transaction(self.connection) as _cursor:
+                self._write_metadata('hourlyStart', str(start_ts), _cursor)
+            self.hourly_start = start_ts
+
+    def _extend_sketch_start(self, start_d, stop_d):
+        """Like _extend_hourly_start(), but for the sketches."""
+        start_ts = int(time.mktime(start_d.timetuple()))
+        stop_ts  = int(time.mktime((stop_d + datetime.timedelta(days=1)).timetuple()))
+        _sketch_start = dict((_obs_type, start_ts if start_ts < _start_ts <= stop_ts else _start_ts)
+                               for (_obs_type, _start_ts) in self.sketch_start.iteritems())
+        if _sketch_start != self.sketch_start:
+            with weedb.Transaction(self.connection) as _cursor:
+                self._write_sketch_start(_sketch_start, _cursor)
+            self.sketch_start = _sketch_start
+
     #--------------------------- UTILITY FUNCTIONS -----------------------------------
 
     def _get_day_summary(self, sod_ts, cursor=None):
@@ -1505,20 +4144,133 @@ class DaySummaryManager(Manager):
         _cursor = cursor or self.connection.cursor()
 
         try:
-            # For each observation type, execute the SQL query and hand the results on
-            # to the accumulator.
+            # Hand the statistics of each observation type on to the accumulator.
+            _stats_dict = self._read_day_stats(_day_accum.timespan.start, _cursor)
             for _day_key in self.daykeys:
-                _cursor.execute("SELECT * FROM %s_day_%s WHERE dateTime = ?" % (self.table_name, _day_key), (_day_accum.timespan.start,))
-                _row = _cursor.fetchone()
-                # If the date does not exist in the database yet then _row will be None.
-                _stats_tuple = _row[1:] if _row is not None else None
-                _day_accum.set_stats(_day_key, _stats_tuple)
+                _day_accum.set_stats(_day_key, _stats_dict[_day_key])
             
             return _day_accum
         finally:
             if not cursor:
                 _cursor.close()
 
+    def _get_day_cache(self, sod_ts, cursor):
+        """Return the accumulator for the day starting at sod_ts, held in memory.
+
+        Successive records usually fall in the same day, so the accumulator is
+        kept between calls and updated in place. It is reloaded from the
+        database only when the day rolls over, or when somebody else has
+        updated the daily summaries since it was last written. Changes are
+        written out by _flush_day_cache()."""
+
+        if self._day_accum is not None:
+            if self._read_metadata('lastUpdate', cursor) != self._day_lastUpdate:
+                # The daily summaries were modified behind our back.
+                syslog.syslog(syslog.LOG_DEBUG, "manager: Daily summary in '%s' modified externally. Reloading."
+                              % self.database_name)
+                self._invalidate_day_cache()
+            elif self._day_accum.timespan.start == sod_ts:
+                return self._day_accum
+            else:
+                # Rolling over to a new day. Save what we have first.
+                self._flush_day_cache(cursor)
+
+        self._day_accum = weewx.accum.Accum(weeutil.weeutil.archiveDaySpan(sod_ts, 0))
+        self._day_stored = self._read_day_stats(self._day_accum.timespan.start, cursor)
+        for _day_key in self.daykeys:
+            self._day_accum.set_stats(_day_key, self._day_stored[_day_key])
+        for _obs_type in self.sketch_start:
+            self._sketch_stored[_obs_type] = self._read_sketch(_obs_type, self._day_accum.timespan.start, cursor)
+            self._day_accum.add_sketch(_obs_type, weewx.accum.new_sketch(_obs_type, self._sketch_stored[_obs_type]))
+        self._day_lastUpdate = self._read_metadata('lastUpdate', cursor)
+        return self._day_accum
+
+    def _get_hour_cache(self, hour_ts, cursor):
+        """Return the accumulator for the hour starting at hour_ts, held in memory
+        like that of _get_day_cache(). It must be called after _get_day_cache(),
+        which takes care of changes made by somebody else."""
+
+        if self._hour_accum is not None:
+            if self._hour_accum.timespan.start == hour_ts:
+                return self._hour_accum
+            self._flush_hour_cache(cursor)
+
+        self._hour_accum = weewx.accum.Accum(weeutil.weeutil.TimeSpan(hour_ts, hour_ts + 3600))
+        self._hour_stored = self._read_wide_row(DaySummaryManager.hourly_table_str % self.table_name,
+                                                self.hourkeys, self.hour_columns, hour_ts, cursor)
+        for _hour_key in self.hourkeys:
+            self._hour_accum.set_stats(_hour_key, self._hour_stored[_hour_key])
+        return self._hour_accum
+
+    def _flush_hour_cache(self, cursor):
+        """Write the in-memory hourly summary, if it has changed."""
+
+        if self._hour_accum is None:
+            return
+        _all_stats = dict((_summary_type, self._hour_accum[_summary_type].getStatsTuple())
+                          for _summary_type in self._hour_accum if _summary_type in self.hour_columns)
+        if [_summary_type for _summary_type in _all_stats
+            if self._hour_stored.get(_summary_type) != _all_stats[_summary_type]]:
+            self._write_wide_row(DaySummaryManager.hourly_table_str % self.table_name, self.hour_columns,
+                                 self._hour_accum.timespan.start, _all_stats, cursor)
+            self._hour_stored.update(_all_stats)
+
+    def _set_hour_summary(self, hour_accum, cursor):
+        """Write all statistics for an hour to the database."""
+        _stats_dict = dict((_summary_type, hour_accum[_summary_type].getStatsTuple())
+                           for _summary_type in hour_accum if _summary_type in self.hour_columns)
+        self._write_wide_row(DaySummaryManager.hourly_table_str % self.table_name, self.hour_columns,
+                             hour_accum.timespan.start, _stats_dict, cursor)
+
+    def _flush_day_cache(self, cursor):
+        """Write any statistics in the in-memory daily summary that differ from
+        what is in the database, then update the time of the last update."""
+
+        if self._day_accum is None:
+            return
+
+        # Make sure the new data uses the same unit system as the database. An
+        # accumulator that has only been loaded does not know its unit system yet.
+        if self._day_accum.unit_system is not None:
+            self._check_unit_system(self._day_accum.unit_system)
+
+        _all_stats = dict((_summary_type, self._day_accum[_summary_type].getStatsTuple())
+                          for _summary_type in self._day_accum if _summary_type in self.daykeys)
+        # Skip the types that have not changed since they were last read or written:
+        _changed = dict((_summary_type, _stats_tuple) for (_summary_type, _stats_tuple) in _all_stats.iteritems()
+                        if self._day_stored.get(_summary_type) != _stats_tuple)
+        if _changed:
+            # The wide layout keeps a day in a single row, which gets written as a whole.
+            if self.day_layout == 'wide':
+                _changed = _all_stats
+            self._write_day_stats(self._day_accum.timespan.start, _changed, cursor)
+            self._day_stored.update(_changed)
+        for _obs_type in self.sketch_start:
+            # A day loaded before the sketches were started has none:
+            if _obs_type not in self._day_accum or self._day_accum[_obs_type].sketch is None:
+                continue
+            _sketch_str = self._day_accum[_obs_type].sketch.to_string()
+            if _sketch_str != self._sketch_stored.get(_obs_type):
+                self._write_sketch(_obs_type, self._day_accum.timespan.start, _sketch_str, cursor)
+                self._sketch_stored[_obs_type] = _sketch_str
+        self._flush_hour_cache(cursor)
+
+        if self._day_pending_update is not None:
+            self._day_lastUpdate = str(int(self._day_pending_update))
+            self._write_metadata('lastUpdate', self._day_lastUpdate, cursor)
+            self._day_pending_update = None
+
+    def _invalidate_day_cache(self):
+        """Forget the in-memory daily and hourly summaries. They will be reloaded
+        when next needed."""
+        self._day_accum = None
+        self._day_stored = {}
+        self._sketch_stored = {}
+        self._day_lastUpdate = None
+        self._day_pending_update = None
+        self._hour_accum = None
+        self._hour_stored = {}
+
     def _set_day_summary(self, day_accum, lastUpdate, cursor):
         """Write all statistics for a day to the database in a single transaction.
         
@@ -1533,29 +4285,202 @@ class DaySummaryManager(Manager):
 
         _sod = day_accum.timespan.start
 
-        # For each daily summary type...
-        for _summary_type in day_accum:
-            # Don't try an update for types not in the database:
-            if _summary_type not in self.daykeys:
-                continue
-            # ... get the stats tuple to be written to the database...
-            _write_tuple = (_sod,) + day_accum[_summary_type].getStatsTuple()
-            # ... and an appropriate SQL command with the correct number of question marks ...
-            _qmarks = ','.join(len(_write_tuple)*'?')
-            _sql_replace_str = "REPLACE INTO %s_day_%s VALUES(%s)" % (self.table_name, _summary_type, _qmarks)
-            # ... and write to the database. In case the type doesn't appear in the database,
-            # be prepared to catch an exception:
-            try:
-                cursor.execute(_sql_replace_str, _write_tuple)
-            except weedb.OperationalError, e:
-                syslog.syslog(syslog.LOG_ERR, "manager: "
-                              "Replace failed for database %s: %s"
-                              % (self.database_name, e))
+        # Any in-memory copy of this day is about to be out of date:
+        if self._day_accum is not None and self._day_accum.timespan.start == _sod:
+            self._invalidate_day_cache()
+
+        # Get the stats tuple of each daily summary type. Don't try an update
+        # for types not in the database:
+        _stats_dict = dict((_summary_type, day_accum[_summary_type].getStatsTuple())
+                           for _summary_type in day_accum if _summary_type in self.daykeys)
+        self._write_day_stats(_sod, _stats_dict, cursor)
+        for _obs_type in self.sketch_start:
+            if _obs_type in day_accum and day_accum[_obs_type].sketch is not None:
+                self._write_sketch(_obs_type, _sod, day_accum[_obs_type].sketch.to_string(), cursor)
 
         # If requested, update the time of the last daily summary update:
         if lastUpdate is not None:
             self._write_metadata('lastUpdate',  str(int(lastUpdate)), cursor)
 
+    def _read_day_stats(self, sod_ts, cursor):
+        """Read the statistics for the day starting at sod_ts.
+
+        returns: A dictionary with the stats tuple of each type. The tuple is None
+        if the database holds nothing for the type on that day."""
+
+        if self.day_layout == 'wide':
+            return self._read_wide_row(DaySummaryManager.wide_table_str % self.table_name,
+                                       self.daykeys, self.day_columns, sod_ts, cursor)
+        _stats_dict = {}
+        for _day_key in self.daykeys:
+            cursor.execute("SELECT * FROM %s_day_%s WHERE dateTime = ?" % (self.table_name, _day_key), (sod_ts,))
+            _row = cursor.fetchone()
+            # If the date does not exist in the database yet then _row will be None.
+            _stats_dict[_day_key] = tuple(_row[1:]) if _row is not None else None
+        return _stats_dict
+
+    def _write_day_stats(self, sod_ts, stats_dict, cursor):
+        """Write the statistics for the day starting at sod_ts.
+
+        stats_dict: A dictionary with the stats tuple of each type to be written.
+        With the wide layout, the whole row for the day gets replaced, so any
+        type missing from the dictionary is left with nulls."""
+
+        if self.day_layout == 'wide':
+            self._write_wide_row(DaySummaryManager.wide_table_str % self.table_name,
+                                 self.day_columns, sod_ts, stats_dict, cursor)
+            return
+        for (_summary_type, _stats_tuple) in stats_dict.iteritems():
+            _write_tuple = (sod_ts,) + tuple(_stats_tuple)
+            # Get an appropriate SQL command with the correct number of question marks:
+            _qmarks = ','.join(len(_write_tuple)*'?')
+            self._replace_row("REPLACE INTO %s_day_%s VALUES(%s)" % (self.table_name, _summary_type, _qmarks),
+                              _write_tuple, cursor)
+
+    def _read_wide_row(self, table_name, key_list, column_dict, row_ts, cursor):
+        """Read the statistics of the types in key_list from the row for row_ts in a
+        table with one row per time period, such as the wide layout."""
+        _columns = ["%s_%s" % (_key, _stat) for _key in key_list for _stat in column_dict[_key]]
+        cursor.execute("SELECT %s FROM %s WHERE dateTime = ?" % (','.join(_columns), table_name), (row_ts,))
+        _row = cursor.fetchone()
+        _stats_dict = {}
+        _i = 0
+        for _key in key_list:
+            _n = len(column_dict[_key])
+            _stats_tuple = tuple(_row[_i:_i + _n]) if _row is not None else None
+            # A type with no data for the period has nothing but nulls.
+            if _stats_tuple is not None and _stats_tuple.count(None) == _n:
+                _stats_tuple = None
+            _stats_dict[_key] = _stats_tuple
+            _i += _n
+        return _stats_dict
+
+    def _write_wide_row(self, table_name, column_dict, row_ts, stats_dict, cursor):
+        """Replace the row for row_ts in a table with one row per time period with
+        the statistics in stats_dict. Types not in stats_dict are left with nulls."""
+        _columns = ['dateTime']
+        _write_list = [row_ts]
+        for (_key, _stats_tuple) in stats_dict.iteritems():
+            _columns.extend(["%s_%s" % (_key, _stat) for _stat in column_dict[_key]])
+            _write_list.extend(_stats_tuple)
+        self._replace_row("REPLACE INTO %s (%s) VALUES(%s)" % (table_name, ','.join(_columns),
+                                                               ','.join(len(_write_list)*'?')),
+                          tuple(_write_list), cursor)
+
+    def _replace_row(self, sql_replace_str, write_tuple, cursor):
+        # In case the type doesn't appear in the database, be prepared to catch an exception:
+        try:
+            cursor.execute(sql_replace_str, write_tuple)
+        except weedb.OperationalError, e:
+            syslog.syslog(syslog.LOG_ERR, "manager: "
+                          "Replace failed for database %s: %s"
+                          % (self.database_name, e))
+
+    def _new_day_accum(self, timespan):
+        """Return an empty accumulator for a day, which keeps the sketches."""
+        _day_accum = weewx.accum.Accum(timespan)
+        for _obs_type in self.sketch_start:
+            _day_accum.add_sketch(_obs_type)
+        return _day_accum
+
+    def _read_sketch(self, obs_type, sod_ts, cursor):
+        """Read the sketch of obs_type for the day starting at sod_ts, as a
+        string. An empty string if there is none."""
+        cursor.execute("SELECT sketch FROM %s WHERE obs_type = ? AND dateTime = ?"
+                       % (DaySummaryManager.sketch_table_str % self.table_name), (obs_type, sod_ts))
+        _row = cursor.fetchone()
+        return _row[0] if _row is not None and _row[0] is not None else ''
+
+    def _write_sketch(self, obs_type, sod_ts, sketch_str, cursor):
+        """Write the sketch of obs_type, as a string, for the day starting at sod_ts."""
+        self._replace_row("REPLACE INTO %s VALUES(?, ?, ?)" % (DaySummaryManager.sketch_table_str % self.table_name),
+                          (obs_type, sod_ts, sketch_str), cursor)
+
+    def _day_table_sql(self, obs_type, start_ts=None, stop_ts=None):
+        """Return a table expression for use in a FROM clause, which gives the daily
+        summaries of obs_type with the columns dateTime, min, mintime, max, etc.,
+        whatever the layout. With the wide layout, optional start_ts and stop_ts
+        limit the rows to start_ts <= dateTime < stop_ts."""
+
+        if self.day_layout != 'wide':
+            return "%s_day_%s" % (self.table_name, obs_type)
+        return self._wide_table_sql(DaySummaryManager.wide_table_str % self.table_name,
+                                    self.day_columns, obs_type, start_ts, stop_ts)
+
+    def _wide_table_sql(self, table_name, column_dict, obs_type, start_ts=None, stop_ts=None):
+        """Like _day_table_sql(), but for any table with one row per time period."""
+        _columns = ','.join(['dateTime'] + ["%s_%s AS %s" % (obs_type, _stat, _stat) for _stat in column_dict[obs_type]])
+        _where = []
+        if start_ts is not None:
+            _where.append("dateTime >= %d" % start_ts)
+        if stop_ts is not None:
+            _where.append("dateTime < %d" % stop_ts)
+        return "(SELECT %s FROM %s%s) AS %s_day_%s" % (_columns, table_name,
+                                                        " WHERE " + " AND ".join(_where) if _where else "",
+                                                        self.table_name, obs_type)
+
+    def convert_day_layout(self, layout):
+        """Convert the daily summaries to a different layout.
+
+        layout: Either 'separate', for a table for each type, or 'wide', for a single
+        table with one row per day.
+
+        returns: The number of days converted."""
+
+        if layout not in ('separate', 'wide'):
+            raise ValueError("Unknown daily summary layout '%s'" % layout)
+        if layout == self.day_layout:
+            return 0
+
+        self._invalidate_day_cache()
+        if self.aggregate_cache is not None:
+            self.aggregate_cache.clear()
+        _stat_types = dict(DaySummaryManager.day_stats)
+        _wide_name = DaySummaryManager.wide_table_str % self.table_name
+
+        with weedb.Transaction(self.connection) as _cursor:
+            if layout == 'wide':
+                # Find the statistics kept by each type
+                _day_columns = {}
+                for _day_key in self.daykeys:
+                    _day_columns[_day_key] = self.connection.columnsOf('%s_day_%s' % (self.table_name, _day_key))[1:]
+                    for _stat in _day_columns[_day_key]:
+                        if _stat not in _stat_types:
+                            raise weewx.ViolatedPrecondition("Unknown column '%s' in daily summary for '%s'" % (_stat, _day_key))
+                self._create_wide_table(_wide_name, self.daykeys, _day_columns, _cursor)
+                # Create a row for every day found in any of the tables...
+                _cursor.execute("INSERT INTO %s (dateTime) %s" %
+                                (_wide_name, " UNION ".join(["SELECT dateTime FROM %s_day_%s" % (self.table_name, _day_key)
+                                                             for _day_key in self.daykeys])))
+                # ... then fill in the statistics of each type.
+                for _day_key in self.daykeys:
+                    _table_name = '%s_day_%s' % (self.table_name, _day_key)
+                    _cursor.execute("SELECT * FROM %s" % _table_name)
+                    _update_list = [tuple(_row[1:]) + (_row[0],) for _row in _cursor.fetchall()]
+                    _sets = ', '.join(["%s_%s=?" % (_day_key, _stat) for _stat in _day_columns[_day_key]])
+                    _cursor.executemany("UPDATE %s SET %s WHERE dateTime=?" % (_wide_name, _sets), _update_list)
+                    _cursor.execute("DROP TABLE %s" % _table_name)
+                _cursor.execute("SELECT COUNT(*) FROM %s" % _wide_name)
+                _ndays = _cursor.fetchone()[0]
+            else:
+                for _day_key in self.daykeys:
+                    _table_name = '%s_day_%s' % (self.table_name, _day_key)
+                    _stats = self.day_columns[_day_key]
+                    _cursor.execute("CREATE TABLE %s (dateTime INTEGER NOT NULL UNIQUE PRIMARY KEY, %s);" %
+                                    (_table_name, ', '.join(["%s %s" % (_stat, _stat_types[_stat]) for _stat in _stats])))
+                    # Copy over the days where the type has data:
+                    _cursor.execute("INSERT INTO %s SELECT dateTime, %s FROM %s WHERE %s_count IS NOT NULL" %
+                                    (_table_name, ', '.join(["%s_%s" % (_day_key, _stat) for _stat in _stats]),
+                                     _wide_name, _day_key))
+                _cursor.execute("SELECT COUNT(*) FROM %s" % _wide_name)
+                _ndays = _cursor.fetchone()[0]
+                _cursor.execute("DROP TABLE %s" % _wide_name)
+
+        self._init_day_layout()
+        syslog.syslog(syslog.LOG_INFO, "manager: Converted %d daily summaries in '%s' to the %s layout"
+                      % (_ndays, self.database_name, layout))
+        return _ndays
+
     def _calc_weight(self, record):
         weight = 60.0 * record['interval'] if self.version >= '2.0' else 1.0
         return weight
@@ -1581,6 +4506,9 @@ class DaySummaryManager(Manager):
         try:
             _cursor.execute(DaySummaryManager.meta_replace_str % self.table_name,
                             (key, value))
+            if key == 'lastUpdate':
+                # Our own updates do not make any cached aggregates out of date:
+                self._cache_lastUpdate = value
         finally:
             if cursor is None:
                 _cursor.close()
@@ -1590,6 +4518,9 @@ class DaySummaryManager(Manager):
         
         syslog.syslog(syslog.LOG_INFO, 
                       "manager: Dropping daily summary tables from '%s' ..." % self.connection.database_name)
+        self._invalidate_day_cache()
+        if self.aggregate_cache is not None:
+            self.aggregate_cache.clear()
         try:
             _all_tables = self.connection.tables()
             with weedb.Transaction(self.connection) as _cursor:
@@ -1598,6 +4529,7 @@ class DaySummaryManager(Manager):
                         _cursor.execute("DROP TABLE %s" % _table_name)
 
             del self.daykeys
+            self.sketch_start = {}
         except weedb.OperationalError, e:
             syslog.syslog(syslog.LOG_ERR, "manager: "
                           "Drop summaries failed for database '%s': %s"
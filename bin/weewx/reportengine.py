@@ -80,7 +80,8 @@ class StdReportEngine(threading.Thread):
     See below for examples of generators.
     """
 
-    def __init__(self, config_dict, stn_info, record=None, gen_ts=None, first_run=True):
+    def __init__(self, config_dict, stn_info, record=None, gen_ts=None, first_run=True,
+                 manager_pool=None):
         """Initializer for the report engine.
 
         config_dict: The configuration dictionary.
@@ -95,6 +96,11 @@ class StdReportEngine(threading.Thread):
 
         first_run: True if this is the first time the report engine has been
         run.  If this is the case, then any 'one time' events should be done.
+
+        manager_pool: An instance of weewx.manager.ManagerPool, from which the
+        generators get their database managers. It is passed to each generator
+        as the keyword argument manager_pool. [Optional. Default is to open
+        them anew]
         """
         threading.Thread.__init__(self, name="ReportThread")
 
@@ -103,6 +109,7 @@ class StdReportEngine(threading.Thread):
         self.record = record
         self.gen_ts = gen_ts
         self.first_run = first_run
+        self.manager_pool = manager_pool
 
     def run(self):
         """This is where the actual work gets done.
@@ -215,6 +222,8 @@ class StdReportEngine(threading.Thread):
 
             for generator in weeutil.weeutil.option_as_list(skin_dict['Generators'].get('generator_list')):
 
+                # Generators take their databases from the pool, if there is one:
+                pool_kwargs = {'manager_pool' : self.manager_pool} if self.manager_pool is not None else {}
                 try:
                     # Instantiate an instance of the class.
                     obj = weeutil.weeutil._get_object(generator)(
@@ -223,7 +232,8 @@ class StdReportEngine(threading.Thread):
                         self.gen_ts,
                         self.first_run,
                         self.stn_info,
-                        self.record)
+                        self.record,
+                        **pool_kwargs)
                 except Exception, e:
                     syslog.syslog(
                         syslog.LOG_CRIT, "reportengine: "
@@ -260,14 +270,16 @@ class StdReportEngine(threading.Thread):
 
 class ReportGenerator(object):
     """Base class for all report generators."""
-    def __init__(self, config_dict, skin_dict, gen_ts, first_run, stn_info, record=None):
+    def __init__(self, config_dict, skin_dict, gen_ts, first_run, stn_info, record=None,
+                 manager_pool=None):
         self.config_dict = config_dict
         self.skin_dict = skin_dict
         self.gen_ts = gen_ts
         self.first_run = first_run
         self.stn_info = stn_info
         self.record = record
-        self.db_binder = weewx.manager.DBBinder(self.config_dict)
+        # Reports only read the databases, so they do not need to lock out the archiving thread:
+        self.db_binder = weewx.manager.DBBinder(self.config_dict, read_only=True, pool=manager_pool)
 
     def start(self):
         self.run()
@@ -251,51 +251,21 @@ class RESTThread(threading.Thread):
                 # CWOP says rain should be "rain that fell in the past hour".
                 # WU says it should be "the accumulated rainfall in the past
                 # 60 min". Presumably, this is exclusive of the archive record
-                # 60 minutes before, so the SQL statement is exclusive on the
-                # left, inclusive on the right.
-                _result = dbmanager.getSql(
-                    "SELECT SUM(rain), MIN(usUnits), MAX(usUnits) FROM %s "
-                    "WHERE dateTime>? AND dateTime<=?" %
-                    dbmanager.table_name, (_time_ts - 3600.0, _time_ts))
-                if _result is not None and _result[0] is not None:
-                    if not _result[1] == _result[2] == record['usUnits']:
-                        raise ValueError("Inconsistent units (%s vs %s vs %s) when querying for hourRain" %
-                                         (_result[1], _result[2], record['usUnits']))
-                    _datadict['hourRain'] = _result[0]
-                else:
-                    _datadict['hourRain'] = None
+                # 60 minutes before, so the sum is exclusive on the left,
+                # inclusive on the right.
+                _datadict['hourRain'] = self._sum_rain(dbmanager, record, _time_ts - 3600.0, 'hourRain')
 
             if 'rain24' not in _datadict:
                 # Similar issue, except for last 24 hours:
-                _result = dbmanager.getSql(
-                    "SELECT SUM(rain), MIN(usUnits), MAX(usUnits) FROM %s "
-                    "WHERE dateTime>? AND dateTime<=?" %
-                    dbmanager.table_name, (_time_ts - 24 * 3600.0, _time_ts))
-                if _result is not None and _result[0] is not None:
-                    if not _result[1] == _result[2] == record['usUnits']:
-                        raise ValueError("Inconsistent units (%s vs %s vs %s) when querying for rain24" %
-                                         (_result[1], _result[2], record['usUnits']))
-                    _datadict['rain24'] = _result[0]
-                else:
-                    _datadict['rain24'] = None
+                _datadict['rain24'] = self._sum_rain(dbmanager, record, _time_ts - 24 * 3600.0, 'rain24')
 
             if 'dayRain' not in _datadict:
                 # NB: The WU considers the archive with time stamp 00:00
                 # (midnight) as (wrongly) belonging to the current day
                 # (instead of the previous day). But, it's their site,
-                # so we'll do it their way.  That means the SELECT statement
-                # is inclusive on both time ends:
-                _result = dbmanager.getSql(
-                    "SELECT SUM(rain), MIN(usUnits), MAX(usUnits) FROM %s "
-                    "WHERE dateTime>=? AND dateTime<=?" %
-                    dbmanager.table_name, (_sod_ts, _time_ts))
-                if _result is not None and _result[0] is not None:
-                    if not _result[1] == _result[2] == record['usUnits']:
-                        raise ValueError("Inconsistent units (%s vs %s vs %s) when querying for dayRain" %
-                                         (_result[1], _result[2], record['usUnits']))
-                    _datadict['dayRain'] = _result[0]
-                else:
-                    _datadict['dayRain'] = None
+                # so we'll do it their way.  That means the sum is
+                # inclusive on both time ends:
+                _datadict['dayRain'] = self._sum_rain(dbmanager, record, _sod_ts - 1, 'dayRain')
 
         except weedb.OperationalError, e:
             syslog.syslog(syslog.LOG_DEBUG,
@@ -304,6 +274,25 @@ class RESTThread(threading.Thread):
 
         return _datadict
 
+    @staticmethod
+    def _sum_rain(dbmanager, record, start_ts, name):
+        """Return the rain that fell after start_ts, up to and including the
+        record. The rain of the record itself comes from the record, rather
+        than the database, as the record may not have been written yet. See
+        the StdArchive option write_queue_size."""
+        _result = dbmanager.getSql(
+            "SELECT SUM(rain), MIN(usUnits), MAX(usUnits) FROM %s "
+            "WHERE dateTime>? AND dateTime<?" %
+            dbmanager.table_name, (start_ts, record['dateTime']))
+        if _result is not None and _result[0] is not None:
+            if not _result[1] == _result[2] == record['usUnits']:
+                raise ValueError("Inconsistent units (%s vs %s vs %s) when querying for %s" %
+                                 (_result[1], _result[2], record['usUnits'], name))
+            if record.get('rain') is not None:
+                return _result[0] + record['rain']
+            return _result[0]
+        return record.get('rain')
+
     def run(self):
         """If there is a database specified, open the database, then call
         run_loop() with the database.  If no database is specified, simply
@@ -312,7 +301,7 @@ class RESTThread(threading.Thread):
         # Open up the archive. Use a 'with' statement. This will automatically
         # close the archive in the case of an exception:
         if self.manager_dict is not None:
-            with weewx.manager.open_manager(self.manager_dict) as _manager:
+            with weewx.manager.open_manager(self.manager_dict, read_only=True) as _manager:
                 self.run_loop(_manager)
         else:
             self.run_loop()
@@ -1620,7 +1609,8 @@ class AWEKASThread(RESTThread):
         except weedb.OperationalError:
             pass
         else:
-            r['rainRate'] = rr[0]
+            # The record may not have been written yet:
+            r['rainRate'] = rr[0] if rr else None
         return r
 
     def process_record(self, record, dbmanager):
@@ -166,11 +166,30 @@ class TimespanBinder(object):
         self.formatter   = formatter
         self.converter   = converter
         self.option_dict = option_dict
+        # Aggregations fetched ahead of time. See prefetch():
+        self.prefetched  = {}
+
+    # Fetch several aggregations in one go:
+    def prefetch(self, *aggregates):
+        """Fetch several aggregations at once, so the database manager can
+        combine their queries. Example:
+
+           #set $m = $month.prefetch(('outTemp', 'max'), ('outTemp', 'min'), ('rain', 'sum'))
+           $m.outTemp.max $m.outTemp.min $m.rain.sum
+
+        aggregates: Tuples (obs_type, aggregate_type).
+
+        returns: Myself."""
+        db_manager = self.db_lookup(self.data_binding)
+        self.prefetched.update(db_manager.getAggregates(self.timespan,
+                                                        [(obs_type, aggregate_type, self.option_dict)
+                                                         for (obs_type, aggregate_type) in aggregates]))
+        return self
 
     # Iterate over all records in the time period:
     def records(self, data_binding=None):
         manager = self.db_lookup(data_binding)
-        for record in manager.genBatchRecords(self.timespan.start, self.timespan.stop):
+        for record in manager.genRecordViews(self.timespan.start, self.timespan.stop):
             yield CurrentObj(self.db_lookup, None, record['dateTime'], self.formatter, 
                              self.converter, record=record)
 
@@ -241,7 +260,7 @@ class TimespanBinder(object):
         # Return an ObservationBinder: if an attribute is
         # requested from it, an aggregation value will be returned.
         return ObservationBinder(obs_type, self.timespan, self.db_lookup, self.data_binding, self.context,
-                                 self.formatter, self.converter, **self.option_dict)
+                                 self.formatter, self.converter, self.prefetched, **self.option_dict)
 
 #===============================================================================
 #                    Class ObservationBinder
@@ -256,7 +275,8 @@ class ObservationBinder(object):
     """
 
     def __init__(self, obs_type, timespan, db_lookup, data_binding, context,
-                 formatter=weewx.units.Formatter(), converter=weewx.units.Converter(), **option_dict):
+                 formatter=weewx.units.Formatter(), converter=weewx.units.Converter(),
+                 prefetched=None, **option_dict):
         """ Initialize an instance of ObservationBinder
 
         obs_type: A string with the stats type (e.g., 'outTemp') for which the query is
@@ -282,6 +302,9 @@ class ObservationBinder(object):
         information to be used. [Optional. If not given, the default
         Converter will be used.]
 
+        prefetched: A dictionary of aggregations fetched ahead of time, with key
+        (obs_type, aggregate_type). [Optional.]
+
         option_dict: Other options which can be used to customize calculations.
         [Optional.]
         """
@@ -293,8 +316,21 @@ class ObservationBinder(object):
         self.context      = context
         self.formatter    = formatter
         self.converter    = converter
+        self.prefetched   = prefetched if prefetched is not None else {}
         self.option_dict  = option_dict
 
+    def prefetch(self, *aggregate_types):
+        """Fetch several aggregations of my observation type at once. Example:
+
+           #set $t = $month.outTemp.prefetch('max', 'maxtime', 'min', 'mintime', 'avg')
+
+        returns: Myself."""
+        db_manager = self.db_lookup(self.data_binding)
+        self.prefetched.update(db_manager.getAggregates(self.timespan,
+                                                        [(self.obs_type, aggregate_type, self.option_dict)
+                                                         for aggregate_type in aggregate_types]))
+        return self
+
     def max_ge(self, val):
         return self._do_query('max_ge', val=val)
 
@@ -310,6 +346,9 @@ class ObservationBinder(object):
     def sum_ge(self, val):
         return self._do_query('sum_ge', val=val)
 
+    def percentile(self, val):
+        return self._do_query('percentile', val=val)
+
     def __getattr__(self, aggregate_type):
         """Return statistical summary using a given aggregate type.
 
@@ -338,9 +377,12 @@ class ObservationBinder(object):
 
     def _do_query(self, aggregate_type, val=None):
         """Run a query against the databases, using the given aggregation type."""
-        db_manager = self.db_lookup(self.data_binding)
-        result = db_manager.getAggregate(self.timespan, self.obs_type, aggregate_type, 
-                                         val=val, **self.option_dict)
+        if val is None and (self.obs_type, aggregate_type) in self.prefetched:
+            result = self.prefetched[(self.obs_type, aggregate_type)]
+        else:
+            db_manager = self.db_lookup(self.data_binding)
+            result = db_manager.getAggregate(self.timespan, self.obs_type, aggregate_type, 
+                                             val=val, **self.option_dict)
         return weewx.units.ValueHelper(result, self.context, self.formatter, self.converter)
         
 #===============================================================================
@@ -462,8 +504,8 @@ class TrendObj(object):
 
         db_manager  = self.db_lookup(self.data_binding)
         # Get the current record, and one "time_delta" ago:        
-        now_record  = db_manager.getRecord(self.nowtime, self.time_grace_val)
-        then_record = db_manager.getRecord(self.nowtime - self.time_delta_val, self.time_grace_val)
+        (now_record, then_record) = db_manager.getRecords([self.nowtime, self.nowtime - self.time_delta_val],
+                                                          self.time_grace_val)
 
         # Do both records exist?
         if now_record is None or then_record is None:
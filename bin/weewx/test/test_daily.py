@@ -21,7 +21,9 @@ import configobj
 os.environ['TZ'] = 'America/Los_Angeles'
 
 import weeutil.weeutil
+import weewx.accum
 import weewx.tags
+import weewx.wxformulas
 import gen_fake_data
 from weewx.units import ValueHelper
 
@@ -177,6 +179,36 @@ class Common(unittest.TestCase):
                                                   'sum', 'count', 'wsum', 'sumtime', 
                                                   'last', 'lasttime')]))
             
+    def testRebuildParallel(self):
+        with weewx.manager.open_manager_with_config(self.config_dict, 'wx_binding') as manager:
+            start_d = datetime.date(2010, 3, 5)
+            stop_d  = datetime.date(2010, 3, 16)
+            sod_list = [int(time.mktime((start_d + datetime.timedelta(days=i)).timetuple())) for i in range(12)]
+            origStats = [manager._get_day_summary(sod_ts) for sod_ts in sod_list]
+
+            hour_sql = "SELECT * FROM archive_day__hourly WHERE dateTime >= %d AND dateTime < %d" % \
+                       (sod_list[0], sod_list[-1] + 24 * 3600)
+            origHours = list(manager.genSql(hour_sql))
+
+            # Rebuild some days, using several processes:
+            nrecs, ndays = manager.backfill_day_summary(start_d=start_d, stop_d=stop_d, progress_fn=None,
+                                                        trans_days=2, processes=3)
+            self.assertEqual(ndays, 12)
+            self.assertEqual(nrecs, len(list(manager.genBatchRows(sod_list[0], sod_list[-1] + 24 * 3600))))
+            self.assertEqual(int(manager._read_metadata('lastUpdate')), manager.last_timestamp)
+
+            # Pretend a rebuild got interrupted after 9 March. It should resume from there:
+            manager._write_metadata('lastUpdate', str(sod_list[5]))
+            nrecs, ndays = manager.backfill_day_summary(progress_fn=None, processes=3)
+            self.assertEqual(nrecs, len(list(manager.genBatchRows(sod_list[5]))))
+            self.assertEqual(int(manager._read_metadata('lastUpdate')), manager.last_timestamp)
+
+            for (sod_ts, orig) in zip(sod_list, origStats):
+                new = manager._get_day_summary(sod_ts)
+                for obstype in manager.daykeys:
+                    self.assertEqual(orig[obstype].getStatsTuple(), new[obstype].getStatsTuple())
+            self.assertEqual(list(manager.genSql(hour_sql)), origHours)
+
     def testTags(self):
         """Test common tags."""
         global skin_dict
@@ -308,6 +340,138 @@ class Common(unittest.TestCase):
                     self.assertEqual(str(table_answer), str(daily_answer), 
                                      msg="aggregation=%s; %s vs %s" % (aggregation, table_answer, daily_answer))
             
+    def test_agg_hours(self):
+        """Test aggregation in the archive table against aggregation in the hourly summary"""
+
+        # These span the spring DST boundary:
+        start_ts = time.mktime((2010,3,13,22,0,0,0,0,-1))
+        stop_ts  = time.mktime((2010,3,14,9,0,0,0,0,-1))
+
+        with weewx.manager.open_manager_with_config(self.config_dict, 'wx_binding') as manager:
+            # The backfill done when the database was created should have covered all the hours:
+            self.assertEqual(manager.hourly_start,
+                             int(time.mktime(datetime.date.fromtimestamp(manager.first_timestamp).timetuple())))
+            for span in [weeutil.weeutil.TimeSpan(start_ts, stop_ts)] + \
+                        list(weeutil.weeutil.genHourSpans(start_ts, stop_ts)):
+                self.assertTrue(manager._use_hours(span, 'outTemp', 'max'))
+                for (obs_type, aggregation) in [('outTemp', 'min'), ('outTemp', 'max'), ('outTemp', 'mintime'),
+                                                ('outTemp', 'maxtime'), ('outTemp', 'avg'), ('outTemp', 'count'),
+                                                ('rain', 'sum'), ('rain', 'count')]:
+                    table_answer = ValueHelper(weewx.manager.Manager.getAggregate(manager, span, obs_type, aggregation))
+                    hourly_answer = ValueHelper(weewx.manager.DaySummaryManager.getAggregate(manager, span, obs_type, aggregation))
+                    self.assertEqual(str(table_answer), str(hourly_answer),
+                                     msg="aggregation=%s; %s vs %s" % (aggregation, table_answer, hourly_answer))
+
+            # Spans that do not sit on the hour cannot use the hourly summaries:
+            self.assertFalse(manager._use_hours(weeutil.weeutil.TimeSpan(start_ts + 1800, stop_ts), 'outTemp', 'max'))
+            self.assertFalse(manager._use_hours(weeutil.weeutil.TimeSpan(start_ts, stop_ts), 'outTemp', 'meanmax'))
+
+    def test_agg_hybrid(self):
+        """Test aggregation in the archive table against aggregation from a mix of
+        daily summaries, hourly summaries, and archive records"""
+
+        with weewx.manager.open_manager_with_config(self.config_dict, 'wx_binding') as manager:
+            spans = [weeutil.weeutil.TimeSpan(time.mktime((2010,3,10,10,35,0,0,0,-1)),
+                                              time.mktime((2010,3,20,14,20,0,0,0,-1))),
+                     weeutil.weeutil.TimeSpan(manager.last_timestamp - 30 * 24 * 3600 - 600, manager.last_timestamp),
+                     weeutil.weeutil.TimeSpan(time.mktime((2010,3,14,0,10,0,0,0,-1)),
+                                              time.mktime((2010,3,14,5,40,0,0,0,-1)))]
+            self.assertEqual([source for (source, span) in manager._plan_aggregate(spans[0], 'outTemp', 'max')],
+                             ['archive', 'hour', 'day', 'hour', 'archive'])
+            for span in spans:
+                for (obs_type, aggregation) in [('outTemp', 'min'), ('outTemp', 'max'), ('outTemp', 'mintime'),
+                                                ('outTemp', 'maxtime'), ('outTemp', 'avg'), ('outTemp', 'count'),
+                                                ('rain', 'sum'), ('rain', 'count')]:
+                    table_answer = ValueHelper(weewx.manager.Manager.getAggregate(manager, span, obs_type, aggregation))
+                    hybrid_answer = ValueHelper(manager.getAggregate(span, obs_type, aggregation))
+                    self.assertEqual(str(table_answer), str(hybrid_answer),
+                                     msg="aggregation=%s; %s vs %s" % (aggregation, table_answer, hybrid_answer))
+
+                # Vector aggregates are not available from the archive table. Check
+                # against the statistics of all the archive records in the span:
+                accum = weewx.accum.Accum(span)
+                for rec in manager.genBatchRecords(span.start, span.stop):
+                    accum.addRecord(rec, weight=60.0 * rec['interval'])
+                wind = accum['wind']
+                # As for the daily summaries, the vector average is over the time with a wind direction:
+                vecavg = math.sqrt(wind.xsum**2 + wind.ysum**2) / wind.dirsumtime
+                for (aggregation, expected) in [('rms', wind.rms), ('vecavg', vecavg),
+                                                ('vecdir', wind.vec_dir), ('gustdir', wind.max_dir)]:
+                    self.assertAlmostEqual(manager.getAggregate(span, 'wind', aggregation)[0], expected,
+                                           msg="aggregation=%s" % aggregation)
+
+    def test_getAggregates(self):
+        """Test aggregations done together against aggregations done one by one"""
+        global skin_dict
+
+        aggregate_list = [('outTemp', 'min', None), ('outTemp', 'max', None), ('outTemp', 'maxtime', None),
+                          ('outTemp', 'avg', None), ('barometer', 'count', None), ('rain', 'sum', None),
+                          ('wind', 'rms', None), ('wind', 'vecavg', None), ('wind', 'vecdir', None),
+                          ('wind', 'gustdir', None), ('heatdeg', 'sum', {'skin_dict': skin_dict})]
+        # These only work over whole days:
+        day_list = [('outTemp', 'meanmax', None), ('outTemp', 'max_ge', {'val': (60.0, 'degree_F')})]
+        spans = [weeutil.weeutil.TimeSpan(time.mktime((2010,3,1,0,0,0,0,0,-1)),
+                                          time.mktime((2010,4,1,0,0,0,0,0,-1))),
+                 weeutil.weeutil.TimeSpan(time.mktime((2010,3,14,1,0,0,0,0,-1)),
+                                          time.mktime((2010,3,14,8,0,0,0,0,-1))),
+                 weeutil.weeutil.TimeSpan(time.mktime((2010,3,10,10,35,0,0,0,-1)),
+                                          time.mktime((2010,3,20,14,20,0,0,0,-1)))]
+        with weewx.manager.open_manager_with_config(self.config_dict, 'wx_binding') as manager:
+            for span in spans:
+                span_list = aggregate_list + day_list if span is spans[0] else aggregate_list
+                results = manager.getAggregates(span, span_list)
+                self.assertEqual(len(results), len(span_list))
+                for (obs_type, aggregation, option_dict) in span_list:
+                    expected = manager.getAggregate(span, obs_type, aggregation, **(option_dict or {}))
+                    self.assertEqual(str(ValueHelper(results[(obs_type, aggregation)])), str(ValueHelper(expected)),
+                                     msg="aggregation=%s.%s" % (obs_type, aggregation))
+
+            # The archive table version:
+            aggregate_list = [('outTemp', 'min'), ('outTemp', 'avg'), ('rain', 'sum'), ('barometer', 'count'),
+                              ('outTemp', 'maxtime')]
+            results = weewx.manager.Manager.getAggregates(manager, spans[2], aggregate_list)
+            for (obs_type, aggregation) in aggregate_list:
+                self.assertEqual(results[(obs_type, aggregation)],
+                                 weewx.manager.Manager.getAggregate(manager, spans[2], obs_type, aggregation))
+
+        # Now the tags:
+        db_binder = weewx.manager.DBBinder(self.config_dict)
+        tsb = weewx.tags.TimespanBinder(spans[0], db_binder.bind_default(), skin_dict=skin_dict)
+        tsb.prefetch(('outTemp', 'max'), ('outTemp', 'min'), ('rain', 'sum'))
+        self.assertEqual(sorted(tsb.prefetched.keys()), [('outTemp', 'max'), ('outTemp', 'min'), ('rain', 'sum')])
+        self.assertEqual(tsb.outTemp.max.raw, tsb.prefetched[('outTemp', 'max')][0])
+        self.assertEqual(str(tsb.rain.sum), str(weewx.tags.TimespanBinder(spans[0], db_binder.bind_default()).rain.sum))
+        obs = tsb.barometer.prefetch('max', 'maxtime')
+        self.assertEqual(str(obs.maxtime), str(weewx.tags.TimespanBinder(spans[0], db_binder.bind_default()).barometer.maxtime))
+        db_binder.close()
+
+    def test_windvec(self):
+        """Test aggregation of wind vectors using numpy against pure Python"""
+        if weewx.manager.numpy is None:
+            return
+
+        # note that this spans the spring DST boundary:
+        span = weeutil.weeutil.TimeSpan(time.mktime((2010,3,13,0,0,0,0,0,-1)),
+                                         time.mktime((2010,3,16,0,0,0,0,0,-1)))
+
+        with weewx.manager.open_manager_with_config(self.config_dict, 'wx_binding') as manager:
+            for obs_type in ('windvec', 'windgustvec'):
+                for aggregation in ('sum', 'count', 'avg', 'max', 'min', 'last'):
+                    numpy_vecs = manager.getSqlVectors(span, obs_type, aggregation, 10800)
+                    saved_numpy = weewx.manager.numpy
+                    try:
+                        weewx.manager.numpy = None
+                        python_vecs = manager.getSqlVectors(span, obs_type, aggregation, 10800)
+                    finally:
+                        weewx.manager.numpy = saved_numpy
+                    self.assertEqual(numpy_vecs[0], python_vecs[0])
+                    self.assertEqual(numpy_vecs[1], python_vecs[1])
+                    self.assertEqual(numpy_vecs[2][1:], python_vecs[2][1:])
+                    self.assertEqual(len(numpy_vecs[2][0]), len(python_vecs[2][0]))
+                    for (x, y) in zip(numpy_vecs[2][0], python_vecs[2][0]):
+                        self.assertAlmostEqual(x, y, places=6,
+                                               msg="%s %s: %s vs %s" % (obs_type, aggregation, x, y))
+
     def test_rainYear(self):
         db_binder = weewx.manager.DBBinder(self.config_dict)
         db_lookup = db_binder.bind_default()
@@ -336,7 +500,89 @@ class Common(unittest.TestCase):
             
         self.assertEqual(str(tagStats.year().heatdeg.sum), "5126.3°F-day")
         self.assertEqual(str(tagStats.year().cooldeg.sum), "1026.2°F-day")
-    
+
+        # With a base in Celsius, check against the average temperature of each day:
+        metric_dict = {'Units' : {'DegreeDays' : {'heating_base' : ['18', 'degree_C']}}}
+        span = weeutil.weeutil.TimeSpan(time.mktime((2010,3,10,10,35,0,0,0,-1)),
+                                        time.mktime((2010,3,20,14,20,0,0,0,-1)))
+        with weewx.manager.open_manager_with_config(self.config_dict, 'wx_binding') as manager:
+            heatdeg = 0.0
+            for day_span in weeutil.weeutil.genDaySpans(span.start, span.stop):
+                Tavg_t = weewx.units.convert(manager.getAggregate(day_span, 'outTemp', 'avg'), 'degree_C')
+                heatdeg += weewx.wxformulas.heating_degrees(Tavg_t[0], 18.0)
+            self.assertAlmostEqual(manager.getAggregate(span, 'heatdeg', 'sum', skin_dict=metric_dict)[0], heatdeg, 6)
+            self.assertAlmostEqual(manager.getAggregate(span, 'heatdeg', 'avg', skin_dict=metric_dict)[0], heatdeg / 11, 6)
+
+    def test_quantiles(self):
+        """Test medians and percentiles from the quantile sketches against the archive records"""
+        with weewx.manager.open_manager_with_config(self.config_dict, 'wx_binding') as manager:
+            manager.enable_sketches(['outTemp'])
+            # Backfill the last two weeks, in part with several processes, so they have sketches.
+            # The sketches start with the day after the latest record, so work backwards:
+            start_d = datetime.date(2010, 8, 20)
+            manager.backfill_day_summary(start_d=datetime.date(2010, 8, 27), progress_fn=None, processes=2)
+            manager.backfill_day_summary(start_d=start_d, stop_d=datetime.date(2010, 8, 26), progress_fn=None)
+            self.assertTrue(manager.sketch_start['outTemp'] <= int(time.mktime(start_d.timetuple())))
+
+            spans = [weeutil.weeutil.TimeSpan(time.mktime((2010,8,22,10,35,0,0,0,-1)),
+                                              time.mktime((2010,9,2,14,20,0,0,0,-1))),
+                     weeutil.weeutil.TimeSpan(time.mktime((2010,8,25,0,0,0,0,0,-1)),
+                                              time.mktime((2010,8,26,0,0,0,0,0,-1))),
+                     weeutil.weeutil.TimeSpan(manager.last_timestamp - 30 * 24 * 3600 - 600, manager.last_timestamp)]
+            for span in spans:
+                values = sorted(val for (ts, val) in manager._genColumns(['dateTime', 'outTemp'], span.start, span.stop)
+                                if val is not None)
+                for (aggregation, val, q) in [('median', None, 0.5), ('p05', None, 0.05), ('percentile', 90, 0.9)]:
+                    table_answer = weewx.manager.Manager.getAggregate(manager, span, 'outTemp', aggregation, val=val)
+                    sketch_answer = manager.getAggregate(span, 'outTemp', aggregation, val=val)
+                    self.assertEqual(table_answer, sketch_answer)
+                    self.assertEqual(sketch_answer[1:], ('degree_F', 'group_temperature'))
+                    expected = values[int(math.ceil(q * len(values))) - 1]
+                    self.assertAlmostEqual(sketch_answer[0], expected, delta=abs(expected) * 1.0e-3,
+                                           msg="aggregation=%s" % aggregation)
+
+            # Tags, including the percentile with a value:
+            db_lookup = weewx.manager.DBBinder(self.config_dict).bind_default()
+            tagStats = weewx.tags.TimeBinder(db_lookup, spans[1].stop)
+            self.assertEqual(tagStats.day().outTemp.median.raw, manager.getAggregate(spans[1], 'outTemp', 'median')[0])
+            self.assertEqual(tagStats.day().outTemp.percentile(90).raw,
+                             manager.getAggregate(spans[1], 'outTemp', 'p90')[0])
+
+    def test_windrose(self):
+        """Test wind roses from the daily sketches against the archive records"""
+        with weewx.manager.open_manager_with_config(self.config_dict, 'wx_binding') as manager:
+            manager.enable_sketches(['wind'])
+            # Backfill the last two weeks so they have wind roses:
+            start_d = datetime.date(2010, 8, 20)
+            manager.backfill_day_summary(start_d=start_d, progress_fn=None, processes=2)
+            self.assertTrue(manager.sketch_start['wind'] <= int(time.mktime(start_d.timetuple())))
+
+            span = weeutil.weeutil.TimeSpan(time.mktime((2010,8,22,10,35,0,0,0,-1)),
+                                            time.mktime((2010,9,2,14,20,0,0,0,-1)))
+            rose = manager.getAggregate(span, 'wind', 'rose')
+            self.assertEqual(rose, weewx.manager.Manager.getAggregate(manager, span, 'wind', 'rose'))
+            self.assertEqual(rose[1:], ('percent', 'group_percent'))
+
+            # Check against the directions of the archive records:
+            freq = [0] * 16
+            rows = [row for row in manager._genColumns(['dateTime', 'windSpeed', 'windDir'], span.start, span.stop)
+                    if row[1] is not None]
+            for (ts, speed, direction) in rows:
+                if speed and direction is not None:
+                    freq[int((direction + 11.25) % 360.0 // 22.5)] += 1
+            for (expected, actual) in zip(freq, rose[0]):
+                self.assertAlmostEqual(100.0 * expected / len(rows), actual)
+
+            # The bands of the rose add up to the whole:
+            (dir_vec, band_list, calm_t) = manager.getRoseVectors(span, speed_bins=([5, 10], 'mile_per_hour', 'group_speed'))
+            self.assertEqual(dir_vec[0][:3], [0.0, 22.5, 45.0])
+            self.assertEqual(len(band_list), 3)
+            for (i, actual) in enumerate(rose[0]):
+                self.assertAlmostEqual(sum(band[0][i] for band in band_list), actual)
+            self.assertAlmostEqual(sum(rose[0]) + calm_t[0], 100.0)
+
+            self.assertRaises(weewx.ViolatedPrecondition, manager.getAggregate, span, 'outTemp', 'rose')
+
 
 class TestSqlite(Common):
 
@@ -352,8 +598,9 @@ class TestMySQL(Common):
         
     
 def suite():
-    tests = ['test_create_stats', 'testScalarTally', 'testWindTally', 'testRebuild',
-             'testTags', 'test_rainYear', 'test_agg_intervals', 'test_agg', 'test_heatcool']
+    tests = ['test_create_stats', 'testScalarTally', 'testWindTally', 'testRebuild', 'testRebuildParallel',
+             'testTags', 'test_rainYear', 'test_agg_intervals', 'test_agg', 'test_agg_hours', 'test_agg_hybrid', 'test_getAggregates', 'test_windvec', 'test_heatcool', 'test_quantiles',
+             'test_windrose']
     
     # Test both sqlite and MySQL:
     return unittest.TestSuite(map(TestSqlite, tests) + map(TestMySQL, tests))
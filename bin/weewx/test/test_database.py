@@ -6,14 +6,19 @@
 #
 """Test archive and stats database modules"""
 from __future__ import with_statement
+import datetime
+import os
+import threading
 import unittest
 import time
 
+import weewx.accum
 import weewx.manager
 import weedb
 import weeutil.weeutil
 
 archive_sqlite = {'database_name': '/var/tmp/weewx_test/weedb.sdb', 'driver':'weedb.sqlite'}
+snapshot_path = '/var/tmp/weewx_test/archive.snapshot'
 archive_mysql  = {'database_name': 'test_weedb', 'user':'weewx1', 'password':'weewx1', 'driver':'weedb.mysql'}
 
 archive_schema = [('dateTime',             'INTEGER NOT NULL UNIQUE PRIMARY KEY'),
@@ -137,6 +142,34 @@ class Common(unittest.TestCase):
             metric_record = {'dateTime': stop_ts + interval, 'interval': interval, 'usUnits' : 16, 'outTemp': 20.0}
             self.assertRaises(weewx.UnitError, archive.addRecord, metric_record)
 
+    def test_add_batch(self):
+        # Add a bunch of records
+        self.populate_database()
+
+        with weewx.manager.Manager.open(self.archive_db_dict) as archive:
+            # Add a batch that includes an existing record. The new records in
+            # the batch should still get added.
+            new_recs = [expected_record(irec) for irec in range(nrecs, nrecs + 3)]
+            archive.addRecord([expected_record(nrecs - 1)] + new_recs)
+            self.assertEqual(archive.last_timestamp, timefunc(nrecs + 2))
+            self.assertEqual(archive.lastGoodStamp(), timefunc(nrecs + 2))
+
+            # Now add a batch with varying keys:
+            new_recs = [expected_record(irec) for irec in range(nrecs + 3, nrecs + 6)]
+            del new_recs[1]['inTemp']
+            archive.addRecord(iter(new_recs))
+
+            for (irec, _rec) in enumerate(archive.genBatchRecords(timefunc(nrecs - 1))):
+                self.assertEqual(_rec.pop('windSpeed'), None)
+                if irec == 4:
+                    self.assertEqual(_rec.pop('inTemp'), None)
+                    expected = expected_record(nrecs + irec)
+                    del expected['inTemp']
+                    self.assertEqual(_rec, expected)
+                else:
+                    self.assertEqual(_rec, expected_record(nrecs + irec))
+            self.assertEqual(irec, 5)
+
     def test_get_records(self):
         # Add a bunch of records
         self.populate_database()
@@ -191,6 +224,36 @@ class Common(unittest.TestCase):
             target_ts = timevec[nrecs/2] + 1
             _rec = archive.getRecord(target_ts)
             self.assertEqual(_rec, None)
+
+            # Try getRecords(), which should find the same records as getRecord():
+            target_list = [timevec[5] + interval/100, timevec[nrecs/2] - interval/100, timevec[nrecs/2] - interval/2,
+                           timevec[3], timevec[5] + interval/100, start_ts - interval, timevec[7] + interval/2,
+                           stop_ts + interval/10]
+            for max_delta in (None, interval/50, interval/2, 3 * interval):
+                for max_windows in (200, 2):
+                    archive.max_windows = max_windows
+                    self.assertEqual(archive.getRecords(target_list, max_delta),
+                                     [archive.getRecord(_ts, max_delta) for _ts in target_list])
+            # The earlier record wins a tie:
+            self.assertEqual(archive.getRecords([timevec[7] + interval/2], interval/2)[0]['dateTime'], timevec[7])
+            self.assertEqual(archive.getRecord(timevec[7] + interval/2, interval/2)['dateTime'], timevec[7])
+            self.assertEqual(archive.getRecords([]), [])
+
+            # Try the record views, fetching a few rows at a time:
+            records = list(archive.genBatchRecords(timefunc(3), timefunc(20)))
+            views = list(archive.genRecordViews(timefunc(3), timefunc(20), batch_size=7))
+            self.assertEqual(len(views), 17)
+            self.assertEqual(views, records)
+            _view = views[0]
+            self.assertEqual(_view['outTemp'], temperfunc(4))
+            self.assertEqual(_view.get('windSpeed', 0.0), None)
+            self.assertEqual(_view.get('foo', 0.0), 0.0)
+            self.assertRaises(KeyError, _view.__getitem__, 'foo')
+            self.assertTrue('barometer' in _view)
+            self.assertFalse('foo' in _view)
+            self.assertEqual(list(_view), archive.sqlkeys)
+            self.assertEqual(dict(_view), records[0])
+            self.assertEqual(weewx.accum.Accum(weeutil.weeutil.TimeSpan(timefunc(3), timefunc(4))).addRecord(_view), None)
             
         # Now try fetching them as vectors:
         with weewx.manager.Manager.open(self.archive_db_dict) as archive:
@@ -219,6 +282,185 @@ class Common(unittest.TestCase):
                 # Compare them.
                 self.assertAlmostEqual(expected_avg, barvec[2][0][irec])
 
+    def test_bucket_aggregates(self):
+        # Add a bunch of records
+        self.populate_database()
+
+        with weewx.manager.Manager.open(self.archive_db_dict) as archive:
+            # Calculate aggregates in a single pass, then compare against the
+            # results of one query per interval. Include an interval that does
+            # not divide evenly into a day, and a span that starts mid-interval.
+            for agg_interval in (3*interval, 7*interval):
+                for span in ((start_ts, stop_ts), (start_ts + interval/2, stop_ts - 5*interval)):
+                    for aggregate_type in weewx.manager.Manager.bucket_aggregates:
+                        spans = list(weeutil.weeutil.intervalgen(span[0], span[1], agg_interval))
+                        with archive.connection.cursor() as cursor:
+                            bucket_results = list(archive._genBucketAggregates('outTemp', aggregate_type, spans, cursor))
+                            interval_results = list(archive._genIntervalAggregates('outTemp', aggregate_type, spans, cursor))
+                        self.assertEqual(len(bucket_results), len(interval_results))
+                        for (bucket, ival) in zip(bucket_results, interval_results):
+                            self.assertEqual(bucket[0], ival[0])
+                            self.assertAlmostEqual(bucket[1][0], ival[1][0])
+                            self.assertEqual(bucket[1][1:], tuple(ival[1][1:]))
+
+            # The missing windSpeed should produce no data, except for a count:
+            vec = archive.getSqlVectors((start_ts, stop_ts), 'windSpeed', aggregate_type='max', aggregate_interval=6*interval)
+            self.assertEqual(vec[2][0], [])
+            vec = archive.getSqlVectors((start_ts, stop_ts), 'windSpeed', aggregate_type='count', aggregate_interval=6*interval)
+            self.assertEqual(vec[2][0], [0] * (nrecs / 6))
+
+    def test_day_cache(self):
+        with weewx.manager.DaySummaryManager.open_with_create(self.archive_db_dict, schema=archive_schema) as archive:
+            # Add the records one at a time, so the in-memory summary gets
+            # carried over from record to record, and across midnight
+            for irec in range(nrecs - 2):
+                archive.addRecord(expected_record(irec))
+            # Add a record through a different manager. This manager should notice.
+            with weewx.manager.DaySummaryManager.open(self.archive_db_dict) as other:
+                other.addRecord(expected_record(nrecs - 2))
+            archive.addRecord(expected_record(nrecs - 1))
+
+            # Build the expected summaries from scratch, and compare:
+            expected = {}
+            for rec in genRecords():
+                sod_ts = weeutil.weeutil.startOfArchiveDay(rec['dateTime'])
+                if sod_ts not in expected:
+                    expected[sod_ts] = weewx.accum.Accum(weeutil.weeutil.archiveDaySpan(sod_ts, 0))
+                expected[sod_ts].addRecord(rec, weight=60.0 * interval)
+            for sod_ts in expected:
+                day_summary = archive._get_day_summary(sod_ts)
+                for obs_type in ('barometer', 'inTemp', 'outTemp'):
+                    self.assertEqual(day_summary[obs_type].getStatsTuple(), expected[sod_ts][obs_type].getStatsTuple())
+            self.assertEqual(archive._read_metadata('lastUpdate'), str(timefunc(nrecs - 1)))
+
+    def test_accumulators(self):
+        # The highs and lows seen in LOOP packets, for two of the records:
+        accumulators = []
+        for (irec, outTemp) in [(10, 200.0), (30, -50.0)]:
+            accum = weewx.accum.Accum(weeutil.weeutil.TimeSpan(timefunc(irec) - interval, timefunc(irec)))
+            accum.addRecord({'dateTime' : timefunc(irec) - 60, 'usUnits' : 1, 'outTemp' : outTemp})
+            accumulators.append(accum)
+        with weewx.manager.DaySummaryManager.open_with_create(self.archive_db_dict, schema=archive_schema) as archive:
+            # All the records in one go, each with its accumulator:
+            archive.addRecord([expected_record(irec) for irec in range(nrecs)], accumulator=accumulators)
+            day_summary = archive._get_day_summary(weeutil.weeutil.startOfArchiveDay(timefunc(10)))
+            self.assertEqual(day_summary['outTemp'].max, 200.0)
+            self.assertEqual(day_summary['outTemp'].maxtime, timefunc(10) - 60)
+            day_summary = archive._get_day_summary(weeutil.weeutil.startOfArchiveDay(timefunc(30)))
+            self.assertEqual(day_summary['outTemp'].min, -50.0)
+            self.assertEqual(day_summary['outTemp'].mintime, timefunc(30) - 60)
+
+    def test_day_layout(self):
+        aggregate_types = ['min', 'max', 'mintime', 'maxtime', 'sum', 'count', 'avg', 'meanmax', 'max_ge']
+        spans = [weeutil.weeutil.TimeSpan(start_ts - 24 * interval, start_ts + 24 * interval),
+                 weeutil.weeutil.archiveDaySpan(start_ts + 2 * interval)]
+        with weewx.manager.DaySummaryManager.open_with_create(self.archive_db_dict, schema=archive_schema) as archive:
+            archive.addRecord([expected_record(irec) for irec in range(nrecs - 4)])
+            self.assertEqual(archive.day_layout, 'separate')
+            expected = [archive.getAggregate(span, obs_type, aggregate_type, val=(68.5, 'degree_F'))
+                        for span in spans for obs_type in ('outTemp', 'barometer') for aggregate_type in aggregate_types]
+            ndays = len(list(archive.genSql("SELECT dateTime FROM archive_day_outTemp")))
+
+            self.assertEqual(archive.convert_day_layout('wide'), ndays)
+            self.assertEqual(archive.day_layout, 'wide')
+            self.assertEqual(sorted(archive.connection.tables()), ['archive', 'archive_day__metadata', 'archive_day__wide'])
+            self.assertEqual(sorted(archive.daykeys), ['barometer', 'inTemp', 'outTemp', 'windSpeed'])
+            self.assertEqual(archive.day_columns['outTemp'],
+                             ['min', 'mintime', 'max', 'maxtime', 'sum', 'count', 'wsum', 'sumtime'])
+            results = [archive.getAggregate(span, obs_type, aggregate_type, val=(68.5, 'degree_F'))
+                       for span in spans for obs_type in ('outTemp', 'barometer') for aggregate_type in aggregate_types]
+            self.assertEqual(results, expected)
+
+            # Add the rest of the records in the wide layout, one of them through a
+            # new manager, then go back:
+            archive.addRecord(expected_record(nrecs - 4))
+            with weewx.manager.DaySummaryManager.open(self.archive_db_dict) as other:
+                self.assertEqual(other.day_layout, 'wide')
+                other.addRecord(expected_record(nrecs - 3))
+            archive.addRecord([expected_record(irec) for irec in range(nrecs - 2, nrecs)])
+            self.assertEqual(archive.convert_day_layout('separate'), ndays)
+            self.assertEqual(archive.day_layout, 'separate')
+            self.assertEqual(archive.convert_day_layout('separate'), 0)
+
+        # The result should be the same as if the records had been added in the usual layout:
+        wide_results = []
+        with weewx.manager.DaySummaryManager.open(self.archive_db_dict) as archive:
+            for sod_ts in [weeutil.weeutil.startOfArchiveDay(timefunc(irec)) for irec in (0, 1, nrecs - 1)]:
+                wide_results.append(archive._get_day_summary(sod_ts))
+        weedb.drop(self.archive_db_dict)
+        with weewx.manager.DaySummaryManager.open_with_create(self.archive_db_dict, schema=archive_schema) as archive:
+            archive.addRecord(genRecords())
+            for (irec, day_summary) in zip((0, 1, nrecs - 1), wide_results):
+                expected_summary = archive._get_day_summary(weeutil.weeutil.startOfArchiveDay(timefunc(irec)))
+                for obs_type in archive.daykeys:
+                    self.assertEqual(day_summary[obs_type].getStatsTuple(), expected_summary[obs_type].getStatsTuple())
+
+    def test_hourly(self):
+        with weewx.manager.DaySummaryManager.open_with_create(self.archive_db_dict, schema=archive_schema) as archive:
+            # Hourly summaries are kept only if asked for:
+            self.assertTrue(archive.hour_columns is None)
+            self.assertTrue(archive.enable_hourly_summaries())
+            self.assertFalse(archive.enable_hourly_summaries())
+            # Created with an empty archive, so all hours are covered:
+            self.assertEqual(archive.hourly_start, 0)
+            self.assertEqual(sorted(archive.hourkeys), sorted(archive.daykeys))
+            archive.addRecord([expected_record(irec) for irec in range(nrecs - 4)])
+            for irec in range(nrecs - 4, nrecs):
+                archive.addRecord(expected_record(irec))
+            for span in [weeutil.weeutil.TimeSpan(start_ts + 5 * interval, start_ts + 30 * interval),
+                         weeutil.weeutil.TimeSpan(start_ts + 20 * interval, stop_ts)]:
+                self.assertTrue(archive._use_hours(span, 'outTemp', 'max'))
+                for aggregate_type in ['min', 'max', 'mintime', 'maxtime', 'sum', 'count', 'avg']:
+                    self.assertAlmostEqual(archive.getAggregate(span, 'outTemp', aggregate_type)[0],
+                                           weewx.manager.Manager.getAggregate(archive, span, 'outTemp', aggregate_type)[0])
+            hours = list(archive.genSql("SELECT * FROM archive_day__hourly"))
+            self.assertEqual(len(hours), nrecs)
+
+            # The first record, at midnight, belongs to the day before:
+            rebuild_d = datetime.date.fromtimestamp(start_ts - 1)
+
+            # A rebuild should give the same hourly summaries:
+            with weedb.Transaction(archive.connection) as cursor:
+                cursor.execute("DELETE FROM archive_day__hourly")
+            archive.backfill_day_summary(start_d=rebuild_d, progress_fn=None)
+            self.assertEqual(list(archive.genSql("SELECT * FROM archive_day__hourly")), hours)
+            # ... as should one done by several processes:
+            with weedb.Transaction(archive.connection) as cursor:
+                cursor.execute("DELETE FROM archive_day__hourly")
+            archive.backfill_day_summary(start_d=rebuild_d, progress_fn=None, processes=2)
+            self.assertEqual(list(archive.genSql("SELECT * FROM archive_day__hourly")), hours)
+            # The workers make hourly statistics only if they are wanted:
+            worker_args = (self.archive_db_dict, 'archive', True, weeutil.weeutil.startOfDay(start_ts - 1),
+                           weeutil.weeutil.startOfDay(stop_ts) + 86400, [])
+            self.assertEqual(weewx.manager._backfill_worker(worker_args + (False,))[3], [])
+            self.assertEqual(len(weewx.manager._backfill_worker(worker_args + (True,))[3]), nrecs)
+
+        # Add hourly summaries to a database that does not have them. They cover
+        # only the hours after the last record until the daily summaries are rebuilt.
+        with weewx.manager.DaySummaryManager.open(self.archive_db_dict) as archive:
+            with weedb.Transaction(archive.connection) as cursor:
+                cursor.execute("DROP TABLE archive_day__hourly")
+        with weewx.manager.DaySummaryManager.open_with_create(self.archive_db_dict, schema=archive_schema) as archive:
+            self.assertTrue(archive.hour_columns is None)
+            archive.enable_hourly_summaries()
+            self.assertEqual(archive.hourly_start, stop_ts)
+            self.assertFalse(archive._use_hours(weeutil.weeutil.TimeSpan(start_ts + 5 * interval, start_ts + 30 * interval),
+                                                'outTemp', 'max'))
+            archive.backfill_day_summary(start_d=rebuild_d, progress_fn=None)
+            self.assertEqual(archive.hourly_start, time.mktime(rebuild_d.timetuple()))
+            self.assertEqual(list(archive.genSql("SELECT * FROM archive_day__hourly")), hours)
+
+    def test_hybrid_avg(self):
+        # With records of different intervals, an average over a span that does not
+        # start at midnight is still the plain average of the records:
+        with weewx.manager.DaySummaryManager.open_with_create(self.archive_db_dict, schema=archive_schema) as archive:
+            archive.addRecord([dict(expected_record(irec), interval=interval / (irec % 3 + 1)) for irec in range(nrecs)])
+            span = weeutil.weeutil.TimeSpan(start_ts + interval / 2, stop_ts)
+            self.assertEqual([_source for (_source, _span) in archive._plan_aggregate(span, 'outTemp', 'avg')],
+                             ['archive', 'day'])
+            self.assertAlmostEqual(archive.getAggregate(span, 'outTemp', 'avg')[0],
+                                   weewx.manager.Manager.getAggregate(archive, span, 'outTemp', 'avg')[0])
+
     def test_update(self):
         # Add a bunch of records
         self.populate_database()
@@ -229,6 +471,329 @@ class Common(unittest.TestCase):
             rec = archive.getRecord(expected_rec['dateTime'])
         self.assertEqual(rec['outTemp'], -1.0)
 
+    def test_extremum_times(self):
+        self.populate_database()
+        span = weeutil.weeutil.TimeSpan(start_ts, stop_ts)
+        with weewx.manager.Manager.open(self.archive_db_dict) as archive:
+            # The temperature only goes up. The first record falls outside the span.
+            self.assertEqual(archive.getAggregate(span, 'outTemp', 'mintime')[0], timefunc(1))
+            self.assertEqual(archive.getAggregate(span, 'outTemp', 'maxtime')[0], stop_ts)
+            self.assertEqual(archive.getAggregate(span, 'outTemp', 'last')[0], temperfunc(nrecs - 1))
+            self.assertEqual(archive.getAggregate(span, 'outTemp', 'lasttime')[0], stop_ts)
+            # For ties, the earliest record wins:
+            archive.updateValue(timefunc(10), 'outTemp', temperfunc(nrecs - 1))
+            archive.updateValue(timefunc(20), 'outTemp', temperfunc(0))
+            self.assertEqual(archive.getAggregate(span, 'outTemp', 'maxtime')[0], timefunc(10))
+            self.assertEqual(archive.getAggregate(span, 'outTemp', 'mintime')[0], timefunc(20))
+            # A null last value is skipped:
+            archive.updateValue(stop_ts, 'outTemp', None)
+            self.assertEqual(archive.getAggregate(span, 'outTemp', 'last')[0], temperfunc(nrecs - 2))
+            self.assertEqual(archive.getAggregate(span, 'outTemp', 'lasttime')[0], timefunc(nrecs - 2))
+            # There is no wind speed at all:
+            for aggregate_type in ['mintime', 'maxtime', 'last', 'lasttime']:
+                self.assertEqual(archive.getAggregate(span, 'windSpeed', aggregate_type)[0], None)
+
+    def test_aggregate_cache(self):
+        day1 = weeutil.weeutil.TimeSpan(start_ts, start_ts + 24 * interval)
+        day2 = weeutil.weeutil.TimeSpan(start_ts + 24 * interval, start_ts + 36 * interval)
+        with weewx.manager.DaySummaryManager.open_with_create(self.archive_db_dict, schema=archive_schema) as archive:
+            cache = archive.enable_aggregate_cache(max_entries=4)
+            archive.addRecord([expected_record(irec) for irec in range(nrecs - 1)])
+            max1 = archive.getAggregate(day1, 'outTemp', 'max')
+            self.assertEqual(archive.getAggregate(day1, 'outTemp', 'max'), max1)
+            self.assertEqual((cache.hits, cache.misses), (1, 1))
+            # A different option is a different result:
+            archive.getAggregate(day1, 'outTemp', 'max_ge', val=(70.0, 'degree_F', 'group_temperature'))
+            self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+            # A new record leaves results for closed timespans alone, but not
+            # those for the open one, nor for the day it falls in:
+            open_span = weeutil.weeutil.TimeSpan(start_ts, start_ts + nrecs * interval)
+            count = archive.getAggregate(open_span, 'outTemp', 'count')
+            archive.getAggregate(day2, 'outTemp', 'max')
+            archive.addRecord(expected_record(nrecs - 1))
+            cache.hits = cache.misses = 0
+            self.assertEqual(archive.getAggregate(day1, 'outTemp', 'max'), max1)
+            self.assertEqual(archive.getAggregate(open_span, 'outTemp', 'count')[0], count[0] + 1)
+            archive.getAggregate(day2, 'outTemp', 'max')
+            self.assertEqual((cache.hits, cache.misses), (1, 2))
+            self.assertEqual(len(cache), 4)
+
+            # So does a change of a value:
+            archive.updateValue(timefunc(3), 'outTemp', 200.0)
+            self.assertEqual(len(cache), 1)
+            archive.getAggregate(day1, 'outTemp', 'max')
+            self.assertEqual((cache.hits, cache.misses), (1, 3))
+
+            # The least recently used result is dropped first:
+            for aggregate_type in ['min', 'avg', 'count']:
+                archive.getAggregate(day2, 'outTemp', aggregate_type)
+            self.assertEqual(len(cache), 4)
+            self.assertFalse((day2.start, day2.stop, 'outTemp', 'max', ()) in cache.entries)
+            self.assertTrue((day1.start, day1.stop, 'outTemp', 'max', ()) in cache.entries)
+
+            # A call made directly to a specific version does not use the cache, but
+            # getAggregates() does:
+            cache.hits = cache.misses = 0
+            weewx.manager.Manager.getAggregate(archive, day1, 'outTemp', 'max')
+            self.assertEqual((cache.hits, cache.misses), (0, 0))
+            results = archive.getAggregates(day1, [('outTemp', 'max'), ('outTemp', 'min'), ('barometer', 'avg')])
+            self.assertEqual(results[('outTemp', 'max')], archive.getAggregate(day1, 'outTemp', 'max'))
+            self.assertEqual((cache.hits, cache.misses), (2, 2))
+            self.assertEqual(archive.getAggregates(day1, [('outTemp', 'min'), ('barometer', 'avg')]),
+                             {('outTemp', 'min'): results[('outTemp', 'min')],
+                              ('barometer', 'avg'): results[('barometer', 'avg')]})
+            self.assertEqual((cache.hits, cache.misses), (4, 2))
+
+        # Changes made to the daily summaries by another manager are noticed by refresh():
+        weedb.drop(self.archive_db_dict)
+        with weewx.manager.DaySummaryManager.open_with_create(self.archive_db_dict, schema=archive_schema) as archive:
+            cache = archive.enable_aggregate_cache()
+            archive.addRecord([expected_record(irec) for irec in range(nrecs - 1) if irec != 3])
+            max1 = archive.getAggregate(day1, 'outTemp', 'max')
+            archive.getAggregate(day2, 'outTemp', 'max')
+            with weewx.manager.DaySummaryManager.open(self.archive_db_dict) as other:
+                # Records added after the last ones leave results for the days before alone:
+                other.addRecord(expected_record(nrecs - 1))
+                archive.refresh()
+                cache.hits = cache.misses = 0
+                self.assertEqual(archive.getAggregate(day1, 'outTemp', 'max'), max1)
+                archive.getAggregate(day2, 'outTemp', 'max')
+                self.assertEqual((cache.hits, cache.misses), (1, 1))
+                # Others do not:
+                other.addRecord(dict(expected_record(3), outTemp=200.0))
+                # ... but until then, a cached result is used without asking the database:
+                self.assertEqual(archive.getAggregate(day1, 'outTemp', 'max'), max1)
+                archive.refresh()
+                self.assertEqual(archive.getAggregate(day1, 'outTemp', 'max')[0], 200.0)
+                self.assertEqual(len(cache), 1)
+
+
+    def test_hot_window(self):
+        self.populate_database()
+        with weewx.manager.Manager.open(self.archive_db_dict) as archive:
+            with weewx.manager.Manager.open(self.archive_db_dict) as hot_archive:
+                # Hold the last day. Because the first record, at midnight, belongs to the
+                # day before, the window starts after the 24th record.
+                window = hot_archive.enable_hot_window(days=1)
+                self.assertEqual(window.start_ts, timefunc(24))
+                self.assertEqual(len(window), nrecs - 25)
+
+                for span in [weeutil.weeutil.TimeSpan(timefunc(24), stop_ts),
+                             weeutil.weeutil.TimeSpan(timefunc(30), timefunc(40))]:
+                    self.assertTrue(window.covers(span.start))
+                    self.assertEqual(list(hot_archive.genBatchRecords(*span)), list(archive.genBatchRecords(*span)))
+                    for aggregate_type in ['sum', 'count', 'avg', 'max', 'min', 'mintime', 'maxtime', 'last', 'lasttime']:
+                        self.assertEqual(hot_archive.getAggregate(span, 'outTemp', aggregate_type),
+                                         archive.getAggregate(span, 'outTemp', aggregate_type))
+                    self.assertEqual(hot_archive.getSqlVectors(span, 'barometer'),
+                                     archive.getSqlVectors(span, 'barometer'))
+                    self.assertEqual(hot_archive.getSqlVectors(span, 'outTemp', 'max', 4 * interval),
+                                     archive.getSqlVectors(span, 'outTemp', 'max', 4 * interval))
+                # The window does not hold the start of this one:
+                self.assertFalse(window.covers(timefunc(23)))
+                span = weeutil.weeutil.TimeSpan(timefunc(20), stop_ts)
+                self.assertEqual(hot_archive.getAggregate(span, 'outTemp', 'min'),
+                                 archive.getAggregate(span, 'outTemp', 'min'))
+
+                # New and changed records. A new day moves the window along.
+                hot_archive.updateValue(timefunc(30), 'outTemp', None)
+                self.assertEqual(hot_archive.getRecord(timefunc(30))['outTemp'], None)
+                self.assertEqual(list(hot_archive.genBatchRecords(timefunc(29), timefunc(30)))[0]['outTemp'], None)
+                hot_archive.addRecord([expected_record(irec) for irec in range(nrecs, nrecs + 3)])
+                self.assertEqual(window.start_ts, timefunc(48))
+                self.assertEqual(len(window), 2)
+                self.assertEqual(list(hot_archive.genBatchRecords(timefunc(48))),
+                                 list(archive.genBatchRecords(timefunc(48))))
+
+            # No more than the given size:
+            with weewx.manager.Manager.open(self.archive_db_dict) as hot_archive:
+                window = hot_archive.enable_hot_window(days=10, max_size=8 * len(archive.sqlkeys) * 5)
+                self.assertEqual(len(window), 5)
+                self.assertEqual(window.start_ts, timefunc(nrecs - 3))
+                self.assertEqual(list(hot_archive.genBatchRecords(timefunc(nrecs - 3))),
+                                 list(archive.genBatchRecords(timefunc(nrecs - 3))))
+
+        # Only managers that stay open hold the records, and only numeric columns:
+        manager_dict = {'manager': 'weewx.manager.Manager', 'table_name': 'archive', 'schema': None,
+                        'database_dict': self.archive_db_dict, 'hot_window_days': '1'}
+        with weewx.manager.open_manager(manager_dict) as archive:
+            self.assertTrue(archive.hot_window is None)
+        with weewx.manager.open_manager(manager_dict, persistent=True) as archive:
+            self.assertEqual(archive.hot_window.start_ts, timefunc(nrecs))
+        self.assertRaises(weewx.ViolatedPrecondition, weewx.manager.HotWindow,
+                          [('dateTime', 'INTEGER'), ('station', 'STR')])
+
+    def test_snapshot(self):
+        self.populate_database()
+        with weewx.manager.Manager.open(self.archive_db_dict) as archive:
+            self.assertEqual(archive.save_snapshot(snapshot_path), nrecs)
+            with weewx.manager.Manager.open(self.archive_db_dict) as snapshot_archive:
+                snapshot = snapshot_archive.attach_snapshot(snapshot_path)
+                self.assertEqual(len(snapshot), nrecs)
+                self.assertEqual(snapshot.stop_ts, stop_ts)
+
+                for span in [weeutil.weeutil.TimeSpan(start_ts - interval, stop_ts),
+                             weeutil.weeutil.TimeSpan(timefunc(3), timefunc(40))]:
+                    self.assertTrue(snapshot.covers(span.start, stop_ts=span.stop))
+                    self.assertEqual(list(snapshot_archive.genBatchRecords(*span)),
+                                     list(archive.genBatchRecords(*span)))
+                    for aggregate_type in ['sum', 'count', 'avg', 'max', 'min', 'mintime', 'maxtime', 'last', 'lasttime']:
+                        # Column windSpeed is all nulls:
+                        for obs_type in ['outTemp', 'windSpeed', 'interval']:
+                            result = snapshot_archive.getAggregate(span, obs_type, aggregate_type)
+                            expected = archive.getAggregate(span, obs_type, aggregate_type)
+                            self.assertEqual(type(result[0]), type(expected[0]))
+                            self.assertAlmostEqual(result[0], expected[0])
+                            self.assertEqual(result[1:], expected[1:])
+                    self.assertEqual(snapshot_archive.getSqlVectors(span, 'barometer'),
+                                     archive.getSqlVectors(span, 'barometer'))
+                    for aggregate_type in ['sum', 'count', 'avg', 'max', 'min', 'last']:
+                        (start_vec, stop_vec, data_vec) = snapshot_archive.getSqlVectors(span, 'outTemp',
+                                                                                         aggregate_type, 5 * interval)
+                        (expected_start, expected_stop, expected_data) = archive.getSqlVectors(span, 'outTemp',
+                                                                                               aggregate_type,
+                                                                                               5 * interval)
+                        self.assertEqual((start_vec, stop_vec), (expected_start, expected_stop))
+                        self.assertEqual(data_vec[1:], expected_data[1:])
+                        for (result, expected) in zip(data_vec[0], expected_data[0]):
+                            self.assertAlmostEqual(result, expected)
+                for timestamp in [timefunc(10), timefunc(10) - 1, timefunc(10) + interval / 2, start_ts - 60]:
+                    self.assertEqual(snapshot_archive.getRecord(timestamp, interval / 2),
+                                     archive.getRecord(timestamp, interval / 2))
+
+                # Beyond the snapshot, the database is used:
+                archive.addRecord(expected_record(nrecs))
+                snapshot_archive._sync()
+                span = weeutil.weeutil.TimeSpan(timefunc(40), timefunc(nrecs))
+                self.assertFalse(snapshot.covers(span.start, stop_ts=span.stop))
+                self.assertEqual(snapshot_archive.getAggregate(span, 'outTemp', 'max')[0], temperfunc(nrecs))
+                self.assertEqual(snapshot_archive.getRecord(timefunc(nrecs)), archive.getRecord(timefunc(nrecs)))
+        os.remove(snapshot_path)
+
+    def test_partitions(self):
+        # Records every 6 hours, from late 2011 into 2013
+        first_ts = int(time.mktime((2011, 12, 20, 0, 0, 0, 0, 0, -1)))
+        partition_vec = range(first_ts, int(time.mktime((2013, 1, 10, 0, 0, 0, 0, 0, -1))), 6 * 3600)
+        def partition_record(ts):
+            return {'dateTime' : ts, 'interval' : 360, 'usUnits' : 1, 'outTemp' : (ts / 3600) % 97 - 20.0,
+                    'barometer' : 30.0, 'windSpeed' : None if (ts / 3600) % 5 else 1.0}
+        year_2012 = weeutil.weeutil.TimeSpan(int(time.mktime((2012, 1, 1, 0, 0, 0, 0, 0, -1))),
+                                             int(time.mktime((2013, 1, 1, 0, 0, 0, 0, 0, -1))))
+        spans = [weeutil.weeutil.TimeSpan(partition_vec[0], partition_vec[-1]),
+                 weeutil.weeutil.TimeSpan(year_2012.start - 24 * 3600, year_2012.start + 24 * 3600),
+                 weeutil.weeutil.TimeSpan(year_2012.start + 24 * 3600, year_2012.start + 48 * 3600),
+                 year_2012]
+        def results(archive):
+            return ([archive.getAggregate(span, obs_type, aggregate_type)
+                     for span in spans for obs_type in ('outTemp', 'windSpeed')
+                     for aggregate_type in ('sum', 'count', 'max', 'mintime', 'last', 'lasttime')],
+                    [archive.getSqlVectors(span, 'outTemp', 'max', 7 * 24 * 3600) for span in spans],
+                    [list(archive.genBatchRows(span.start, span.stop)) for span in spans],
+                    archive.getRecord(year_2012.start), archive.getRecord(year_2012.start + 60, 3600),
+                    archive.first_timestamp, archive.last_timestamp)
+
+        with weewx.manager.Manager.open_with_create(self.archive_db_dict, schema=archive_schema) as archive:
+            archive.addRecord([partition_record(ts) for ts in partition_vec])
+            expected = results(archive)
+            self.assertEqual(archive.partition_archive(), 3)
+            self.assertEqual(archive.partitions, [2011, 2012, 2013])
+            self.assertFalse('archive' in archive.connection.tables())
+            self.assertEqual(results(archive), expected)
+            # The view can still be read:
+            self.assertEqual(archive.getSql("SELECT COUNT(*) FROM archive")[0], len(partition_vec))
+
+        with weewx.manager.Manager.open(self.archive_db_dict) as archive:
+            self.assertEqual(archive.partitions, [2011, 2012, 2013])
+            self.assertEqual(results(archive), expected)
+            # A new year gets a new partition. Only the newest two can be changed.
+            next_ts = int(time.mktime((2014, 1, 5, 0, 0, 0, 0, 0, -1)))
+            archive.addRecord(partition_record(next_ts))
+            self.assertEqual(archive.partitions, [2011, 2012, 2013, 2014])
+            self.assertEqual(archive.last_timestamp, next_ts)
+            self.assertEqual(archive.getRecord(next_ts)['outTemp'], partition_record(next_ts)['outTemp'])
+            archive.updateValue(partition_vec[-1], 'outTemp', 100.0)
+            self.assertEqual(archive.getRecord(partition_vec[-1])['outTemp'], 100.0)
+            self.assertRaises(weedb.IntegrityError, archive.updateValue, year_2012.start, 'outTemp', 100.0)
+            archive.addRecord(partition_record(year_2012.start + 60))
+            self.assertEqual(archive.getRecord(year_2012.start + 60), None)
+            # A new partition is made before the records go in, so it outlasts a failed transaction:
+            next_ts = int(time.mktime((2015, 1, 5, 0, 0, 0, 0, 0, -1)))
+            self.assertRaises(weewx.UnitError, archive.addRecord,
+                              [partition_record(next_ts), dict(partition_record(next_ts + 3600), usUnits=16)])
+            self.assertEqual(archive.partitions, [2011, 2012, 2013, 2014, 2015])
+            self.assertTrue('archive__2015' in archive.connection.tables())
+            self.assertEqual(archive.getRecord(next_ts), None)
+            # Older records can be added to a partition made for them, until another one is added:
+            old_ts = int(time.mktime((2009, 6, 1, 0, 0, 0, 0, 0, -1)))
+            archive.addRecord([partition_record(old_ts), partition_record(old_ts + 3600)])
+            self.assertEqual(archive.partitions, [2009, 2011, 2012, 2013, 2014, 2015])
+            self.assertEqual(archive.getRecord(old_ts)['outTemp'], partition_record(old_ts)['outTemp'])
+            archive.addRecord(partition_record(old_ts + 7200))
+            self.assertEqual(archive.getRecord(old_ts + 7200)['outTemp'], partition_record(old_ts + 7200)['outTemp'])
+            archive.addRecord(partition_record(int(time.mktime((2010, 6, 1, 0, 0, 0, 0, 0, -1)))))
+            self.assertEqual(archive.partitions, [2009, 2010, 2011, 2012, 2013, 2014, 2015])
+            self.assertRaises(weedb.IntegrityError, archive.updateValue, old_ts, 'outTemp', 100.0)
+
+    def test_manager_pool(self):
+        self.populate_database()
+        config_dict = {'DataBindings' : {'test_binding' : {'database' : 'test_db',
+                                                           'table_name' : 'archive',
+                                                           'manager' : 'weewx.manager.Manager'},
+                                         'test_binding2' : {'database' : 'test_db',
+                                                            'table_name' : 'archive',
+                                                            'manager' : 'weewx.manager.Manager'}},
+                       'Databases' : {'test_db' : self.archive_db_dict}}
+        with weewx.manager.Manager.open(self.archive_db_dict) as archive:
+            with weewx.manager.ManagerPool(config_dict, max_size=1, timeout=0.1) as pool:
+                reader = pool.checkout('test_binding', read_only=True)
+                self.assertEqual(reader.last_timestamp, stop_ts)
+                # No more than one manager can be open, for another thread:
+                errors = []
+                def wait():
+                    try:
+                        pool.checkout('test_binding', read_only=True)
+                    except weedb.OperationalError, e:
+                        errors.append(e)
+                _thread = threading.Thread(target=wait)
+                _thread.start()
+                _thread.join()
+                self.assertEqual(len(errors), 1)
+                pool.checkin(reader)
+
+                # Another thread gets the same manager, and sees the record added meanwhile
+                archive.addRecord(expected_record(nrecs))
+                results = []
+                def check():
+                    _reader = pool.checkout('test_binding', read_only=True)
+                    results.append((_reader is reader, _reader.last_timestamp,
+                                    _reader.getRecord(timefunc(nrecs))['outTemp']))
+                    pool.checkin(_reader)
+                _thread = threading.Thread(target=check)
+                _thread.start()
+                _thread.join()
+                self.assertEqual(results, [(True, timefunc(nrecs), temperfunc(nrecs))])
+
+                # A binder gives back what it takes from the pool
+                with weewx.manager.DBBinder(config_dict, read_only=True, pool=pool) as binder:
+                    self.assertTrue(binder.get_manager('test_binding') is reader)
+                    # A thread that holds a manager does not wait for another...
+                    writer = binder.get_manager('test_binding2')
+                    self.assertEqual(pool.size, 2)
+                # ... which gets closed, because the pool is over its maximum size
+                self.assertEqual((pool.in_use, pool.holders, pool.size), ({}, {}, 1))
+
+                # The idle reader gets closed, to make room for a writer
+                writer = pool.checkout('test_binding')
+                self.assertFalse(writer is reader)
+                self.assertEqual(pool.size, 1)
+                pool.checkin(writer)
+                # ... which gets closed once it has been idle long enough
+                pool.max_idle = -1
+                reader = pool.checkout('test_binding', read_only=True)
+                self.assertEqual(pool.idle, {('test_binding', True) : [], ('test_binding', False) : []})
+                pool.checkin(reader, discard=True)
+                self.assertEqual((pool.size, pool.opened, pool.reused), (0, 4, 2))
 
 class TestSqlite(Common):
 
@@ -246,7 +811,10 @@ class TestMySQL(Common):
     
 def suite():
     tests = ['test_no_archive', 'test_create_archive', 
-             'test_empty_archive', 'test_add_archive_records', 'test_get_records', 'test_update']
+             'test_empty_archive', 'test_add_archive_records', 'test_add_batch', 'test_get_records',
+             'test_bucket_aggregates', 'test_day_cache', 'test_accumulators', 'test_day_layout', 'test_hourly', 'test_hybrid_avg',
+             'test_update', 'test_extremum_times', 'test_aggregate_cache', 'test_hot_window',
+             'test_snapshot', 'test_partitions', 'test_manager_pool']
     return unittest.TestSuite(map(TestSqlite, tests) + map(TestMySQL, tests))
             
 if __name__ == '__main__':
@@ -0,0 +1,142 @@
+#
+#    Copyright (c) 2009-2015 Tom Keffer <tkeffer@gmail.com>
+#
+#    See the file LICENSE.txt for your full rights.
+#
+"""Test the archive writer of module weewx.engine"""
+from __future__ import with_statement
+import threading
+import time
+import unittest
+
+import weedb
+import weewx.accum
+import weewx.engine
+import weewx.manager
+import weeutil.weeutil
+
+archive_sqlite = {'database_name': '/var/tmp/weewx_test/engine.sdb', 'driver': 'weedb.sqlite'}
+
+archive_schema = [('dateTime',             'INTEGER NOT NULL UNIQUE PRIMARY KEY'),
+                  ('usUnits',              'INTEGER NOT NULL'),
+                  ('interval',             'INTEGER NOT NULL'),
+                  ('outTemp',              'REAL')]
+
+interval = 300
+start_ts = int(time.mktime((2012, 07, 01, 00, 00, 0, 0, 0, -1))) # 1 July 2012
+timevec = [start_ts + (i + 1) * interval for i in range(10)]
+
+def archive_record(ts):
+    return {'dateTime': ts, 'usUnits': 1, 'interval': interval / 60, 'outTemp': 60.0}
+
+def archive_accumulator(ts, temperature):
+    """An accumulator for the archive period ending at ts, which saw a LOOP
+    packet with the given temperature."""
+    accumulator = weewx.accum.Accum(weeutil.weeutil.TimeSpan(ts - interval, ts))
+    accumulator.addRecord({'dateTime': ts - 60, 'usUnits': 1, 'outTemp': temperature})
+    return accumulator
+
+class ArchiveWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        try:
+            weedb.drop(archive_sqlite)
+        except weedb.NoDatabaseError:
+            pass
+        with weewx.manager.DaySummaryManager.open_with_create(archive_sqlite, schema=archive_schema):
+            pass
+        self.config_dict = {'DataBindings': {'wx_binding': {'database': 'test_db',
+                                                            'table_name': 'archive',
+                                                            'manager': 'weewx.manager.DaySummaryManager'}},
+                            'Databases': {'test_db': archive_sqlite}}
+
+    def tearDown(self):
+        try:
+            weedb.drop(archive_sqlite)
+        except weedb.NoDatabaseError:
+            pass
+
+    def test_write(self):
+        writer = weewx.engine.ArchiveWriter(self.config_dict, 'wx_binding', queue_size=len(timevec))
+        # Records queued before the writer gets to them go in together, each
+        # with the accumulator of its own archive period:
+        for (i, ts) in enumerate(timevec):
+            writer.put(archive_record(ts), archive_accumulator(ts, 70.0 + i))
+        self.assertEqual(writer.last_ts, timevec[-1])
+        writer.start()
+        writer.flush()
+        self.assertEqual((writer.nrecs, writer.ncommits), (len(timevec), 1))
+        with weewx.manager.open_manager_with_config(self.config_dict, 'wx_binding') as archive:
+            self.assertEqual(archive.getSql("SELECT COUNT(*) FROM archive")[0], len(timevec))
+            day = weeutil.weeutil.archiveDaySpan(timevec[0])
+            self.assertEqual(archive.getAggregate(day, 'outTemp', 'max')[0], 70.0 + len(timevec) - 1)
+            self.assertEqual(archive.getAggregate(day, 'outTemp', 'maxtime')[0], timevec[-1] - 60)
+
+        # Records queued after a flush are written as well:
+        next_ts = timevec[-1] + interval
+        writer.put(archive_record(next_ts), archive_accumulator(next_ts, 100.0))
+        writer.flush()
+        self.assertEqual(writer.nrecs, len(timevec) + 1)
+        with weewx.manager.open_manager_with_config(self.config_dict, 'wx_binding') as archive:
+            self.assertEqual(archive.getRecord(next_ts)['outTemp'], 60.0)
+            self.assertEqual(archive.getAggregate(weeutil.weeutil.archiveDaySpan(next_ts), 'outTemp', 'max')[0],
+                             100.0)
+        writer.close()
+        self.assertFalse(writer.isAlive())
+
+    def test_close(self):
+        writer = weewx.engine.ArchiveWriter(self.config_dict, 'wx_binding')
+        writer.start()
+        for ts in timevec:
+            writer.put(archive_record(ts))
+        # Closing the writer writes any records still waiting:
+        writer.close()
+        self.assertFalse(writer.isAlive())
+        self.assertEqual(writer.nrecs, len(timevec))
+        with weewx.manager.open_manager_with_config(self.config_dict, 'wx_binding') as archive:
+            self.assertEqual(archive.getSql("SELECT COUNT(*) FROM archive")[0], len(timevec))
+        # Closing it again does no harm:
+        writer.close()
+
+    def test_retry(self):
+        # The database cannot be opened at first, but can be by the time the writer tries again:
+        weedb.drop(archive_sqlite)
+        writer = weewx.engine.ArchiveWriter(self.config_dict, 'wx_binding', max_tries=3, retry_wait=1)
+        writer.put(archive_record(timevec[0]))
+        writer.start()
+        time.sleep(0.2)
+        with weewx.manager.DaySummaryManager.open_with_create(archive_sqlite, schema=archive_schema):
+            pass
+        writer.flush()
+        self.assertEqual((writer.nrecs, writer.ncommits), (1, 1))
+        writer.close()
+        with weewx.manager.open_manager_with_config(self.config_dict, 'wx_binding') as archive:
+            self.assertEqual(archive.getRecord(timevec[0])['outTemp'], 60.0)
+
+    def test_error(self):
+        # If the records still cannot be added after the last try, the writer stops:
+        weedb.drop(archive_sqlite)
+        writer = weewx.engine.ArchiveWriter(self.config_dict, 'wx_binding', max_tries=2, retry_wait=0)
+        writer.put(archive_record(timevec[0]))
+        writer.start()
+        self.assertRaises(weedb.OperationalError, writer.flush)
+        writer.join(5.0)
+        self.assertFalse(writer.isAlive())
+        self.assertEqual((writer.nrecs, writer.ncommits), (0, 0))
+        # The error is raised again for the records that follow:
+        self.assertRaises(weedb.OperationalError, writer.put, archive_record(timevec[1]))
+        self.assertRaises(weedb.OperationalError, writer.close)
+
+    def test_wait_for_room(self):
+        # A full queue makes put() wait until the writer has taken the records waiting:
+        writer = weewx.engine.ArchiveWriter(self.config_dict, 'wx_binding', queue_size=2, retry_wait=0.1)
+        writer.put(archive_record(timevec[0]))
+        writer.put(archive_record(timevec[1]))
+        threading.Timer(0.2, writer.start).start()
+        writer.put(archive_record(timevec[2]))
+        self.assertEqual(writer.nwaits, 1)
+        writer.close()
+        self.assertEqual(writer.nrecs, 3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+#
+#    Copyright (c) 2009-2015 Tom Keffer <tkeffer@gmail.com>
+#
+#    See the file LICENSE.txt for your full rights.
+#
+"""Test the rain sums of module weewx.restx"""
+from __future__ import with_statement
+import time
+import unittest
+
+import weedb
+import weewx.manager
+import weewx.restx
+
+archive_sqlite = {'database_name': '/var/tmp/weewx_test/restx.sdb', 'driver': 'weedb.sqlite'}
+
+archive_schema = [('dateTime',             'INTEGER NOT NULL UNIQUE PRIMARY KEY'),
+                  ('usUnits',              'INTEGER NOT NULL'),
+                  ('interval',             'INTEGER NOT NULL'),
+                  ('rain',                 'REAL')]
+
+interval = 300
+start_ts = int(time.mktime((2012, 07, 01, 00, 00, 0, 0, 0, -1))) # 1 July 2012
+# An hour of records, each with 0.01 inch of rain:
+timevec = [start_ts + (i + 1) * interval for i in range(12)]
+
+def archive_record(ts, rain=0.01, usUnits=1):
+    return {'dateTime': ts, 'usUnits': usUnits, 'interval': interval / 60, 'rain': rain}
+
+class SumRainTest(unittest.TestCase):
+
+    def setUp(self):
+        try:
+            weedb.drop(archive_sqlite)
+        except weedb.NoDatabaseError:
+            pass
+        self.archive = weewx.manager.Manager.open_with_create(archive_sqlite, schema=archive_schema)
+        self.archive.addRecord([archive_record(ts) for ts in timevec[:-1]])
+
+    def tearDown(self):
+        self.archive.close()
+        try:
+            weedb.drop(archive_sqlite)
+        except weedb.NoDatabaseError:
+            pass
+
+    def test_queued_record(self):
+        # The record has not been written yet. Its rain comes from the record:
+        record = archive_record(timevec[-1], 0.1)
+        self.assertAlmostEqual(weewx.restx.RESTThread._sum_rain(self.archive, record, start_ts, 'hourRain'),
+                               0.21)
+        # The sum is exclusive of the record at the start:
+        self.assertAlmostEqual(weewx.restx.RESTThread._sum_rain(self.archive, record, timevec[5], 'hourRain'),
+                               0.15)
+        # A record without rain adds nothing:
+        record['rain'] = None
+        self.assertAlmostEqual(weewx.restx.RESTThread._sum_rain(self.archive, record, start_ts, 'hourRain'),
+                               0.11)
+        # Nor is there anything in the database before the first record:
+        self.assertEqual(weewx.restx.RESTThread._sum_rain(self.archive, archive_record(start_ts, 0.1),
+                                                          start_ts - 3600, 'hourRain'), 0.1)
+        self.assertEqual(weewx.restx.RESTThread._sum_rain(self.archive, archive_record(start_ts, None),
+                                                          start_ts - 3600, 'hourRain'), None)
+
+    def test_written_record(self):
+        # The record is in the database already. It is not counted twice:
+        record = archive_record(timevec[-1], 0.1)
+        self.archive.addRecord(record)
+        self.assertAlmostEqual(weewx.restx.RESTThread._sum_rain(self.archive, record, start_ts, 'hourRain'),
+                               0.21)
+
+    def test_units(self):
+        record = archive_record(timevec[-1], 0.25, usUnits=16)
+        self.assertRaises(ValueError, weewx.restx.RESTThread._sum_rain, self.archive, record, start_ts, 'hourRain')
+
+if __name__ == '__main__':
+    unittest.main()
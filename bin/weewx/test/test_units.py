@@ -147,6 +147,14 @@ class ValueHelperTest(unittest.TestCase):
         # Now try a 'None' value:
         vh = weewx.units.ValueHelper((None, "second", "group_deltatime"))
         self.assertEqual(vh.string(), "   N/A")
+
+    def testList(self):
+        # Each value of a list, such as a wind rose, is formatted in turn:
+        value_t = ([12.5, None, 87.5], "percent", "group_percent")
+        vh = weewx.units.ValueHelper(value_t)
+        self.assertEqual(str(vh), "12%,    N/A, 88%")
+        self.assertEqual(vh.nolabel("%.1f"), "12.5,    N/A, 87.5")
+        self.assertEqual(vh.raw, [12.5, None, 87.5])
         
 if __name__ == '__main__':
     unittest.main()
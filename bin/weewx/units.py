@@ -621,6 +621,11 @@ class Formatter(object):
                 return NONE_string
             else:
                 return self.unit_format_dict.get('NONE', 'N/A')
+
+        if isinstance(val_t[0], (list, tuple)):
+            # A list of values, such as the sectors of a wind rose. Format each in turn:
+            return ', '.join([self.toString(ValueTuple(val, val_t[1], val_t[2]), context, addLabel,
+                                            useThisFormat, NONE_string, localize) for val in val_t[0]])
             
         if val_t[1] == "unix_epoch":
             # Different formatting routines are used if the value is a time.
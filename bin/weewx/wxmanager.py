@@ -37,6 +37,7 @@ class WXDaySummaryManager(weewx.manager.DaySummaryManager):
         # Now initialize the WX specific tables
         cursor.execute(WXDaySummaryManager.wx_sql_create_str % self.table_name)
         
+    @weewx.manager._cache_aggregate
     def getAggregate(self, timespan, obs_type, aggregateType, **option_dict):
         """Specialized version of getDayAggregate that can calculate heating or cooling degree days.
 
@@ -71,22 +72,26 @@ class WXDaySummaryManager(weewx.manager.DaySummaryManager):
         heatbase_t = (float(heatbase[0]), heatbase[1], "group_temperature") if heatbase else WXDaySummaryManager.default_heatbase
         coolbase_t = (float(coolbase[0]), coolbase[1], "group_temperature") if coolbase else WXDaySummaryManager.default_coolbase
 
-        _sum = 0.0
-        _count = 0
-        for daySpan in weeutil.weeutil.genDaySpans(timespan.start, timespan.stop):
-            # Get the average temperature for the day as a value tuple:
-            Tavg_t = weewx.manager.DaySummaryManager.getAggregate(self, daySpan, 'outTemp', 'avg')
-            # Make sure it's valid before including it in the aggregation:
-            if Tavg_t is not None and Tavg_t[0] is not None:
-                if obs_type == 'heatdeg':
-                    # Convert average temperature to the same units as heatbase:
-                    Tavg_target_t = weewx.units.convert(Tavg_t, heatbase_t[1])
-                    _sum += weewx.wxformulas.heating_degrees(Tavg_target_t[0], heatbase_t[0])
-                else:
-                    # Convert average temperature to the same units as coolbase:
-                    Tavg_target_t = weewx.units.convert(Tavg_t, coolbase_t[1])
-                    _sum += weewx.wxformulas.cooling_degrees(Tavg_target_t[0], coolbase_t[0])
-                _count += 1
+        # Each day adds the amount by which its average temperature falls below (or
+        # rises above) the base. This is calculated for all the days at once from the
+        # daily summaries of outTemp, where the average is wsum/sumtime. The average is
+        # converted to the units of the base by T_base = scale * T + offset. Days that
+        # include any of the timespan are included.
+        if 'outTemp' not in self.daykeys:
+            raise AttributeError, "Unknown daily summary type outTemp"
+        base_t = heatbase_t if obs_type == 'heatdeg' else coolbase_t
+        (t, g) = weewx.units.getStandardUnitType(self.std_unit_system, 'outTemp', 'avg')
+        offset = weewx.units.convert((0.0, t, g), base_t[1])[0]
+        scale = weewx.units.convert((1.0, t, g), base_t[1])[0] - offset
+        Tavg = "(%r * wsum / sumtime + %r)" % (scale, offset)
+        degrees = "%r - %s" % (base_t[0], Tavg) if obs_type == 'heatdeg' else "%s - %r" % (Tavg, base_t[0])
+        start = weeutil.weeutil.startOfDay(timespan.start)
+        _row = self.getSql("SELECT SUM(CASE WHEN %s > 0 THEN %s ELSE 0 END), COUNT(*) FROM %s "
+                           "WHERE dateTime >= ? AND dateTime < ? AND sumtime > 0"
+                           % (degrees, degrees, self._day_table_sql('outTemp', start, timespan.stop)),
+                           (start, timespan.stop))
+        _sum = _row[0] or 0.0
+        _count = _row[1]
 
         if aggregateType == 'sum':
             _result = _sum